@@ -16,6 +16,10 @@ from .model import Model, Fittable, Fitted, FitResult
 from .sample import Sample
 from .solution import Solution
 from .functions import *
+from .cache import *
+from .lookup import *
+from .surrogate import *
+from .adjoint import *
 from .logger import set_log_level
 
 from ._version import __version__
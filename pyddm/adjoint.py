@@ -0,0 +1,392 @@
+# Copyright 2018 Max Shinn <maxwell.shinn@yale.edu>
+#           2018 Norman Lam <norman.lam@yale.edu>
+#
+# This file is part of PyDDM, and is available under the MIT license.
+# Please see LICENSE.txt in the root directory for more information.
+
+__all__ = ["get_model_loss_gradient"]
+
+import numpy as np
+
+from .model import Model, Fittable, _OperatorCache
+from .solution import Solution
+from .models.loss import LossLikelihood, LossBIC
+from .models.overlay import OverlayNone, OverlayChain, OverlayNonDecision, OverlayUniformMixture
+from .functions import _horizon_steps
+from .tridiag import TriDiagMatrix
+
+def get_model_loss_gradient(model, sample, lossfunction=LossLikelihood):
+    """The loss of a model and its gradient with respect to each parameter.
+
+    Like get_model_loss(), but also returns the derivative of the loss
+    with respect to each Fittable parameter of Model `model`, in the
+    same order as Model.get_model_parameters().  The model is solved
+    with the implicit (backward Euler) method in Python, and the
+    gradient with respect to the parameters of the drift, noise, and
+    initial condition is found with a second, reverse pass through the
+    same timesteps (the adjoint method), so it costs about one more
+    solve no matter how many parameters there are.  These derivatives
+    are exact for the discretized model, apart from the rounding in
+    the model's solver.
+
+    The bound and a point source initial condition only change the
+    solution when they cross a grid point, and the non-decision time
+    only when it crosses a timestep, so their derivatives are instead
+    found from the change in the loss over one grid point (dx) or one
+    timestep (dt).  Each bound parameter requires two more solves.  The
+    other parameters of the initial condition and overlay do not need
+    the model to be solved again.
+
+    `lossfunction` must be LossLikelihood, LossRobustLikelihood, LossBIC,
+    or LossRobustBIC, and the overlay must be made of OverlayNone,
+    OverlayNonDecision, and OverlayUniformMixture.  Otherwise, this
+    raises NotImplementedError.
+
+    Returns a tuple of the loss and an ndarray of the gradient.
+    """
+    assert model.choice_names == sample.choice_names, "Model and sample choice names must match"
+    params = model.get_model_parameters()
+    lf = lossfunction(sample, required_conditions=model.required_conditions,
+                      T_dur=model.T_dur, dt=model.dt, method="implicit",
+                      nparams=len(params), samplesize=len(sample))
+    return _loss_gradient(model, lf)
+
+def _unsupported(model, lf):
+    """The reason the gradient of loss function `lf` for `model` cannot be found, or None if it can."""
+    if type(lf).loss not in [LossLikelihood.loss, LossBIC.loss]:
+        return "Gradients are only available for likelihood and BIC loss functions"
+    # Subclasses may override the solvers
+    solvers = ["solve", "_solve", "solve_numerical", "solve_numerical_implicit"]
+    if any(getattr(type(model), s) is not getattr(Model, s) for s in solvers):
+        return "Gradients are not available for models which redefine the solver"
+    if not _overlay_supported(model.get_dependence("overlay")):
+        return "Gradients are only available for the overlays OverlayNone, OverlayNonDecision, and OverlayUniformMixture"
+    return None
+
+def _overlay_supported(overlay):
+    if type(overlay).apply is OverlayChain.apply:
+        return all(_overlay_supported(o) for o in overlay.overlays)
+    return type(overlay).apply in [OverlayNone.apply, OverlayNonDecision.apply, OverlayUniformMixture.apply]
+
+def _loss_gradient(model, lf, robustness=None):
+    """The loss and its gradient for loss function `lf`, which has already been set up.
+
+    See get_model_loss_gradient().  If `robustness` is given, it
+    replaces the robustness parameter of the likelihood in `lf`.
+    """
+    reason = _unsupported(model, lf)
+    if reason is not None:
+        raise NotImplementedError(reason)
+    r = lf._robustness_param if robustness is None else robustness
+    params = model.get_model_parameters()
+    # Each parameter may be used in more than one component
+    owners = [[(dep, name) for dep in model.dependencies for name in dep.required_parameters
+               if getattr(dep, name) is p] for p in params]
+    loss = 0
+    gradient = np.zeros(len(params))
+    for key in lf.hist_counts.keys():
+        conditions = dict(key)
+        horizon = lf.horizons.get(key) if lf.horizons is not None else None
+        n_steps = _horizon_steps(model, conditions, horizon)
+        upper, lower, record = _solve_recorded(model, conditions, n_steps)
+        sol = Solution(upper, lower, model, conditions=conditions, pdf_undec=record["undec"])
+        loss_k, g_upper, g_lower = _negative_loglikelihood(lf, key, *_apply_overlay(model, sol), model.dt, r)
+        loss += loss_k
+        if not np.isfinite(loss_k):
+            continue
+        g_upper, g_lower = _overlay_vjp(model.get_dependence("overlay"), conditions, model.dt, len(model.t_domain()), g_upper, g_lower)
+        ic_grad, matrix_grads, flux_grads = _backward(model, record, g_upper, g_lower)
+        x_domain = model.x_domain(conditions=conditions)
+        for i,pairs in enumerate(owners):
+            for dep,name in pairs:
+                if dep.depname in ["Drift", "Noise"]:
+                    f = lambda dep=dep : _operator_sum(dep, matrix_grads, flux_grads, model.dx, model.dt, conditions)
+                    h = 1e-6*max(1, abs(float(getattr(dep, name))))
+                elif dep.depname == "IC":
+                    f = lambda dep=dep : np.dot(ic_grad, dep.get_IC(x_domain, dx=model.dx, conditions=conditions))
+                    h = model.dx
+                elif dep.depname == "Bound":
+                    f = lambda : _condition_loss(model, lf, key, n_steps, r)
+                    h = model.dx
+                elif dep.depname == "Overlay":
+                    f = lambda : _negative_loglikelihood(lf, key, *_apply_overlay(model, sol), model.dt, r)[0]
+                    h = model.dt if _shifts_time(dep, name) else 1e-6*max(1, abs(float(getattr(dep, name))))
+                gradient[i] += _derivative(f, dep, name, h)
+    if isinstance(lf, LossBIC):
+        return np.log(lf.samplesize)*lf.nparams + 2*loss, 2*gradient
+    return loss, gradient
+
+def _derivative(f, dep, name, h):
+    """The derivative of f() with respect to parameter `name` of `dep`.
+
+    This is a central difference with step `h`, or a one-sided
+    difference next to the bounds of a Fittable parameter.
+    """
+    value = getattr(dep, name)
+    low = max(float(value)-h, value.minval) if isinstance(value, Fittable) else float(value)-h
+    high = min(float(value)+h, value.maxval) if isinstance(value, Fittable) else float(value)+h
+    try:
+        setattr(dep, name, high)
+        f_high = f()
+        setattr(dep, name, low)
+        f_low = f()
+    finally:
+        setattr(dep, name, value)
+    return (f_high - f_low)/(high - low)
+
+def _apply_overlay(model, sol):
+    """The pdfs of Solution `sol`, from before the overlay, after the overlay."""
+    after = model.get_dependence("overlay").apply(sol._derive(sol.choice_upper.copy(), sol.choice_lower.copy(), sol.undec))
+    return after.choice_upper, after.choice_lower
+
+def _condition_loss(model, lf, key, n_steps, r):
+    """The negative log likelihood of the data under conditions `key` only."""
+    conditions = dict(key)
+    upper, lower, record = _solve_recorded(model, conditions, n_steps)
+    sol = Solution(upper, lower, model, conditions=conditions, pdf_undec=record["undec"])
+    return _negative_loglikelihood(lf, key, *_apply_overlay(model, sol), model.dt, r)[0]
+
+def _negative_loglikelihood(lf, key, upper, lower, dt, r):
+    """The negative log likelihood of the histograms for `key` in `lf`, and its gradient with respect to `upper` and `lower`.
+
+    `r` is the robustness parameter, added to the likelihood of each RT.
+    """
+    (inds_upper, counts_upper), (inds_lower, counts_lower), _ = lf.hist_counts[key]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        loglikelihood = np.dot(counts_upper, np.log(upper[inds_upper]/dt + r)) + np.dot(counts_lower, np.log(lower[inds_lower]/dt + r))
+        g_upper = np.zeros(len(upper))
+        g_lower = np.zeros(len(lower))
+        g_upper[inds_upper] = -counts_upper/(upper[inds_upper] + r*dt)
+        g_lower[inds_lower] = -counts_lower/(lower[inds_lower] + r*dt)
+    if not np.isfinite(loglikelihood):
+        return np.inf, g_upper, g_lower
+    return -loglikelihood, g_upper, g_lower
+
+def _shifts_time(overlay, name):
+    """Whether parameter `name` of `overlay` shifts the pdfs in time, i.e. is a non-decision time."""
+    if type(overlay).apply is OverlayChain.apply:
+        return any(_shifts_time(o, name) for o in overlay.overlays if name in o.required_parameters)
+    return type(overlay).apply is OverlayNonDecision.apply
+
+def _shift(v, shift):
+    """Shift `v` right by `shift` elements (left if negative), filling with zeros."""
+    out = np.zeros(len(v))
+    if shift > 0:
+        out[shift:] = v[:-shift]
+    elif shift < 0:
+        out[:shift] = v[-shift:]
+    else:
+        out[:] = v
+    return out
+
+def _overlay_vjp(overlay, conditions, dt, n_t, g_upper, g_lower):
+    """The gradient with respect to the pdfs before `overlay`, from the gradient with respect to the pdfs after it."""
+    if type(overlay).apply is OverlayChain.apply:
+        for o in reversed(overlay.overlays):
+            g_upper, g_lower = _overlay_vjp(o, conditions, dt, n_t, g_upper, g_lower)
+        return g_upper, g_lower
+    elif type(overlay).apply is OverlayNonDecision.apply:
+        shift = int(overlay.get_nondecision_time(conditions=conditions)/dt) # truncate, as in apply
+        return _shift(g_upper, -shift), _shift(g_lower, -shift)
+    elif type(overlay).apply is OverlayUniformMixture.apply:
+        # Each element of the pdfs contributes to the normalization
+        # of the mixture at every timepoint.
+        u = overlay.umixturecoef
+        common = .5*u/n_t*(np.sum(g_upper) + np.sum(g_lower))
+        return g_upper*(1-u) + common, g_lower*(1-u) + common
+    return g_upper, g_lower
+
+def _solve_recorded(model, conditions, n_steps):
+    """Solve `model` with the implicit method for the first `n_steps` timesteps.
+
+    This is the same as Model.solve_numerical_implicit with
+    force_python=True, but without the overlay, and it records what
+    _backward() needs about each timestep.  Returns the pdfs of the
+    upper and lower choices, and the record.
+    """
+    dt, dx = model.dt, model.dx
+    t_domain = model.t_domain()
+    x_list = model.x_domain(conditions=conditions)
+    N = len(x_list)
+    bound_dep = model.get_dependence("bound")
+    bounds = [bound_dep.get_bound(t=t, conditions=conditions) for t in t_domain]
+    bmax = max(bounds)
+    time_invariant = not (model.get_dependence("drift")._uses_t() or
+                          model.get_dependence("noise")._uses_t() or
+                          bound_dep._uses_t())
+    operators = _OperatorCache(model, conditions, implicit=True)
+    propagate = None
+    # The flux through each position is the same at every timestep
+    # unless the drift or noise depends on time.
+    fluxes_at = {}
+    def flux(x, t):
+        key = (x, t) if operators.uses_t else x
+        if key not in fluxes_at:
+            fluxes_at[key] = model.flux(x, t, conditions=conditions)
+        return fluxes_at[key]
+    pdf = model._IC_array(conditions=conditions).copy()
+    upper = np.zeros(len(t_domain))
+    lower = np.zeros(len(t_domain))
+    steps = []
+    for i_t in range(min(n_steps, len(t_domain)-1)):
+        if np.sum(pdf) < 0.0001:
+            break
+        t = t_domain[i_t]
+        bound = bounds[i_t]
+        assert bmax >= bound, "Invalid change in bound"
+        bound_shift = bmax - bound
+        inner = int(np.ceil(bound_shift/dx))
+        outer = int(np.floor(bound_shift/dx))
+        w_inner = (bound_shift - outer*dx)/dx
+        w_outer = 1. - w_inner
+        x_outer = x_list[outer:N-outer]
+        if propagate is None or not time_invariant:
+            matrix = operators.matrix(x_outer, t, dt)
+            propagate = matrix.factorize() if time_invariant else matrix.spsolve
+        y_outer = propagate(pdf[outer:N-outer])
+        if inner == outer:
+            y_inner = y_outer
+        else:
+            y_inner = operators.matrix(x_outer[1:-1], t, dt).spsolve(pdf[inner:N-inner])
+        lower[i_t+1] += w_outer*np.sum(pdf[:outer]) + w_inner*np.sum(pdf[:inner])
+        upper[i_t+1] += w_outer*np.sum(pdf[N-outer:]) + w_inner*np.sum(pdf[N-inner:])
+        pdf = np.zeros(N)
+        pdf[outer:N-outer] += w_outer*y_outer
+        pdf[inner:N-inner] += w_inner*y_inner
+        fluxes = tuple(flux(x_list[i], t) for i in [N-1-outer, outer, N-1-inner, inner])
+        upper[i_t+1] += w_outer*y_outer[-1]*fluxes[0]
+        lower[i_t+1] += w_outer*y_outer[0]*fluxes[1]
+        if len(y_inner) > 0:
+            upper[i_t+1] += w_inner*y_inner[-1]*fluxes[2]
+            lower[i_t+1] += w_inner*y_inner[0]*fluxes[3]
+        scale = (1 + (1-bound/dx)) if bound < dx else 1
+        upper[i_t+1] *= scale
+        lower[i_t+1] *= scale
+        steps.append((i_t, t, outer, inner, w_outer, w_inner, y_outer, y_inner, fluxes, scale))
+    # Fix negative values and numerical errors as in solve_numerical
+    undec = pdf
+    lower_negative = lower < 0
+    undec_negative = undec < 0
+    if min(np.min(upper), np.min(lower), np.min(undec)) < 0:
+        lower[lower_negative] = 0
+        undec[undec_negative] = 0
+    else:
+        lower_negative = undec_negative = None
+    pdfsum = np.sum(upper) + np.sum(lower) + np.sum(undec)
+    if pdfsum > 1:
+        upper /= pdfsum
+        lower /= pdfsum
+        undec /= pdfsum
+    record = {"steps": steps, "x_domain": x_list, "conditions": conditions, "operators": operators,
+              "time_invariant": time_invariant, "undec": undec, "pdfsum": pdfsum,
+              "upper": upper.copy(), "lower": lower.copy(),
+              "lower_negative": lower_negative, "undec_negative": undec_negative}
+    return upper, lower, record
+
+def _backward(model, record, g_upper, g_lower):
+    """The adjoint pass of the implicit method through the timesteps in `record`.
+
+    `g_upper` and `g_lower` are the gradient of the loss with respect to
+    the pdfs from _solve_recorded().  Returns the gradient with respect
+    to the initial condition, and the gradients with respect to the
+    (tridiagonal) diffusion matrix and the flux at the boundary.  The
+    matrix gradients are a dictionary of tuples of the positions, the
+    time, and the gradients of the diagonal, upper, and lower diagonals.
+    The flux gradients are a dictionary of tuples of the position, the
+    time, and the gradient.  Both are indexed so that identical matrices
+    or fluxes are only included once.
+    """
+    dt = model.dt
+    x_list = record["x_domain"]
+    N = len(x_list)
+    operators = record["operators"]
+    uses_t = operators.uses_t
+    g_upper = np.array(g_upper, dtype=float)
+    g_lower = np.array(g_lower, dtype=float)
+    g_undec = np.zeros(N)
+    # Undo the corrections at the end of the solver
+    pdfsum = record["pdfsum"]
+    if pdfsum > 1:
+        common = np.dot(g_upper, record["upper"]) + np.dot(g_lower, record["lower"])
+        g_upper = (g_upper - common)/pdfsum
+        g_lower = (g_lower - common)/pdfsum
+        g_undec[:] = -common/pdfsum
+    if record["lower_negative"] is not None:
+        g_lower[record["lower_negative"]] = 0
+        g_undec[record["undec_negative"]] = 0
+    matrix_grads = {}
+    flux_grads = {}
+    def add_matrix_grad(x, t, mu, y):
+        # y = A^-1 b, so the gradient with respect to A is -mu y^T,
+        # where mu = A^-T times the gradient with respect to y.
+        key = (len(x), x[0]) + ((t,) if uses_t else ())
+        if key not in matrix_grads:
+            matrix_grads[key] = (x, t, np.zeros(len(x)), np.zeros(len(x)-1), np.zeros(len(x)-1))
+        _, _, diag, up, down = matrix_grads[key]
+        diag -= mu*y
+        up -= mu[:-1]*y[1:]
+        down -= mu[1:]*y[:-1]
+    def add_flux_grad(x_b, t, g):
+        key = (x_b,) + ((t,) if uses_t else ())
+        if key not in flux_grads:
+            flux_grads[key] = [x_b, t, 0.]
+        flux_grads[key][2] += g
+    transposes = {}
+    def solve_transpose(x, t, vec):
+        key = (len(x), x[0])
+        if record["time_invariant"] and key in transposes:
+            return transposes[key](vec)
+        m = operators.matrix(x, t, dt)
+        transpose = TriDiagMatrix(diag=m.diag.copy(), up=m.down.copy(), down=m.up.copy())
+        if record["time_invariant"]:
+            transposes[key] = transpose.factorize()
+            return transposes[key](vec)
+        return transpose.spsolve(vec)
+    lam = g_undec
+    for (i_t, t, outer, inner, w_outer, w_inner, y_outer, y_inner, fluxes, scale) in reversed(record["steps"]):
+        gu = g_upper[i_t+1]*scale
+        gl = g_lower[i_t+1]*scale
+        x_outer = x_list[outer:N-outer]
+        lam_outer = w_outer*lam[outer:N-outer]
+        lam_outer[-1] += w_outer*fluxes[0]*gu
+        lam_outer[0] += w_outer*fluxes[1]*gl
+        add_flux_grad(x_list[N-1-outer], t, w_outer*y_outer[-1]*gu)
+        add_flux_grad(x_list[outer], t, w_outer*y_outer[0]*gl)
+        lam_inner = w_inner*lam[inner:N-inner]
+        if len(y_inner) > 0:
+            lam_inner[-1] += w_inner*fluxes[2]*gu
+            lam_inner[0] += w_inner*fluxes[3]*gl
+            add_flux_grad(x_list[N-1-inner], t, w_inner*y_inner[-1]*gu)
+            add_flux_grad(x_list[inner], t, w_inner*y_inner[0]*gl)
+        lam = np.zeros(N)
+        if inner == outer:
+            mu = solve_transpose(x_outer, t, lam_outer + lam_inner)
+            add_matrix_grad(x_outer, t, mu, y_outer)
+            lam[outer:N-outer] += mu
+        else:
+            mu = solve_transpose(x_outer, t, lam_outer)
+            add_matrix_grad(x_outer, t, mu, y_outer)
+            lam[outer:N-outer] += mu
+            if len(y_inner) > 0:
+                mu = solve_transpose(x_outer[1:-1], t, lam_inner)
+                add_matrix_grad(x_outer[1:-1], t, mu, y_inner)
+                lam[inner:N-inner] += mu
+        lam[:outer] += w_outer*gl
+        lam[:inner] += w_inner*gl
+        lam[N-outer:] += w_outer*gu
+        lam[N-inner:] += w_inner*gu
+    return lam, matrix_grads, flux_grads
+
+def _operator_sum(dep, matrix_grads, flux_grads, dx, dt, conditions):
+    """The sum of the drift or noise matrices and fluxes from `dep`, weighted by their gradients.
+
+    The derivative of this with respect to a parameter of `dep` is the
+    derivative of the loss with respect to that parameter.
+    """
+    total = 0
+    for x,t,diag,up,down in matrix_grads.values():
+        m = dep.get_matrix(x=x, t=t, dx=dx, dt=dt, conditions=conditions, implicit=True)
+        total += np.dot(diag, m.diag) + np.dot(up, m.up) + np.dot(down, m.down)
+    for x_b,t,g in flux_grads.values():
+        total += g * dep.get_flux(x_b, t, dx=dx, dt=dt, conditions=conditions)
+    return total
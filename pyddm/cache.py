@@ -0,0 +1,317 @@
+# Copyright 2018 Max Shinn <maxwell.shinn@yale.edu>
+#           2018 Norman Lam <norman.lam@yale.edu>
+#
+# This file is part of PyDDM, and is available under the MIT license.
+# Please see LICENSE.txt in the root directory for more information.
+
+__all__ = ["SolutionCache", "set_solution_cache", "get_solution_cache",
+           "set_pre_overlay_cache", "get_pre_overlay_cache",
+           "SolutionStore", "set_solution_store", "get_solution_store"]
+
+import collections
+import threading
+import hashlib
+import os
+import re
+import tempfile
+import numpy as np
+
+from paranoid.types import Maybe, Natural1, String
+from paranoid.decorators import accepts
+
+from .models.base import Dependence
+from ._version import __version__
+
+class SolutionCache:
+    """A cache of recently computed Solution objects.
+
+    When fitting a model, the same parameter values are often solved
+    many times, e.g. by differential evolution or in the model GUI.
+    When the cache is enabled with set_solution_cache(), Model.solve()
+    and solve_all_conditions() look up Solutions here before solving
+    the model.
+
+    Solutions are indexed by the model's components and their parameter
+    values, the model's dx, dt, and T_dur, the conditions, and the solver
+    method.  When the total size of the Solutions in the cache exceeds
+    `max_bytes`, the least recently used Solutions are removed.
+
+    The number of lookups which found a Solution (`hits`) and which did
+    not (`misses`) are recorded, as is the total size in bytes of the
+    cached Solutions (`nbytes`).
+
+    The cache keeps its own copy of each Solution, and returns a new
+    copy each time it is found, so modifying a returned Solution does
+    not affect the cache.
+
+    Note that the cache assumes that models only depend on their
+    parameters and conditions.  Custom model components which depend on
+    other variables (e.g. global variables) should not be used with the
+    cache.
+    """
+    def __init__(self, max_bytes=100000000):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._solutions = collections.OrderedDict()
+        self._lock = threading.Lock()
+    def __len__(self):
+        return len(self._solutions)
+    def __repr__(self):
+        return "SolutionCache(max_bytes=%i) with %i solutions (%i bytes), %i hits, %i misses" % \
+            (self.max_bytes, len(self), self.nbytes, self.hits, self.misses)
+    def key(self, model, conditions, method=None):
+        """The index of the Solution of `model` under `conditions` using `method`."""
+        return (type(model), model.name, model.choice_names, model.dx, model.dt, model.T_dur,
+                tuple(_dependence_key(d) for d in model.dependencies),
+                frozenset(conditions.items()), method)
+    def get(self, key):
+        """Return the Solution indexed by `key`, or None if it is not in the cache."""
+        with self._lock:
+            sol = self._solutions.get(key)
+            if sol is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._solutions.move_to_end(key)
+        return _copy_solution(sol)
+    def put(self, key, solution):
+        """Add a copy of `solution` to the cache, indexed by `key`."""
+        size = _solution_nbytes(solution)
+        if size > self.max_bytes:
+            return
+        solution = _copy_solution(solution)
+        with self._lock:
+            if key in self._solutions:
+                self.nbytes -= _solution_nbytes(self._solutions.pop(key))
+            self._solutions[key] = solution
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _,old = self._solutions.popitem(last=False)
+                self.nbytes -= _solution_nbytes(old)
+    def clear(self):
+        """Remove all Solutions and reset the hit and miss counts."""
+        with self._lock:
+            self._solutions.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+class SolutionStore:
+    """A directory of Solutions saved to disk, shared across sessions.
+
+    When the store is enabled with set_solution_store(), Model.solve()
+    and solve_all_conditions() (and thus solve_partial_conditions(),
+    plot_fit_diagnostics(), and the fitting functions) load previously
+    computed Solutions from the directory `path` before solving the
+    model, and save the Solutions they compute there.
+
+    Each Solution is saved in a compressed .npz file, named by a hash of
+    the model's components and their parameter values, the model's dx,
+    dt, and T_dur, the conditions, the solver method, and the PyDDM
+    version.  When the total size of the files exceeds `max_bytes`, the
+    least recently used files are removed.
+
+    As with SolutionCache, the number of Solutions loaded (`hits`) and
+    not found (`misses`) are recorded.  Note that model components are
+    identified by their class name, not their code.  If you change the
+    code of a model component, call clear() to remove old Solutions.
+    Likewise, parameters and conditions are identified by their repr,
+    so models with parameters or conditions whose repr only gives their
+    address in memory (e.g. functions or most custom objects) are never
+    loaded or saved.
+    """
+    def __init__(self, path, max_bytes=1000000000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self.nbytes = sum(f.stat().st_size for f in self._files())
+    def __len__(self):
+        return len(self._files())
+    def __repr__(self):
+        return "SolutionStore(%s, max_bytes=%i) with %i solutions (%i bytes), %i hits, %i misses" % \
+            (repr(self.path), self.max_bytes, len(self), self.nbytes, self.hits, self.misses)
+    def _files(self):
+        return [f for f in os.scandir(self.path) if f.is_file() and f.name.endswith(".npz")]
+    def key(self, model, conditions, method=None):
+        """The file name of the Solution of `model` under `conditions` using `method`.
+
+        This is None if the model cannot be identified across sessions,
+        i.e. its repr includes an address in memory.
+        """
+        k = (__version__, type(model), model.name, model.choice_names, model.dx, model.dt, model.T_dur,
+             tuple(_dependence_key(d) for d in model.dependencies),
+             tuple(sorted(((c, _param_key(v)) for c,v in conditions.items()), key=lambda cv : cv[0])),
+             method)
+        k = repr(k)
+        if _ADDRESS_REPR.search(k):
+            return None
+        return hashlib.sha1(k.encode()).hexdigest() + ".npz"
+    def load(self, key, model, conditions):
+        """Return the Solution of `model` under `conditions` saved as `key`, or None if there is none."""
+        from .solution import Solution # Importing here avoids a recursion issue
+        if key is None:
+            return None
+        filename = os.path.join(self.path, key)
+        try:
+            with np.load(filename) as f:
+                arrays = {k : f[k] for k in f.files}
+            os.utime(filename) # Mark as recently used
+        except (FileNotFoundError, OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return Solution(arrays["choice_upper"], arrays["choice_lower"], model,
+                        conditions=conditions, pdf_undec=arrays.get("undec"))
+    def save(self, key, solution):
+        """Save `solution` to disk as `key`, unless `key` is None."""
+        if key is None:
+            return
+        arrays = {"choice_upper": solution.choice_upper, "choice_lower": solution.choice_lower}
+        if solution.undec is not None:
+            arrays["undec"] = solution.undec
+        # Write to a temporary file first so that other processes never
+        # read a partially written file.
+        fd,tmpname = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        filename = os.path.join(self.path, key)
+        oldsize = os.path.getsize(filename) if os.path.exists(filename) else 0
+        os.replace(tmpname, filename)
+        with self._lock:
+            self.nbytes += os.path.getsize(filename) - oldsize
+            if self.nbytes > self.max_bytes:
+                self._evict()
+    def _evict(self):
+        """Remove the least recently used files until the store fits in max_bytes."""
+        files = sorted(self._files(), key=lambda f : f.stat().st_mtime)
+        self.nbytes = sum(f.stat().st_size for f in files)
+        for f in files:
+            if self.nbytes <= self.max_bytes:
+                break
+            try:
+                self.nbytes -= f.stat().st_size
+                os.remove(f.path)
+            except FileNotFoundError: # Removed by another process
+                pass
+    def clear(self):
+        """Remove all saved Solutions and reset the hit and miss counts."""
+        with self._lock:
+            for f in self._files():
+                try:
+                    os.remove(f.path)
+                except FileNotFoundError:
+                    pass
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+# The default repr of objects and functions, e.g. "<function f at 0x7f...>"
+_ADDRESS_REPR = re.compile(r" at 0x[0-9a-fA-F]+>")
+
+def _solution_nbytes(solution):
+    """Approximate memory used by a Solution object."""
+    arrays = [solution.choice_upper, solution.choice_lower, solution.undec, solution.evolution]
+    return 1000 + sum(a.nbytes for a in arrays if isinstance(a, np.ndarray))
+
+def _copy_solution(solution):
+    """A Solution with copies of the pdfs of `solution`."""
+    copy_or_none = lambda a : a.copy() if a is not None else None
+    return solution._derive(solution.choice_upper.copy(), solution.choice_lower.copy(),
+                            copy_or_none(solution.undec), copy_or_none(solution.evolution))
+
+def _param_key(value):
+    """A hashable version of a model component's parameter."""
+    if isinstance(value, Dependence):
+        return _dependence_key(value)
+    if isinstance(value, (float, int, np.number)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, np.ndarray):
+        return (value.shape, value.dtype.str, value.tobytes())
+    if isinstance(value, (list, tuple)):
+        return tuple(map(_param_key, value))
+    if isinstance(value, dict):
+        return tuple(sorted((k, _param_key(v)) for k,v in value.items()))
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return repr(value)
+
+def _dependence_key(dep):
+    """A hashable version of a model component, based on its parameters.
+
+    Like Dependence.__eq__, this compares all of the object's attributes."""
+    return (type(dep),) + tuple(sorted((k, _param_key(v)) for k,v in dep.__dict__.items() if k != "_cache_uses"))
+
+_solution_cache = None # Note: do not change this directly.  Call set_solution_cache() instead.
+
+@accepts(Maybe(Natural1))
+def set_solution_cache(max_bytes=100000000):
+    """Cache recently computed Solutions, up to `max_bytes` bytes.
+
+    Afterwards, Model.solve() and solve_all_conditions() (and thus the
+    fitting functions) will return the previous Solution if the model
+    has already been solved with the same parameters and conditions.
+    Calling with `max_bytes` set to None disables the cache.  Calling
+    this function again empties the cache.  See SolutionCache for more
+    information.
+    """
+    global _solution_cache
+    _solution_cache = SolutionCache(max_bytes) if max_bytes is not None else None
+
+def get_solution_cache():
+    """Return the SolutionCache object, or None if the cache is disabled.
+
+    This is mainly useful for checking how often Solutions are found in
+    the cache, via its `hits` and `misses` attributes.
+    """
+    return _solution_cache
+
+_pre_overlay_cache = None # Note: do not change this directly.  Call set_pre_overlay_cache() instead.
+
+@accepts(Maybe(Natural1))
+def set_pre_overlay_cache(max_bytes=10000000):
+    """Keep recent Solutions from before the overlay was applied, up to `max_bytes` bytes.
+
+    Overlays, such as non-decision time or mixture models, modify the
+    Solution after the model has been solved.  When a model is solved
+    again and only the parameters of its overlay have changed, the
+    previous Solution before the overlay is reused, and only the overlay
+    is applied.  Calling with `max_bytes` set to None disables it.  As
+    with set_solution_cache(), this assumes that models only depend on
+    their parameters and conditions, so it is disabled by default.
+    """
+    global _pre_overlay_cache
+    _pre_overlay_cache = SolutionCache(max_bytes) if max_bytes is not None else None
+
+def get_pre_overlay_cache():
+    """Return the SolutionCache of Solutions before the overlay, or None if disabled."""
+    return _pre_overlay_cache
+
+_solution_store = None # Note: do not change this directly.  Call set_solution_store() instead.
+
+@accepts(Maybe(String), Natural1)
+def set_solution_store(path, max_bytes=1000000000):
+    """Save Solutions to the directory `path`, up to `max_bytes` bytes.
+
+    Afterwards, Model.solve() and solve_all_conditions() (and thus
+    solve_partial_conditions(), plot_fit_diagnostics(), and the fitting
+    functions) load Solutions from this directory if the model has been
+    solved with the same parameters and conditions before, including in
+    previous Python sessions.  The directory is created if it does not
+    exist.  Calling with `path` set to None disables the store.  See
+    SolutionStore for more information.
+    """
+    global _solution_store
+    _solution_store = SolutionStore(path, max_bytes) if path is not None else None
+
+def get_solution_store():
+    """Return the SolutionStore object, or None if it is disabled."""
+    return _solution_store
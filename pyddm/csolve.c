@@ -28,16 +28,54 @@ void easy_dgtsv(int n, double *dl, double *d, double *du, double *b) {
   }
 }
 
+// Precompute the elimination for easy_dgtsv so that many equations with the
+// same matrix can be solved using easy_dgtsv_factored.  This overwrites dl with
+// the multipliers and d with the inverse of the eliminated diagonal.
+void easy_dgtsv_factor(int n, double *dl, double *d, double *du) {
+  for (int i=1; i<n; i++) {
+    dl[i-1] = dl[i-1]/d[i-1];
+    d[i] -= dl[i-1]*du[i-1];
+  }
+  for (int i=0; i<n; i++)
+    d[i] = 1/d[i];
+}
+
+// Solve the equation with a matrix factorized by easy_dgtsv_factor.  Unlike
+// easy_dgtsv, the coefficients are not modified, and the return value is saved
+// in b.
+void easy_dgtsv_factored(int n, const double *dl, const double *d, const double *du, double *b) {
+  for (int i=1; i<n; i++)
+    b[i] -= dl[i-1]*b[i-1];
+  b[n-1] *= d[n-1];
+  for (int i=n-2; i>=0; i--)
+    b[i] = (b[i] - du[i]*b[i+1])*d[i];
+}
 
 double* _analytic_ddm_linbound(double a1, double b1, double a2, double b2, unsigned int nsteps, double tstep);
-int _implicit_time(int Tsteps, double *pdfchoice1, double *pdfchoice2, double *pdfcurr, double* drift, double* noise, double *bound, double *ic, int Xsteps, double dt, double dx, unsigned int drift_mode, unsigned int noise_mode, unsigned int bound_mode);
+int _implicit_time(int Tsteps, double *pdfchoice1, double *pdfchoice2, double *pdfcurr, double* drift, double* noise, double *bound, double *ic, int Xsteps, double dt, double dx, unsigned int drift_mode, unsigned int noise_mode, unsigned int bound_mode, double tol);
+int _cn_time(int Tsteps, double *pdfchoice1, double *pdfchoice2, double *pdfcurr, double* drift, double* noise, double *bound, double *ic, int Xsteps, double dt, double dx, unsigned int drift_mode, unsigned int noise_mode, unsigned int bound_mode, double tol);
+int _trbdf2_time(int Tsteps, double *pdfchoice1, double *pdfchoice2, double *pdfcurr, double* drift, double* noise, double *bound, double *ic, int Xsteps, double dt, double dx, unsigned int drift_mode, unsigned int noise_mode, unsigned int bound_mode, double tol);
+int _adaptive_time(int Tsteps, double *pdfchoice1, double *pdfchoice2, double *pdfcurr, double* drift, double* noise, double *bound, double *ic, int Xsteps, double dt, double dx, unsigned int drift_mode, unsigned int noise_mode, unsigned int bound_mode, double tol);
+void _mode_multipliers(unsigned int mode, int Xsteps, int *multt, int *multx);
+void _fill_operator(double *DL, double *D, double *DU, double *drift, int dmultt, int dmultx, double *noise, int nmultt, int nmultx, int i, int shift, int Xsteps, double dt, double dx, double scale);
+double _boundary_flux(double *drift, int dmultt, int dmultx, double *noise, int nmultt, int nmultx, int i, int j, double sign, double dt, double dx);
+void _implicit_step(const double *pdfin, double *pdfout, double *work, double *DL, double *D, double *DU, const double *factored, double *drift, int dmultt, int dmultx, double *noise, int nmultt, int nmultx, double *bound, int bmultt, double bound_max, int i, int k, int Xsteps, double dt, double dx, double *mass1, double *mass2);
+void _graded_time(int Tsteps, double *mass1, double *mass2, double *pdfcurr, double *drift, double *noise, double *ic, double *spacing, int Xsteps, double dt, unsigned int drift_mode, unsigned int noise_mode);
+// All solvers share the same signature.  "tol" is the error tolerance, which
+// is only used by solvers with adaptive timesteps.
+typedef int (*solver_function)(int, double*, double*, double*, double*, double*, double*, double*, int, double, double, unsigned int, unsigned int, unsigned int, double);
 
 static PyObject* analytic_ddm_linbound(PyObject* self, PyObject* args) {
   double a1, b1, a2, b2, tstep;
   int nsteps;
   if (!PyArg_ParseTuple(args, "ddddid", &a1, &b1, &a2, &b2, &nsteps, &tstep))
     return NULL;
-  double *res = _analytic_ddm_linbound(a1, b1, a2, b2, nsteps, tstep);
+  double *res;
+  // The numerical work does not touch any Python objects, so let other
+  // threads run in the meantime.
+  Py_BEGIN_ALLOW_THREADS
+  res = _analytic_ddm_linbound(a1, b1, a2, b2, nsteps, tstep);
+  Py_END_ALLOW_THREADS
   npy_intp dims[1] = { nsteps };
   PyObject *retarray = PyArray_SimpleNewFromData(1, dims, NPY_DOUBLE, res);
   PyArray_ENABLEFLAGS((PyArrayObject*)retarray, NPY_ARRAY_OWNDATA);
@@ -45,14 +83,15 @@ static PyObject* analytic_ddm_linbound(PyObject* self, PyObject* args) {
 }
 
 
-static PyObject* implicit_time(PyObject* self, PyObject* args) {
+static PyObject* _solve_time(PyObject* args, solver_function solver) {
   double dt, dx, T_dur;
+  double tol = 0;
   double *drift, *noise, *bound, *ic;
   PyArrayObject *_drift, *_noise, *_bound, *_ic;
   PyObject *__drift, *__noise, *__bound, *__ic;
   int nsteps, len_x0;
   int drifttype, noisetype, boundtype;
-  if (!PyArg_ParseTuple(args, "OiOiOiOdddi", &__drift, &drifttype, &__noise, &noisetype, &__bound, &boundtype, &__ic, &T_dur, &dt, &dx, &nsteps))
+  if (!PyArg_ParseTuple(args, "OiOiOiOdddi|d", &__drift, &drifttype, &__noise, &noisetype, &__bound, &boundtype, &__ic, &T_dur, &dt, &dx, &nsteps, &tol))
     return NULL;
 
   // TODO here is the memory leak: if you don't call the FROMANY function, there is no leak
@@ -73,7 +112,23 @@ static PyObject* implicit_time(PyObject* self, PyObject* args) {
   double *pdfchoice1 = (double*)malloc(nsteps*sizeof(double));
   double *pdfchoice2 = (double*)malloc(nsteps*sizeof(double));
   double *pdfcurr = (double*)malloc(len_x0*sizeof(double));
-  _implicit_time(nsteps, pdfchoice1, pdfchoice2, pdfcurr, drift, noise, bound, ic, len_x0, dt, dx, drifttype, noisetype, boundtype);
+  int status;
+  // The solvers do not touch any Python objects, so let other threads run
+  // in the meantime.  The input arrays are kept alive by our references.
+  Py_BEGIN_ALLOW_THREADS
+  status = solver(nsteps, pdfchoice1, pdfchoice2, pdfcurr, drift, noise, bound, ic, len_x0, dt, dx, drifttype, noisetype, boundtype, tol);
+  Py_END_ALLOW_THREADS
+  if (status != 0) {
+    free(pdfchoice1);
+    free(pdfchoice2);
+    free(pdfcurr);
+    Py_DECREF(_drift);
+    Py_DECREF(_noise);
+    Py_DECREF(_bound);
+    Py_DECREF(_ic);
+    PyErr_SetString(PyExc_ValueError, "Unsupported drift, noise, or bound type for this solver");
+    return NULL;
+  }
   npy_intp dims[1] = { nsteps };
   npy_intp dimscurr[1] = { len_x0 };
   PyObject *choice1array = PyArray_SimpleNewFromData(1, dims, NPY_DOUBLE, pdfchoice1);
@@ -98,11 +153,403 @@ static PyObject* implicit_time(PyObject* self, PyObject* args) {
 }
 
 
+// Solve many conditions in a single call.  The drift, noise, bound, and initial
+// condition arrays for each condition are concatenated, and the corresponding
+// "offsets" arrays (of length number_of_conditions+1) give the index at which
+// each condition starts.  Conditions must share the same drift/noise/bound
+// modes and the same number of timesteps.
+static PyObject* _solve_time_batch(PyObject* args, solver_function solver) {
+  double dt, dx, T_dur;
+  double tol = 0;
+  double *drift, *noise, *bound, *ic;
+  npy_intp *driftoffsets, *noiseoffsets, *boundoffsets, *icoffsets;
+  PyArrayObject *_drift=NULL, *_noise=NULL, *_bound=NULL, *_ic=NULL;
+  PyArrayObject *_driftoffsets=NULL, *_noiseoffsets=NULL, *_boundoffsets=NULL, *_icoffsets=NULL;
+  PyObject *__drift, *__noise, *__bound, *__ic;
+  PyObject *__driftoffsets, *__noiseoffsets, *__boundoffsets, *__icoffsets;
+  PyObject *ret = NULL;
+  int nsteps, nconds;
+  int drifttype, noisetype, boundtype;
+  if (!PyArg_ParseTuple(args, "OOiOOiOOiOOdddi|d", &__drift, &__driftoffsets, &drifttype, &__noise, &__noiseoffsets, &noisetype, &__bound, &__boundoffsets, &boundtype, &__ic, &__icoffsets, &T_dur, &dt, &dx, &nsteps, &tol))
+    return NULL;
+
+  _drift = (PyArrayObject*)PyArray_FROMANY(__drift, NPY_DOUBLE, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  _noise = (PyArrayObject*)PyArray_FROMANY(__noise, NPY_DOUBLE, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  _bound = (PyArrayObject*)PyArray_FROMANY(__bound, NPY_DOUBLE, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  _ic = (PyArrayObject*)PyArray_FROMANY(__ic, NPY_DOUBLE, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  _driftoffsets = (PyArrayObject*)PyArray_FROMANY(__driftoffsets, NPY_INTP, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  _noiseoffsets = (PyArrayObject*)PyArray_FROMANY(__noiseoffsets, NPY_INTP, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  _boundoffsets = (PyArrayObject*)PyArray_FROMANY(__boundoffsets, NPY_INTP, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  _icoffsets = (PyArrayObject*)PyArray_FROMANY(__icoffsets, NPY_INTP, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  if (!_drift || !_noise || !_bound || !_ic || !_driftoffsets || !_noiseoffsets || !_boundoffsets || !_icoffsets)
+    goto cleanup;
+  nconds = PyArray_SIZE(_icoffsets) - 1;
+  if (nconds < 0 || PyArray_SIZE(_driftoffsets) != nconds+1 || PyArray_SIZE(_noiseoffsets) != nconds+1 || PyArray_SIZE(_boundoffsets) != nconds+1) {
+    PyErr_SetString(PyExc_ValueError, "Offset arrays must all have length equal to the number of conditions plus one");
+    goto cleanup;
+  }
+  drift = (double*)PyArray_DATA(_drift);
+  noise = (double*)PyArray_DATA(_noise);
+  bound = (double*)PyArray_DATA(_bound);
+  ic = (double*)PyArray_DATA(_ic);
+  driftoffsets = (npy_intp*)PyArray_DATA(_driftoffsets);
+  noiseoffsets = (npy_intp*)PyArray_DATA(_noiseoffsets);
+  boundoffsets = (npy_intp*)PyArray_DATA(_boundoffsets);
+  icoffsets = (npy_intp*)PyArray_DATA(_icoffsets);
+
+  npy_intp dims[2] = { nconds, nsteps };
+  npy_intp dimscurr[1] = { icoffsets[nconds] };
+  PyObject *choice1array = PyArray_SimpleNew(2, dims, NPY_DOUBLE);
+  PyObject *choice2array = PyArray_SimpleNew(2, dims, NPY_DOUBLE);
+  PyObject *currarray = PyArray_SimpleNew(1, dimscurr, NPY_DOUBLE);
+  if (!choice1array || !choice2array || !currarray) {
+    Py_XDECREF(choice1array);
+    Py_XDECREF(choice2array);
+    Py_XDECREF(currarray);
+    goto cleanup;
+  }
+  double *pdfchoice1 = (double*)PyArray_DATA((PyArrayObject*)choice1array);
+  double *pdfchoice2 = (double*)PyArray_DATA((PyArrayObject*)choice2array);
+  double *pdfcurr = (double*)PyArray_DATA((PyArrayObject*)currarray);
+  int status = 0;
+  // As in _solve_time, release the GIL while solving.
+  Py_BEGIN_ALLOW_THREADS
+  for (int c=0; c<nconds && status == 0; c++)
+    status = solver(nsteps, pdfchoice1+c*nsteps, pdfchoice2+c*nsteps, pdfcurr+icoffsets[c],
+                    drift+driftoffsets[c], noise+noiseoffsets[c], bound+boundoffsets[c],
+                    ic+icoffsets[c], icoffsets[c+1]-icoffsets[c], dt, dx,
+                    drifttype, noisetype, boundtype, tol);
+  Py_END_ALLOW_THREADS
+  if (status != 0) {
+    Py_DECREF(choice1array);
+    Py_DECREF(choice2array);
+    Py_DECREF(currarray);
+    PyErr_SetString(PyExc_ValueError, "Unsupported drift, noise, or bound type for this solver");
+    goto cleanup;
+  }
+  ret = Py_BuildValue("(NNN)", choice1array, choice2array, currarray);
+
+ cleanup:
+  Py_XDECREF(_drift);
+  Py_XDECREF(_noise);
+  Py_XDECREF(_bound);
+  Py_XDECREF(_ic);
+  Py_XDECREF(_driftoffsets);
+  Py_XDECREF(_noiseoffsets);
+  Py_XDECREF(_boundoffsets);
+  Py_XDECREF(_icoffsets);
+  return ret;
+}
+
+// Correct floating point errors so that the total probability is not greater
+// than one, as in the Solution constructor.  Returns the total probability.
+static double _limit_total(double *pdfchoice1, double *pdfchoice2, int n) {
+  double total = 0;
+  for (int i=0; i<n; i++)
+    total += pdfchoice1[i] + pdfchoice2[i];
+  if (total > 1) {
+    for (int i=0; i<n; i++) {
+      pdfchoice1[i] /= 1.00000000001;
+      pdfchoice2[i] /= 1.00000000001;
+    }
+    total /= 1.00000000001;
+  }
+  return total;
+}
+
+// Convert the first "length" timepoints of the pdfs from a solver to
+// probabilities, as in Model._c_solver_solution, and extend them with zeros to
+// "n" timepoints.  Then shift them right by "shift" timesteps (left if
+// negative) as in OverlayNonDecision, and apply a uniform mixture with
+// coefficient "mixture" as in OverlayUniformMixture.  The total probability
+// is limited to one after each step, as in the Solution constructor.
+static void _overlay_pdfs(double *pdfchoice1, double *pdfchoice2, int n, int length, double dt, int shift, double mixture) {
+  for (int i=0; i<n; i++) {
+    if (i >= length || pdfchoice1[i] < 0) pdfchoice1[i] = 0;
+    else pdfchoice1[i] = pdfchoice1[i]*dt;
+    if (i >= length || pdfchoice2[i] < 0) pdfchoice2[i] = 0;
+    else pdfchoice2[i] = pdfchoice2[i]*dt;
+  }
+  double total = _limit_total(pdfchoice1, pdfchoice2, n);
+  if (shift != 0) {
+    double *pdfs[2] = {pdfchoice1, pdfchoice2};
+    for (int p=0; p<2; p++) {
+      if (shift >= n || -shift >= n) {
+        memset(pdfs[p], 0, n*sizeof(double));
+      } else if (shift > 0) {
+        memmove(pdfs[p]+shift, pdfs[p], (n-shift)*sizeof(double));
+        memset(pdfs[p], 0, shift*sizeof(double));
+      } else {
+        memmove(pdfs[p], pdfs[p]-shift, (n+shift)*sizeof(double));
+        memset(pdfs[p]+n+shift, 0, -shift*sizeof(double));
+      }
+    }
+    total = _limit_total(pdfchoice1, pdfchoice2, n);
+  }
+  if (mixture > 0) {
+    for (int i=0; i<n; i++) {
+      pdfchoice1[i] = pdfchoice1[i]*(1-mixture) + .5*mixture/n*total;
+      pdfchoice2[i] = pdfchoice2[i]*(1-mixture) + .5*mixture/n*total;
+    }
+    _limit_total(pdfchoice1, pdfchoice2, n);
+  }
+}
+
+// Solve many conditions with "solver", as in _solve_time_batch, and return
+// the log likelihood of the data, without creating a Solution for
+// each condition in Python.  For each condition, "lengths" gives the number of
+// timepoints to solve (the rest of the pdf is zero), "shifts" gives the
+// number of timesteps by which the pdfs are shifted (as in OverlayNonDecision)
+// and "mixtures" gives the coefficient of a uniform mixture model applied
+// afterwards (as in OverlayUniformMixture).  The data are histograms, as in
+// LossLikelihood: condition c has counts_upper[k] responses at the upper bound
+// at timepoint inds_upper[k], for upperoffsets[c] <= k < upperoffsets[c+1],
+// and likewise for the lower bound.  "robustness" is added to the pdf before
+// taking the log.
+static PyObject* _loglikelihood_batch(PyObject* args, solver_function solver) {
+  double dt, dx, T_dur, robustness;
+  double *drift, *noise, *bound, *ic, *mixtures, *counts_upper, *counts_lower;
+  npy_intp *driftoffsets, *noiseoffsets, *boundoffsets, *icoffsets, *lengths, *shifts;
+  npy_intp *inds_upper, *upperoffsets, *inds_lower, *loweroffsets;
+  PyArrayObject *_drift=NULL, *_noise=NULL, *_bound=NULL, *_ic=NULL;
+  PyArrayObject *_driftoffsets=NULL, *_noiseoffsets=NULL, *_boundoffsets=NULL, *_icoffsets=NULL;
+  PyArrayObject *_lengths=NULL, *_shifts=NULL, *_mixtures=NULL;
+  PyArrayObject *_inds_upper=NULL, *_counts_upper=NULL, *_upperoffsets=NULL;
+  PyArrayObject *_inds_lower=NULL, *_counts_lower=NULL, *_loweroffsets=NULL;
+  PyObject *__drift, *__noise, *__bound, *__ic;
+  PyObject *__driftoffsets, *__noiseoffsets, *__boundoffsets, *__icoffsets;
+  PyObject *__lengths, *__shifts, *__mixtures;
+  PyObject *__inds_upper, *__counts_upper, *__upperoffsets;
+  PyObject *__inds_lower, *__counts_lower, *__loweroffsets;
+  PyObject *ret = NULL;
+  int nsteps, nconds;
+  int drifttype, noisetype, boundtype;
+  if (!PyArg_ParseTuple(args, "OOiOOiOOiOOdddiOOOOOOOOOd", &__drift, &__driftoffsets, &drifttype, &__noise, &__noiseoffsets, &noisetype, &__bound, &__boundoffsets, &boundtype, &__ic, &__icoffsets, &T_dur, &dt, &dx, &nsteps,
+                        &__lengths, &__shifts, &__mixtures, &__inds_upper, &__counts_upper, &__upperoffsets, &__inds_lower, &__counts_lower, &__loweroffsets, &robustness))
+    return NULL;
+
+  _drift = (PyArrayObject*)PyArray_FROMANY(__drift, NPY_DOUBLE, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  _noise = (PyArrayObject*)PyArray_FROMANY(__noise, NPY_DOUBLE, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  _bound = (PyArrayObject*)PyArray_FROMANY(__bound, NPY_DOUBLE, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  _ic = (PyArrayObject*)PyArray_FROMANY(__ic, NPY_DOUBLE, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  _driftoffsets = (PyArrayObject*)PyArray_FROMANY(__driftoffsets, NPY_INTP, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  _noiseoffsets = (PyArrayObject*)PyArray_FROMANY(__noiseoffsets, NPY_INTP, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  _boundoffsets = (PyArrayObject*)PyArray_FROMANY(__boundoffsets, NPY_INTP, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  _icoffsets = (PyArrayObject*)PyArray_FROMANY(__icoffsets, NPY_INTP, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  _lengths = (PyArrayObject*)PyArray_FROMANY(__lengths, NPY_INTP, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  _shifts = (PyArrayObject*)PyArray_FROMANY(__shifts, NPY_INTP, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  _mixtures = (PyArrayObject*)PyArray_FROMANY(__mixtures, NPY_DOUBLE, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  _inds_upper = (PyArrayObject*)PyArray_FROMANY(__inds_upper, NPY_INTP, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  _counts_upper = (PyArrayObject*)PyArray_FROMANY(__counts_upper, NPY_DOUBLE, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  _upperoffsets = (PyArrayObject*)PyArray_FROMANY(__upperoffsets, NPY_INTP, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  _inds_lower = (PyArrayObject*)PyArray_FROMANY(__inds_lower, NPY_INTP, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  _counts_lower = (PyArrayObject*)PyArray_FROMANY(__counts_lower, NPY_DOUBLE, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  _loweroffsets = (PyArrayObject*)PyArray_FROMANY(__loweroffsets, NPY_INTP, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  if (!_drift || !_noise || !_bound || !_ic || !_driftoffsets || !_noiseoffsets || !_boundoffsets || !_icoffsets ||
+      !_lengths || !_shifts || !_mixtures || !_inds_upper || !_counts_upper || !_upperoffsets || !_inds_lower || !_counts_lower || !_loweroffsets)
+    goto cleanup;
+  nconds = PyArray_SIZE(_icoffsets) - 1;
+  if (nconds < 0 || PyArray_SIZE(_driftoffsets) != nconds+1 || PyArray_SIZE(_noiseoffsets) != nconds+1 || PyArray_SIZE(_boundoffsets) != nconds+1 ||
+      PyArray_SIZE(_upperoffsets) != nconds+1 || PyArray_SIZE(_loweroffsets) != nconds+1 ||
+      PyArray_SIZE(_lengths) != nconds || PyArray_SIZE(_shifts) != nconds || PyArray_SIZE(_mixtures) != nconds) {
+    PyErr_SetString(PyExc_ValueError, "Offset arrays must all have length equal to the number of conditions plus one, and other per-condition arrays the number of conditions");
+    goto cleanup;
+  }
+  if (PyArray_SIZE(_inds_upper) != PyArray_SIZE(_counts_upper) || PyArray_SIZE(_inds_lower) != PyArray_SIZE(_counts_lower)) {
+    PyErr_SetString(PyExc_ValueError, "Histogram indices and counts must have the same length");
+    goto cleanup;
+  }
+  drift = (double*)PyArray_DATA(_drift);
+  noise = (double*)PyArray_DATA(_noise);
+  bound = (double*)PyArray_DATA(_bound);
+  ic = (double*)PyArray_DATA(_ic);
+  driftoffsets = (npy_intp*)PyArray_DATA(_driftoffsets);
+  noiseoffsets = (npy_intp*)PyArray_DATA(_noiseoffsets);
+  boundoffsets = (npy_intp*)PyArray_DATA(_boundoffsets);
+  icoffsets = (npy_intp*)PyArray_DATA(_icoffsets);
+  lengths = (npy_intp*)PyArray_DATA(_lengths);
+  shifts = (npy_intp*)PyArray_DATA(_shifts);
+  mixtures = (double*)PyArray_DATA(_mixtures);
+  inds_upper = (npy_intp*)PyArray_DATA(_inds_upper);
+  counts_upper = (double*)PyArray_DATA(_counts_upper);
+  upperoffsets = (npy_intp*)PyArray_DATA(_upperoffsets);
+  inds_lower = (npy_intp*)PyArray_DATA(_inds_lower);
+  counts_lower = (double*)PyArray_DATA(_counts_lower);
+  loweroffsets = (npy_intp*)PyArray_DATA(_loweroffsets);
+  for (int c=0; c<nconds; c++) {
+    if (lengths[c] < 1 || lengths[c] > nsteps) {
+      PyErr_SetString(PyExc_ValueError, "The number of timepoints to solve must be between 1 and nsteps");
+      goto cleanup;
+    }
+  }
+  for (npy_intp k=0; k<PyArray_SIZE(_inds_upper); k++) {
+    if (inds_upper[k] < 0 || inds_upper[k] >= nsteps) {
+      PyErr_SetString(PyExc_ValueError, "Histogram index out of range");
+      goto cleanup;
+    }
+  }
+  for (npy_intp k=0; k<PyArray_SIZE(_inds_lower); k++) {
+    if (inds_lower[k] < 0 || inds_lower[k] >= nsteps) {
+      PyErr_SetString(PyExc_ValueError, "Histogram index out of range");
+      goto cleanup;
+    }
+  }
+
+  npy_intp maxXsteps = 0;
+  for (int c=0; c<nconds; c++)
+    if (icoffsets[c+1]-icoffsets[c] > maxXsteps)
+      maxXsteps = icoffsets[c+1]-icoffsets[c];
+  double *pdfchoice1 = (double*)malloc(nsteps*sizeof(double));
+  double *pdfchoice2 = (double*)malloc(nsteps*sizeof(double));
+  double *pdfcurr = (double*)malloc((maxXsteps > 0 ? maxXsteps : 1)*sizeof(double));
+  double loglikelihood = 0;
+  int status = 0;
+  // As in _solve_time, release the GIL while solving.
+  Py_BEGIN_ALLOW_THREADS
+  for (int c=0; c<nconds && status == 0; c++) {
+    status = solver(lengths[c], pdfchoice1, pdfchoice2, pdfcurr,
+                    drift+driftoffsets[c], noise+noiseoffsets[c], bound+boundoffsets[c],
+                    ic+icoffsets[c], icoffsets[c+1]-icoffsets[c], dt, dx,
+                    drifttype, noisetype, boundtype, 0);
+    _overlay_pdfs(pdfchoice1, pdfchoice2, nsteps, lengths[c], dt, shifts[c], mixtures[c]);
+    for (npy_intp k=upperoffsets[c]; k<upperoffsets[c+1]; k++)
+      loglikelihood += counts_upper[k] * log(pdfchoice1[inds_upper[k]]/dt + robustness);
+    for (npy_intp k=loweroffsets[c]; k<loweroffsets[c+1]; k++)
+      loglikelihood += counts_lower[k] * log(pdfchoice2[inds_lower[k]]/dt + robustness);
+  }
+  Py_END_ALLOW_THREADS
+  free(pdfchoice1);
+  free(pdfchoice2);
+  free(pdfcurr);
+  if (status != 0) {
+    PyErr_SetString(PyExc_ValueError, "Unsupported drift, noise, or bound type for this solver");
+    goto cleanup;
+  }
+  ret = PyFloat_FromDouble(loglikelihood);
+
+ cleanup:
+  Py_XDECREF(_drift);
+  Py_XDECREF(_noise);
+  Py_XDECREF(_bound);
+  Py_XDECREF(_ic);
+  Py_XDECREF(_driftoffsets);
+  Py_XDECREF(_noiseoffsets);
+  Py_XDECREF(_boundoffsets);
+  Py_XDECREF(_icoffsets);
+  Py_XDECREF(_lengths);
+  Py_XDECREF(_shifts);
+  Py_XDECREF(_mixtures);
+  Py_XDECREF(_inds_upper);
+  Py_XDECREF(_counts_upper);
+  Py_XDECREF(_upperoffsets);
+  Py_XDECREF(_inds_lower);
+  Py_XDECREF(_counts_lower);
+  Py_XDECREF(_loweroffsets);
+  return ret;
+}
+
+static PyObject* implicit_loglikelihood_batch(PyObject* self, PyObject* args) {
+  return _loglikelihood_batch(args, _implicit_time);
+}
+
+static PyObject* cn_loglikelihood_batch(PyObject* self, PyObject* args) {
+  return _loglikelihood_batch(args, _cn_time);
+}
+
+static PyObject* implicit_time(PyObject* self, PyObject* args) {
+  return _solve_time(args, _implicit_time);
+}
+
+static PyObject* implicit_time_batch(PyObject* self, PyObject* args) {
+  return _solve_time_batch(args, _implicit_time);
+}
+
+static PyObject* cn_time(PyObject* self, PyObject* args) {
+  return _solve_time(args, _cn_time);
+}
+
+static PyObject* cn_time_batch(PyObject* self, PyObject* args) {
+  return _solve_time_batch(args, _cn_time);
+}
+
+static PyObject* trbdf2_time(PyObject* self, PyObject* args) {
+  return _solve_time(args, _trbdf2_time);
+}
+
+static PyObject* adaptive_time(PyObject* self, PyObject* args) {
+  return _solve_time(args, _adaptive_time);
+}
+
+// Backward Euler on a non-uniform grid with constant bounds.  The drift and
+// noise are given at the grid points, indexed according to their modes as in
+// _implicit_time, and "spacing" holds the Xsteps-1 distances between adjacent
+// grid points.  Unlike the other solvers, this returns the probability mass
+// (not density) crossing each bound at each timestep, and does not
+// renormalize, since Model.solve_numerical_graded does this in Python.
+static PyObject* graded_time(PyObject* self, PyObject* args) {
+  double dt;
+  int nsteps, drifttype, noisetype;
+  PyObject *__drift, *__noise, *__ic, *__spacing;
+  PyArrayObject *_drift=NULL, *_noise=NULL, *_ic=NULL, *_spacing=NULL;
+  PyObject *ret = NULL;
+  if (!PyArg_ParseTuple(args, "OiOiOOdi", &__drift, &drifttype, &__noise, &noisetype, &__ic, &__spacing, &dt, &nsteps))
+    return NULL;
+  _drift = (PyArrayObject*)PyArray_FROMANY(__drift, NPY_DOUBLE, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  _noise = (PyArrayObject*)PyArray_FROMANY(__noise, NPY_DOUBLE, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  _ic = (PyArrayObject*)PyArray_FROMANY(__ic, NPY_DOUBLE, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  _spacing = (PyArrayObject*)PyArray_FROMANY(__spacing, NPY_DOUBLE, 1, 1, NPY_ARRAY_C_CONTIGUOUS);
+  if (!_drift || !_noise || !_ic || !_spacing)
+    goto cleanup;
+  int len_x0 = PyArray_SIZE(_ic);
+  if (len_x0 < 2 || PyArray_SIZE(_spacing) != len_x0-1) {
+    PyErr_SetString(PyExc_ValueError, "The grid must have at least two points, and one less spacing than points");
+    goto cleanup;
+  }
+  npy_intp dims[1] = { nsteps };
+  npy_intp dimscurr[1] = { len_x0 };
+  PyObject *choice1array = PyArray_SimpleNew(1, dims, NPY_DOUBLE);
+  PyObject *choice2array = PyArray_SimpleNew(1, dims, NPY_DOUBLE);
+  PyObject *currarray = PyArray_SimpleNew(1, dimscurr, NPY_DOUBLE);
+  if (!choice1array || !choice2array || !currarray) {
+    Py_XDECREF(choice1array);
+    Py_XDECREF(choice2array);
+    Py_XDECREF(currarray);
+    goto cleanup;
+  }
+  double *drift = (double*)PyArray_DATA(_drift);
+  double *noise = (double*)PyArray_DATA(_noise);
+  double *ic = (double*)PyArray_DATA(_ic);
+  double *spacing = (double*)PyArray_DATA(_spacing);
+  double *mass1 = (double*)PyArray_DATA((PyArrayObject*)choice1array);
+  double *mass2 = (double*)PyArray_DATA((PyArrayObject*)choice2array);
+  double *pdfcurr = (double*)PyArray_DATA((PyArrayObject*)currarray);
+  Py_BEGIN_ALLOW_THREADS
+  _graded_time(nsteps, mass1, mass2, pdfcurr, drift, noise, ic, spacing, len_x0, dt, drifttype, noisetype);
+  Py_END_ALLOW_THREADS
+  ret = Py_BuildValue("(NNN)", choice1array, choice2array, currarray);
+
+ cleanup:
+  Py_XDECREF(_drift);
+  Py_XDECREF(_noise);
+  Py_XDECREF(_ic);
+  Py_XDECREF(_spacing);
+  return ret;
+}
+
+
 /*  define functions in module */
 static PyMethodDef DDMMethods[] =
 {
      {"analytic_ddm_linbound", analytic_ddm_linbound, METH_VARARGS, "DDM with linear bound"},
      {"implicit_time", implicit_time, METH_VARARGS, "DDM with implicit method"},
+     {"implicit_time_batch", implicit_time_batch, METH_VARARGS, "DDM with implicit method for many conditions at once"},
+     {"implicit_loglikelihood_batch", implicit_loglikelihood_batch, METH_VARARGS, "Log likelihood of data for many conditions using the implicit method"},
+     {"cn_loglikelihood_batch", cn_loglikelihood_batch, METH_VARARGS, "Log likelihood of data for many conditions using the Crank-Nicolson method"},
+     {"cn_time", cn_time, METH_VARARGS, "DDM with Crank-Nicolson method (constant bounds only)"},
+     {"cn_time_batch", cn_time_batch, METH_VARARGS, "DDM with Crank-Nicolson method for many conditions at once"},
+     {"trbdf2_time", trbdf2_time, METH_VARARGS, "DDM with TR-BDF2 method"},
+     {"adaptive_time", adaptive_time, METH_VARARGS, "DDM with implicit method and adaptive timesteps"},
+     {"graded_time", graded_time, METH_VARARGS, "DDM with implicit method on a non-uniform grid (constant bounds only)"},
      {NULL, NULL, 0, NULL}
 };
 
@@ -185,7 +632,7 @@ double* _analytic_ddm_linbound(double a1, double b1, double a2, double b2, unsig
 
 
 
-int _implicit_time(int Tsteps, double *pdfchoice1, double *pdfchoice2, double *pdfcurr, double* drift, double* noise, double *bound, double *ic, int Xsteps, double dt, double dx, unsigned int drift_mode, unsigned int noise_mode, unsigned int bound_mode) {
+int _implicit_time(int Tsteps, double *pdfchoice1, double *pdfchoice2, double *pdfcurr, double* drift, double* noise, double *bound, double *ic, int Xsteps, double dt, double dx, unsigned int drift_mode, unsigned int noise_mode, unsigned int bound_mode, double tol) {
   int dmultt=-1, dmultx=-1, nmultt=-1, nmultx=-1, bmultt=-1;
   int j;
   double dxinv = 1/dx;
@@ -199,6 +646,7 @@ int _implicit_time(int Tsteps, double *pdfchoice1, double *pdfchoice2, double *p
   double *D_copy = (double*)malloc(Xsteps*sizeof(double));
   double *DL_copy = (double*)malloc((Xsteps-1)*sizeof(double));
   double *pdfcurr_copy = (double*)malloc(Xsteps*sizeof(double));
+  int Tsteps_remaining = Tsteps;
   memset(pdfchoice1, 0, Tsteps*sizeof(double));
   memset(pdfchoice2, 0, Tsteps*sizeof(double));
   memset(pdfcurr, 0, Xsteps*sizeof(double));
@@ -259,7 +707,29 @@ int _implicit_time(int Tsteps, double *pdfchoice1, double *pdfchoice2, double *p
   for (int i=1; i<Tsteps*bmultt; i++)
     if (bound[i] > bound_max)
       bound_max = bound[i];
-  for (int i=0; i<Tsteps-1; i++) {
+  // If the drift, noise, and bound do not depend on time, the matrix is the
+  // same on each timestep, so factorize it once and then reuse it.  The bound
+  // is constant, so the shift is always zero.
+  if (dmultt == 0 && nmultt == 0 && bmultt == 0) {
+    _fill_operator(DL, D, DU, drift, dmultt, dmultx, noise, nmultt, nmultx, 0, 0, Xsteps, dt, dx, 1);
+    for (int j=0; j<Xsteps; j++)
+      D[j] += 1;
+    easy_dgtsv_factor(Xsteps, DL, D, DU);
+    double flux_upper = _boundary_flux(drift, dmultt, dmultx, noise, nmultt, nmultx, 0, Xsteps-1, 1, dt, dx);
+    double flux_lower = _boundary_flux(drift, dmultt, dmultx, noise, nmultt, nmultx, 0, 0, -1, dt, dx);
+    for (int i=0; i<Tsteps-1; i++) {
+      double sumpdfcurr = 0;
+      for (int j=0; j<Xsteps; j++)
+        sumpdfcurr += pdfcurr[j];
+      if (sumpdfcurr < .0001)
+        break;
+      easy_dgtsv_factored(Xsteps, DL, D, DU, pdfcurr);
+      pdfchoice1[i+1] += flux_upper*pdfcurr[Xsteps-1];
+      pdfchoice2[i+1] += flux_lower*pdfcurr[0];
+    }
+    Tsteps_remaining = 0;
+  }
+  for (int i=0; i<Tsteps_remaining-1; i++) {
     // Make a copy of the current pdf
     for (int j=0; j<Xsteps; j++)
       pdfcurr_copy[j] = pdfcurr[j];
@@ -373,3 +843,612 @@ int _implicit_time(int Tsteps, double *pdfchoice1, double *pdfchoice2, double *p
   free(DL_copy);
   return 0;
 }
+
+
+// Convert a drift or noise mode (see _implicit_time) into multipliers for
+// indexing the time and space dimensions of the corresponding array.
+void _mode_multipliers(unsigned int mode, int Xsteps, int *multt, int *multx) {
+  switch (mode) {
+  case 0: // Constant
+    *multt = 0;
+    *multx = 0;
+    break;
+  case 1: // Varies over time
+    *multt = 1;
+    *multx = 0;
+    break;
+  case 2: // Varies over space
+    *multt = 0;
+    *multx = 1;
+    break;
+  case 3: // Varies over time and space
+    *multt = Xsteps;
+    *multx = 1;
+    break;
+  }
+}
+
+// Fill the lower diagonal DL, diagonal D, and upper diagonal DU with the
+// drift and noise terms at time index i, multiplied by "scale".  Only the grid
+// points from "shift" to Xsteps-shift-1 are filled.  This includes the
+// correction for the absorbing boundaries (as in _implicit_time), but not the
+// identity matrix.
+void _fill_operator(double *DL, double *D, double *DU, double *drift, int dmultt, int dmultx, double *noise, int nmultt, int nmultx, int i, int shift, int Xsteps, double dt, double dx, double scale) {
+  double dxinv = 1/dx;
+  double noisesum;
+  int first = shift;
+  int last = Xsteps-1-shift;
+  for (int j=first; j<=last; j++)
+    D[j] = scale * noise[i*nmultt+j*nmultx]*noise[i*nmultt+j*nmultx] * dt * dxinv * dxinv;
+  for (int j=first; j<last; j++) {
+    noisesum = noise[i*nmultt+j*nmultx]+noise[i*nmultt+(j+1)*nmultx];
+    DU[j] = scale * ( .5*drift[i*dmultt+(j+1)*dmultx]*dt * dxinv - .125*noisesum*noisesum * dt * dxinv * dxinv);
+    DL[j] = scale * (-.5*drift[i*dmultt+j*dmultx]*dt * dxinv - .125*noisesum*noisesum * dt * dxinv * dxinv);
+  }
+  if (last > first) {
+    D[first] += DL[first];
+    DL[first] = 0;
+    D[last] += DU[last-1];
+    DU[last-1] = 0;
+  }
+}
+
+// The proportion of the probability at grid point j which crosses the
+// boundary in a single timestep.  "sign" is 1 for the upper boundary and -1 for
+// the lower boundary.
+double _boundary_flux(double *drift, int dmultt, int dmultx, double *noise, int nmultt, int nmultx, int i, int j, double sign, double dt, double dx) {
+  double n = noise[i*nmultt+j*nmultx];
+  return sign*0.5*dt/dx * drift[i*dmultt+j*dmultx] + 0.5*dt/(dx*dx) * n*n;
+}
+
+// Crank-Nicolson solver.  This mirrors Model.solve_numerical_cn in Python,
+// and so it only supports constant bounds (bound_mode 0).  Arguments are the
+// same as for _implicit_time.
+int _cn_time(int Tsteps, double *pdfchoice1, double *pdfchoice2, double *pdfcurr, double* drift, double* noise, double *bound, double *ic, int Xsteps, double dt, double dx, unsigned int drift_mode, unsigned int noise_mode, unsigned int bound_mode, double tol) {
+  int dmultt=0, dmultx=0, nmultt=0, nmultx=0;
+  int iprev;
+  double flux;
+  if (bound_mode != 0)
+    return -1;
+  _mode_multipliers(drift_mode, Xsteps, &dmultt, &dmultx);
+  _mode_multipliers(noise_mode, Xsteps, &nmultt, &nmultx);
+  double dtinv = 1/dt;
+  double *DU = (double*)malloc((Xsteps-1)*sizeof(double));
+  double *D = (double*)malloc(Xsteps*sizeof(double));
+  double *DL = (double*)malloc((Xsteps-1)*sizeof(double));
+  double *DU_prev = (double*)malloc((Xsteps-1)*sizeof(double));
+  double *D_prev = (double*)malloc(Xsteps*sizeof(double));
+  double *DL_prev = (double*)malloc((Xsteps-1)*sizeof(double));
+  double *rhs = (double*)malloc(Xsteps*sizeof(double));
+  // Each timestep contributes to the current and the next timepoint, so we
+  // need one extra element to hold the contribution of the final step.
+  double *choice1 = (double*)calloc(Tsteps+1, sizeof(double));
+  double *choice2 = (double*)calloc(Tsteps+1, sizeof(double));
+  for (int j=0; j<Xsteps; j++) pdfcurr[j] = ic[j];
+  // Renormalize when the channel size has <1 grid, although all hell breaks
+  // loose in this regime.
+  double renorm = (bound[0] < dx) ? 2 - bound[0]/dx : 1;
+  // If the drift and noise do not depend on time, both matrices are the same
+  // on each timestep, so only construct them (and factorize) once.
+  int time_invariant = (dmultt == 0 && nmultt == 0);
+  for (int i=0; i<Tsteps; i++) {
+    // Sum the current pdf and exit if it is small
+    double sumpdfcurr = 0;
+    for (int j=0; j<Xsteps; j++)
+      sumpdfcurr += pdfcurr[j];
+    if (sumpdfcurr < .0001)
+      break;
+    iprev = (i > 0) ? i-1 : 0;
+    // Solve (I + M(t)/2) p_next = (I - M(t_prev)/2) p
+    if (i == 0 || !time_invariant) {
+      _fill_operator(DL, D, DU, drift, dmultt, dmultx, noise, nmultt, nmultx, i, 0, Xsteps, dt, dx, .5);
+      _fill_operator(DL_prev, D_prev, DU_prev, drift, dmultt, dmultx, noise, nmultt, nmultx, iprev, 0, Xsteps, dt, dx, -.5);
+      for (int j=0; j<Xsteps; j++) {
+        D[j] += 1;
+        D_prev[j] += 1;
+      }
+      if (time_invariant)
+        easy_dgtsv_factor(Xsteps, DL, D, DU);
+    }
+    for (int j=0; j<Xsteps; j++) {
+      rhs[j] = D_prev[j] * pdfcurr[j];
+      if (j < Xsteps-1)
+        rhs[j] += DU_prev[j] * pdfcurr[j+1];
+      if (j > 0)
+        rhs[j] += DL_prev[j-1] * pdfcurr[j-1];
+    }
+    if (time_invariant)
+      easy_dgtsv_factored(Xsteps, DL, D, DU, rhs);
+    else
+      easy_dgtsv(Xsteps, DL, D, DU, rhs);
+    for (int j=0; j<Xsteps; j++)
+      pdfcurr[j] = rhs[j];
+    // Flux across the boundaries, split between this timepoint and the next
+    flux = .5 * pdfcurr[Xsteps-1] * _boundary_flux(drift, dmultt, dmultx, noise, nmultt, nmultx, i, Xsteps-1, 1, dt, dx);
+    choice1[i] += flux;
+    choice1[i+1] += flux * renorm;
+    flux = .5 * pdfcurr[0] * _boundary_flux(drift, dmultt, dmultx, noise, nmultt, nmultx, i, 0, -1, dt, dx);
+    choice2[i] += flux;
+    choice2[i+1] += flux * renorm;
+  }
+  // Fix the time-offset error of dt/2, and scale the output to make it a pdf,
+  // not a pmf
+  pdfchoice1[0] = 0;
+  pdfchoice2[0] = 0;
+  for (int i=1; i<Tsteps; i++) {
+    pdfchoice1[i] = .5*(choice1[i] + choice1[i-1]) * dtinv;
+    pdfchoice2[i] = .5*(choice2[i] + choice2[i-1]) * dtinv;
+  }
+  free(DU);
+  free(D);
+  free(DL);
+  free(DU_prev);
+  free(D_prev);
+  free(DL_prev);
+  free(rhs);
+  free(choice1);
+  free(choice2);
+  return 0;
+}
+
+
+
+// Take a single backward Euler step of size k*dt, starting at time index i,
+// from "pdfin" to "pdfout".  The probability which crosses the upper and lower
+// bound during the step is added to "mass1" and "mass2".  As in _implicit_time,
+// the bound is linearly approximated by the two surrounding grid points.
+// "work", "DL", "D", and "DU" are scratch space of size Xsteps.  If "factored"
+// is not NULL, it holds the factorized matrix (DL, D, then DU, each of size
+// Xsteps) for this step size, which is only valid when the drift, noise, and
+// bound do not depend on time.
+void _implicit_step(const double *pdfin, double *pdfout, double *work, double *DL, double *D, double *DU, const double *factored, double *drift, int dmultt, int dmultx, double *noise, int nmultt, int nmultx, double *bound, int bmultt, double bound_max, int i, int k, int Xsteps, double dt, double dx, double *mass1, double *mass2) {
+  double h = k*dt;
+  double dxinv = 1/dx;
+  double bound_shift = bound_max - bound[i*bmultt];
+  int shifts[2], n, last;
+  double weights[2];
+  shifts[0] = (int)floor(1e-10*round(bound_shift*dxinv*1e10));
+  shifts[1] = (int)ceil(1e-10*round(bound_shift*dxinv*1e10));
+  weights[1] = (bound_shift - shifts[0]*dx)*dxinv;
+  weights[0] = 1 - weights[1];
+  double m1 = 0, m2 = 0;
+  for (int j=0; j<Xsteps; j++)
+    pdfout[j] = 0;
+  for (int s=0; s<2; s++) {
+    int shift = shifts[s];
+    n = Xsteps-2*shift;
+    last = Xsteps-1-shift;
+    if (weights[s] == 0 || n <= 0)
+      continue;
+    for (int j=0; j<shift; j++)
+      m2 += weights[s]*pdfin[j];
+    for (int j=last+1; j<Xsteps; j++)
+      m1 += weights[s]*pdfin[j];
+    for (int j=shift; j<=last; j++)
+      work[j] = pdfin[j];
+    if (factored != NULL) {
+      easy_dgtsv_factored(n, factored, factored+Xsteps, factored+2*Xsteps, work);
+    } else {
+      _fill_operator(DL, D, DU, drift, dmultt, dmultx, noise, nmultt, nmultx, i, shift, Xsteps, h, dx, 1);
+      for (int j=shift; j<=last; j++)
+        D[j] += 1;
+      easy_dgtsv(n, DL+shift, D+shift, DU+shift, work+shift);
+    }
+    m1 += weights[s]*work[last]*_boundary_flux(drift, dmultt, dmultx, noise, nmultt, nmultx, i, last, 1, h, dx);
+    m2 += weights[s]*work[shift]*_boundary_flux(drift, dmultt, dmultx, noise, nmultt, nmultx, i, shift, -1, h, dx);
+    for (int j=shift; j<=last; j++)
+      pdfout[j] += weights[s]*work[j];
+  }
+  // Renormalize when the channel size has <1 grid
+  if (bound[i*bmultt] < dx) {
+    m1 *= 2 - bound[i*bmultt]/dx;
+    m2 *= 2 - bound[i*bmultt]/dx;
+  }
+  *mass1 += m1;
+  *mass2 += m2;
+}
+
+// Backward Euler with adaptive timesteps.  This mirrors
+// Model.solve_numerical_adaptive in Python.  Steps are chosen by step
+// doubling, comparing one step of size k*dt to two steps of size k*dt/2, where
+// k is a power of two.  "tol" is the error tolerance over the entire
+// simulation.  Arguments are otherwise the same as for _implicit_time.
+int _adaptive_time(int Tsteps, double *pdfchoice1, double *pdfchoice2, double *pdfcurr, double* drift, double* noise, double *bound, double *ic, int Xsteps, double dt, double dx, unsigned int drift_mode, unsigned int noise_mode, unsigned int bound_mode, double tol) {
+  int dmultt=0, dmultx=0, nmultt=0, nmultx=0, bmultt=0;
+  int nsteps = Tsteps-1;
+  _mode_multipliers(drift_mode, Xsteps, &dmultt, &dmultx);
+  _mode_multipliers(noise_mode, Xsteps, &nmultt, &nmultx);
+  bmultt = (bound_mode == 0) ? 0 : 1;
+  double bound_max = bound[0];
+  for (int i=1; i<Tsteps*bmultt; i++)
+    if (bound[i] > bound_max)
+      bound_max = bound[i];
+  double *DU = (double*)malloc(Xsteps*sizeof(double));
+  double *D = (double*)malloc(Xsteps*sizeof(double));
+  double *DL = (double*)malloc(Xsteps*sizeof(double));
+  double *work = (double*)malloc(Xsteps*sizeof(double));
+  double *pdffull = (double*)malloc(Xsteps*sizeof(double));
+  double *pdfhalf = (double*)malloc(Xsteps*sizeof(double));
+  double *pdfhalf2 = (double*)malloc(Xsteps*sizeof(double));
+  // The time index at the end of each step, and the cumulative probability of
+  // crossing each bound at that time.  There are at most nsteps steps.
+  int *ends = (int*)malloc((nsteps+1)*sizeof(int));
+  double *cum1 = (double*)malloc((nsteps+1)*sizeof(double));
+  double *cum2 = (double*)malloc((nsteps+1)*sizeof(double));
+  // If nothing depends on time, factorize the matrix for each step size only
+  // once.  There is one factorization for each power of two.
+  int time_invariant = (dmultt == 0 && nmultt == 0 && bmultt == 0);
+  int nlevels = 1;
+  while ((1 << nlevels) <= nsteps)
+    nlevels++;
+  double **factored = (double**)calloc(nlevels, sizeof(double*));
+  int nends = 1;
+  ends[0] = 0;
+  cum1[0] = 0;
+  cum2[0] = 0;
+  for (int j=0; j<Xsteps; j++)
+    pdfcurr[j] = ic[j];
+  int i = 0; // Current time index
+  int step = 1; // Current step size, in units of dt
+  double err, mass1, mass2, mass1_full, mass2_full, mass1_half, mass2_half;
+  while (i < nsteps) {
+    // Sum the current pdf and exit if it is small
+    double sumpdfcurr = 0;
+    for (int j=0; j<Xsteps; j++)
+      sumpdfcurr += pdfcurr[j];
+    if (sumpdfcurr < .0001)
+      break;
+    // Steps must evenly divide the current time, so step sizes can only
+    // increase at aligned times.
+    while (i % step != 0 || i + step > nsteps)
+      step /= 2;
+    // Find the factorized matrices for the step sizes needed here
+    const double *fact_full = NULL, *fact_half = NULL;
+    if (time_invariant) {
+      for (int level=0; (1 << level) <= step; level++) {
+        if ((1 << level) != step && (2 << level) != step)
+          continue;
+        if (factored[level] == NULL) {
+          factored[level] = (double*)malloc(3*Xsteps*sizeof(double));
+          _fill_operator(factored[level], factored[level]+Xsteps, factored[level]+2*Xsteps, drift, dmultt, dmultx, noise, nmultt, nmultx, 0, 0, Xsteps, (1 << level)*dt, dx, 1);
+          for (int j=0; j<Xsteps; j++)
+            factored[level][Xsteps+j] += 1;
+          easy_dgtsv_factor(Xsteps, factored[level], factored[level]+Xsteps, factored[level]+2*Xsteps);
+        }
+        if ((1 << level) == step)
+          fact_full = factored[level];
+        else
+          fact_half = factored[level];
+      }
+    }
+    if (step == 1) {
+      mass1 = mass2 = 0;
+      _implicit_step(pdfcurr, pdffull, work, DL, D, DU, fact_full, drift, dmultt, dmultx, noise, nmultt, nmultx, bound, bmultt, bound_max, i, 1, Xsteps, dt, dx, &mass1, &mass2);
+      for (int j=0; j<Xsteps; j++)
+        pdfcurr[j] = pdffull[j];
+      ends[nends] = i+1;
+      cum1[nends] = cum1[nends-1] + mass1;
+      cum2[nends] = cum2[nends-1] + mass2;
+      nends++;
+      err = 0;
+    } else {
+      mass1_full = mass2_full = mass1 = mass2 = mass1_half = mass2_half = 0;
+      _implicit_step(pdfcurr, pdffull, work, DL, D, DU, fact_full, drift, dmultt, dmultx, noise, nmultt, nmultx, bound, bmultt, bound_max, i, step, Xsteps, dt, dx, &mass1_full, &mass2_full);
+      _implicit_step(pdfcurr, pdfhalf, work, DL, D, DU, fact_half, drift, dmultt, dmultx, noise, nmultt, nmultx, bound, bmultt, bound_max, i, step/2, Xsteps, dt, dx, &mass1, &mass2);
+      _implicit_step(pdfhalf, pdfhalf2, work, DL, D, DU, fact_half, drift, dmultt, dmultx, noise, nmultt, nmultx, bound, bmultt, bound_max, i+step/2, step/2, Xsteps, dt, dx, &mass1_half, &mass2_half);
+      err = fabs(mass1_full - mass1 - mass1_half) + fabs(mass2_full - mass2 - mass2_half);
+      for (int j=0; j<Xsteps; j++)
+        err += fabs(pdffull[j] - pdfhalf2[j]);
+      // Reject the step if it is larger than this step's share of the total
+      // tolerance.  The two half steps are already computed, so if they are
+      // the smallest possible step, use them.
+      if (err > tol*step/nsteps && step > 2) {
+        step /= 2;
+        continue;
+      }
+      for (int j=0; j<Xsteps; j++)
+        pdfcurr[j] = pdfhalf2[j];
+      ends[nends] = i+step/2;
+      cum1[nends] = cum1[nends-1] + mass1;
+      cum2[nends] = cum2[nends-1] + mass2;
+      nends++;
+      ends[nends] = i+step;
+      cum1[nends] = cum1[nends-1] + mass1_half;
+      cum2[nends] = cum2[nends-1] + mass2_half;
+      nends++;
+    }
+    i = ends[nends-1];
+    // Increase the step size if the error is well within tolerance.  The local
+    // error grows with the square of the step size, so each doubling of the
+    // step doubles the error relative to the step's tolerance.  Grow by at most
+    // a factor of 8 per step.
+    for (int g=0; g<3; g++) {
+      if (err*4 > tol*step/nsteps)
+        break;
+      step *= 2;
+      err *= 2;
+    }
+  }
+  // Linearly interpolate the cumulative probability onto each timestep, and
+  // then find the probability within each timestep.
+  pdfchoice1[0] = 0;
+  pdfchoice2[0] = 0;
+  double prev1 = 0, prev2 = 0, curr1, curr2;
+  int e = 0;
+  for (int t=1; t<Tsteps; t++) {
+    while (e < nends-1 && ends[e+1] < t)
+      e++;
+    if (e >= nends-1) {
+      curr1 = cum1[nends-1];
+      curr2 = cum2[nends-1];
+    } else {
+      double frac = (double)(t - ends[e])/(ends[e+1] - ends[e]);
+      curr1 = cum1[e] + frac*(cum1[e+1] - cum1[e]);
+      curr2 = cum2[e] + frac*(cum2[e+1] - cum2[e]);
+    }
+    pdfchoice1[t] = curr1 - prev1;
+    pdfchoice2[t] = curr2 - prev2;
+    prev1 = curr1;
+    prev2 = curr2;
+  }
+  // Normalize pdfchoice1 and pdfchoice2, and scale the output to make it a
+  // pdf, not a pmf
+  double sumpdfs = 0;
+  for (int t=0; t<Tsteps; t++)
+    sumpdfs += pdfchoice1[t] + pdfchoice2[t];
+  double scale = (sumpdfs > 1) ? 1/(sumpdfs*dt) : 1/dt;
+  for (int t=0; t<Tsteps; t++) {
+    pdfchoice1[t] *= scale;
+    pdfchoice2[t] *= scale;
+  }
+  for (int level=0; level<nlevels; level++)
+    free(factored[level]);
+  free(factored);
+  free(DU);
+  free(D);
+  free(DL);
+  free(work);
+  free(pdffull);
+  free(pdfhalf);
+  free(pdfhalf2);
+  free(ends);
+  free(cum1);
+  free(cum2);
+  return 0;
+}
+
+
+// TR-BDF2 solver.  This mirrors Model.solve_numerical_trbdf2 in Python.  Each
+// step is a trapezoid (Crank-Nicolson) stage to t+g*dt followed by a BDF2
+// stage to t+dt.  The operator for the intermediate stage is linearly
+// interpolated between t and t+dt.  Collapsing bounds are handled as in
+// _implicit_time, by weighting the solutions on the grids on either side of
+// the bound.  "tol" is unused.  Arguments are otherwise the same as for
+// _implicit_time.
+int _trbdf2_time(int Tsteps, double *pdfchoice1, double *pdfchoice2, double *pdfcurr, double* drift, double* noise, double *bound, double *ic, int Xsteps, double dt, double dx, unsigned int drift_mode, unsigned int noise_mode, unsigned int bound_mode, double tol) {
+  int dmultt=0, dmultx=0, nmultt=0, nmultx=0, bmultt=0;
+  const double g = 2 - sqrt(2);
+  const double w = (1-g)/(2-g);
+  const double a = 1/(g*(2-g));
+  const double b = (1-g)*(1-g)/(g*(2-g));
+  double dxinv = 1/dx;
+  _mode_multipliers(drift_mode, Xsteps, &dmultt, &dmultx);
+  _mode_multipliers(noise_mode, Xsteps, &nmultt, &nmultx);
+  bmultt = (bound_mode == 0) ? 0 : 1;
+  double bound_max = bound[0];
+  for (int i=1; i<Tsteps*bmultt; i++)
+    if (bound[i] > bound_max)
+      bound_max = bound[i];
+  // Operators at the start (0) and end (1) of the step, the matrices for each
+  // stage (A for the trapezoid stage and B for the BDF2 stage), and scratch
+  // space for the intermediate and next distributions.
+  double *DL0 = (double*)malloc(Xsteps*sizeof(double));
+  double *D0 = (double*)malloc(Xsteps*sizeof(double));
+  double *DU0 = (double*)malloc(Xsteps*sizeof(double));
+  double *DL1 = (double*)malloc(Xsteps*sizeof(double));
+  double *D1 = (double*)malloc(Xsteps*sizeof(double));
+  double *DU1 = (double*)malloc(Xsteps*sizeof(double));
+  double *DLA = (double*)malloc(Xsteps*sizeof(double));
+  double *DA = (double*)malloc(Xsteps*sizeof(double));
+  double *DUA = (double*)malloc(Xsteps*sizeof(double));
+  double *DLB = (double*)malloc(Xsteps*sizeof(double));
+  double *DB = (double*)malloc(Xsteps*sizeof(double));
+  double *DUB = (double*)malloc(Xsteps*sizeof(double));
+  double *pdfmid = (double*)malloc(Xsteps*sizeof(double));
+  double *pdfnext = (double*)malloc(Xsteps*sizeof(double));
+  double *pdfprev = (double*)malloc(Xsteps*sizeof(double));
+  memset(pdfchoice1, 0, Tsteps*sizeof(double));
+  memset(pdfchoice2, 0, Tsteps*sizeof(double));
+  for (int j=0; j<Xsteps; j++)
+    pdfcurr[j] = ic[j];
+  // If nothing depends on time, the matrices are the same on each timestep, so
+  // only construct (and factorize) them once.
+  int time_invariant = (dmultt == 0 && nmultt == 0 && bmultt == 0);
+  double flux1_0=0, flux1_1=0, flux2_0=0, flux2_1=0;
+  for (int i=0; i<Tsteps-1; i++) {
+    // Sum the current pdf and exit if it is small
+    double sumpdfcurr = 0;
+    for (int j=0; j<Xsteps; j++)
+      sumpdfcurr += pdfcurr[j];
+    if (sumpdfcurr < .0001)
+      break;
+    for (int j=0; j<Xsteps; j++) {
+      pdfprev[j] = pdfcurr[j];
+      pdfcurr[j] = 0;
+    }
+    // Compute bound indices and weights, as in _implicit_time
+    double bound_shift = bound_max - bound[i*bmultt];
+    int shifts[2];
+    double weights[2];
+    shifts[0] = (int)floor(1e-10*round(bound_shift*dxinv*1e10));
+    shifts[1] = (int)ceil(1e-10*round(bound_shift*dxinv*1e10));
+    weights[1] = (bound_shift - shifts[0]*dx)*dxinv;
+    weights[0] = 1 - weights[1];
+    for (int s=0; s<2; s++) {
+      int shift = shifts[s];
+      int first = shift;
+      int last = Xsteps-1-shift;
+      int n = Xsteps-2*shift;
+      if (weights[s] == 0 || n <= 0)
+        continue;
+      // Probability outside the bounds is considered a decision
+      for (int j=0; j<shift; j++)
+        pdfchoice2[i+1] += weights[s]*pdfprev[j];
+      for (int j=last+1; j<Xsteps; j++)
+        pdfchoice1[i+1] += weights[s]*pdfprev[j];
+      if (i == 0 || !time_invariant) {
+        _fill_operator(DL0, D0, DU0, drift, dmultt, dmultx, noise, nmultt, nmultx, i, shift, Xsteps, dt, dx, 1);
+        _fill_operator(DL1, D1, DU1, drift, dmultt, dmultx, noise, nmultt, nmultx, i+1, shift, Xsteps, dt, dx, 1);
+        for (int j=first; j<=last; j++) {
+          DA[j] = 1 + .5*g*((1-g)*D0[j] + g*D1[j]);
+          DB[j] = 1 + w*D1[j];
+        }
+        for (int j=first; j<last; j++) {
+          DLA[j] = .5*g*((1-g)*DL0[j] + g*DL1[j]);
+          DUA[j] = .5*g*((1-g)*DU0[j] + g*DU1[j]);
+          DLB[j] = w*DL1[j];
+          DUB[j] = w*DU1[j];
+        }
+        easy_dgtsv_factor(n, DLA+shift, DA+shift, DUA+shift);
+        easy_dgtsv_factor(n, DLB+shift, DB+shift, DUB+shift);
+        flux1_0 = _boundary_flux(drift, dmultt, dmultx, noise, nmultt, nmultx, i, last, 1, dt, dx);
+        flux1_1 = _boundary_flux(drift, dmultt, dmultx, noise, nmultt, nmultx, i+1, last, 1, dt, dx);
+        flux2_0 = _boundary_flux(drift, dmultt, dmultx, noise, nmultt, nmultx, i, first, -1, dt, dx);
+        flux2_1 = _boundary_flux(drift, dmultt, dmultx, noise, nmultt, nmultx, i+1, first, -1, dt, dx);
+      }
+      // Trapezoid stage: (I + g/2 M_g) p_mid = (I - g/2 M_0) p
+      for (int j=first; j<=last; j++) {
+        double Mp = D0[j]*pdfprev[j];
+        if (j < last)
+          Mp += DU0[j]*pdfprev[j+1];
+        if (j > first)
+          Mp += DL0[j-1]*pdfprev[j-1];
+        pdfmid[j] = pdfprev[j] - .5*g*Mp;
+      }
+      easy_dgtsv_factored(n, DLA+shift, DA+shift, DUA+shift, pdfmid+shift);
+      // BDF2 stage: (I + w M_1) p_next = a p_mid - b p
+      for (int j=first; j<=last; j++)
+        pdfnext[j] = a*pdfmid[j] - b*pdfprev[j];
+      easy_dgtsv_factored(n, DLB+shift, DB+shift, DUB+shift, pdfnext+shift);
+      // Integrate the flux with the same quadrature as the scheme
+      pdfchoice1[i+1] += weights[s]*(a*g/2*(flux1_0*pdfprev[last] + ((1-g)*flux1_0+g*flux1_1)*pdfmid[last]) + w*flux1_1*pdfnext[last]);
+      pdfchoice2[i+1] += weights[s]*(a*g/2*(flux2_0*pdfprev[first] + ((1-g)*flux2_0+g*flux2_1)*pdfmid[first]) + w*flux2_1*pdfnext[first]);
+      for (int j=first; j<=last; j++)
+        pdfcurr[j] += weights[s]*pdfnext[j];
+    }
+    // Renormalize when the channel size has <1 grid
+    if (bound[i*bmultt] < dx) {
+      pdfchoice1[i+1] *= 2 - bound[i*bmultt]/dx;
+      pdfchoice2[i+1] *= 2 - bound[i*bmultt]/dx;
+    }
+  }
+  // Normalize pdfchoice1 and pdfchoice2, and scale the output to make it a
+  // pdf, not a pmf
+  double sumpdfs = 0;
+  for (int i=0; i<Tsteps; i++)
+    sumpdfs += pdfchoice1[i] + pdfchoice2[i];
+  double scale = (sumpdfs > 1) ? 1/(sumpdfs*dt) : 1/dt;
+  for (int i=0; i<Tsteps; i++) {
+    pdfchoice1[i] *= scale;
+    pdfchoice2[i] *= scale;
+  }
+  free(DL0);
+  free(D0);
+  free(DU0);
+  free(DL1);
+  free(D1);
+  free(DU1);
+  free(DLA);
+  free(DA);
+  free(DUA);
+  free(DLB);
+  free(DB);
+  free(DUB);
+  free(pdfmid);
+  free(pdfnext);
+  free(pdfprev);
+  return 0;
+}
+
+
+// Backward Euler on a non-uniform grid.  This mirrors
+// Model.solve_numerical_graded in Python, using the matrices from
+// Drift.get_matrix and Noise.get_matrix when "dx" is an array.  Each grid point
+// holds the probability within a cell extending halfway to its neighbors.  See
+// graded_time for the arguments.
+void _graded_time(int Tsteps, double *mass1, double *mass2, double *pdfcurr, double *drift, double *noise, double *ic, double *spacing, int Xsteps, double dt, unsigned int drift_mode, unsigned int noise_mode) {
+  int dmultt=0, dmultx=0, nmultt=0, nmultx=0;
+  _mode_multipliers(drift_mode, Xsteps, &dmultt, &dmultx);
+  _mode_multipliers(noise_mode, Xsteps, &nmultt, &nmultx);
+  double *width = (double*)malloc(Xsteps*sizeof(double));
+  double *DU = (double*)malloc((Xsteps-1)*sizeof(double));
+  double *D = (double*)malloc(Xsteps*sizeof(double));
+  double *DL = (double*)malloc((Xsteps-1)*sizeof(double));
+  int last = Xsteps-1;
+  width[0] = spacing[0];
+  width[last] = spacing[last-1];
+  for (int j=1; j<last; j++)
+    width[j] = .5*(spacing[j]+spacing[j-1]);
+  memset(mass1, 0, Tsteps*sizeof(double));
+  memset(mass2, 0, Tsteps*sizeof(double));
+  for (int j=0; j<Xsteps; j++)
+    pdfcurr[j] = ic[j];
+  double flux_upper = 0, flux_lower = 0;
+  int time_invariant = (dmultt == 0 && nmultt == 0);
+  for (int i=0; i<Tsteps-1; i++) {
+    double sumpdfcurr = 0;
+    for (int j=0; j<Xsteps; j++)
+      sumpdfcurr += pdfcurr[j];
+    if (sumpdfcurr < .0001)
+      break;
+    if (i == 0 || !time_invariant) {
+      double *dr = drift + i*dmultt;
+      double *nz = noise + i*nmultt;
+      for (int j=0; j<Xsteps; j++)
+        D[j] = 1;
+      // Drift, as in Drift.get_matrix
+      for (int j=0; j<last; j++) {
+        DU[j] = .5*dt * dr[(j+1)*dmultx]/width[j+1];
+        DL[j] = -.5*dt * dr[j*dmultx]/width[j];
+      }
+      D[last] += DU[last-1];
+      D[0] += DL[0];
+      DU[last-1] = 0;
+      DL[0] = 0;
+      // Noise, as in Noise.get_matrix.  The boundary correction moves the
+      // flux between the outermost cells onto the diagonal.
+      for (int j=0; j<last; j++) {
+        double edge = .5*(nz[j*nmultx]+nz[(j+1)*nmultx]);
+        double out_right = .5*dt * edge*edge/(spacing[j]*width[j]);
+        double out_left = .5*dt * edge*edge/(spacing[j]*width[j+1]);
+        D[j] += out_right;
+        D[j+1] += out_left;
+        if (j == 0)
+          D[0] -= out_right;
+        else
+          DL[j] -= out_right;
+        if (j == last-1)
+          D[last] -= out_left;
+        else
+          DU[j] -= out_left;
+      }
+      D[0] += .5*dt * nz[0]*nz[0]/(spacing[0]*width[0]);
+      D[last] += .5*dt * nz[last*nmultx]*nz[last*nmultx]/(spacing[last-1]*width[last]);
+      // Flux across each bound, as in Drift.get_flux and Noise.get_flux
+      flux_lower = -.5*dt/spacing[0] * dr[0] + .5*dt/(spacing[0]*spacing[0]) * nz[0]*nz[0];
+      flux_upper = .5*dt/spacing[last-1] * dr[last*dmultx] + .5*dt/(spacing[last-1]*spacing[last-1]) * nz[last*nmultx]*nz[last*nmultx];
+      if (time_invariant)
+        easy_dgtsv_factor(Xsteps, DL, D, DU);
+    }
+    if (time_invariant)
+      easy_dgtsv_factored(Xsteps, DL, D, DU, pdfcurr);
+    else
+      easy_dgtsv(Xsteps, DL, D, DU, pdfcurr);
+    mass1[i+1] = flux_upper*pdfcurr[last];
+    mass2[i+1] = flux_lower*pdfcurr[0];
+  }
+  free(width);
+  free(DU);
+  free(D);
+  free(DL);
+}
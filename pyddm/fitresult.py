@@ -23,6 +23,10 @@ class FitResult:
     - properties: a dictionary containing any additional values saved
       by the loss function or fitting procedure (e.g. "likelihood" for
       BIC loss function, or "mess" for a message describing the output).
+      fit_adjust_model() saves the number of times the loss function was
+      evaluated ("evaluations"), and how many of these evaluations
+      repeated previous parameters and so did not need to solve the
+      model ("duplicate_evaluations").
 
     So, for example, can access FitResult.method to get the name of
     the numerical algorithm used to solve the equation.
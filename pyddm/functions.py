@@ -11,6 +11,7 @@ __all__ = ['models_close', 'fit_model', 'fit_adjust_model',
 
 import copy
 import logging
+import multiprocessing.pool
 import numpy as np
 from scipy.optimize import minimize, basinhopping, differential_evolution, OptimizeResult
 
@@ -21,8 +22,8 @@ from .models.drift import DriftConstant
 from .models.noise import NoiseConstant
 from .models.ic import ICPointSourceCenter
 from .models.bound import BoundConstant
-from .models.overlay import OverlayNone, OverlayChain
-from .models.loss import LossLikelihood
+from .models.overlay import OverlayNone, OverlayChain, _defined_together
+from .models.loss import LossLikelihood, LossRobustLikelihood
 from .logger import logger as _logger
 
 from paranoid.types import Boolean, Number, String, Set, Unchecked, Natural1, Maybe
@@ -31,25 +32,111 @@ from paranoid.settings import Settings as paranoid_settings
 from .models.paranoid_types import Conditions
 
 from .fitresult import FitResult, FitResultEmpty
+from .cache import get_solution_cache, get_pre_overlay_cache, get_solution_store
 
 # For parallelization support
 _parallel_pool = None # Note: do not change this directly.  Call set_N_cpus() instead.
 #@accepts(Natural1)
 #@paranoidconfig(enabled=False)
-def set_N_cpus(N):
+def set_N_cpus(N, backend="process"):
+    """Solve models for different conditions in parallel using `N` CPUs.
+
+    `backend` may be "process" (the default), "thread", or "resident".
+    The "process" backend runs each solver in a separate process using
+    pathos, which works for any model but must copy the model to the
+    worker processes each time it is solved.  The "thread" backend runs
+    the solvers in threads within the current process, avoiding this
+    overhead.  Since the C solvers run without holding Python's global
+    interpreter lock, this is usually faster for models which can use
+    the C solvers, but gives little speedup for models which must be
+    solved in Python.  The "resident" backend also uses separate
+    processes, but each process keeps its own copy of the model, so only
+    the parameter values are sent to the processes when the model is
+    solved, and only the response time distributions are sent back.
+    This is the most efficient backend for fitting models which must be
+    solved in Python.
+    """
     global _parallel_pool
+    if backend not in ["process", "thread", "resident"]:
+        raise ValueError("Invalid backend "+str(backend)+", must be 'process', 'thread', or 'resident'")
     if _parallel_pool is not None:
         _parallel_pool.close()
     if N != 1:
+        if backend == "thread":
+            _parallel_pool = multiprocessing.pool.ThreadPool(N)
+        elif backend == "resident":
+            _parallel_pool = _ResidentPool(N)
+        else:
+            try:
+                import pathos
+            except ImportError:
+                raise ImportError("Parallel support requires pathos.  Please install pathos.")
+            #_parallel_pool = pathos.multiprocessing.Pool(N)
+            _parallel_pool = pathos.pools._ProcessPool(N)
+        _parallel_pool.n_cpus = N
+        _parallel_pool.backend = backend
+    else:
+        _parallel_pool = None
+
+class _ResidentPool:
+    """A process pool where each process keeps a copy of a model.
+
+    The model is sent to the processes once, when the pool starts.
+    After that, solving the model only requires sending the parameter
+    values.  If a model is solved which differs in anything other than
+    its parameter values, the pool is restarted with the new model.
+    """
+    def __init__(self, N):
+        self.n_cpus = N
+        self.backend = "resident"
+        self.pool = None
+        self.model = None # Our copy of the model in the processes
+    def load(self, model):
+        """Make sure the processes have a copy of `model`."""
+        params = [float(p) for p in model.get_model_parameters()]
+        if self.model is not None and type(self.model) is type(model) \
+           and len(self.model.get_model_parameters()) == len(params):
+            self.model.set_model_parameters(params)
+            if self.model.dependencies == model.dependencies and \
+               (self.model.dx, self.model.dt, self.model.T_dur) == (model.dx, model.dt, model.T_dur):
+                return
+        self.close()
         try:
             import pathos
         except ImportError:
             raise ImportError("Parallel support requires pathos.  Please install pathos.")
-        #_parallel_pool = pathos.multiprocessing.Pool(N)
-        _parallel_pool = pathos.pools._ProcessPool(N)
-        _parallel_pool.n_cpus = N
+        self.model = copy.deepcopy(model)
+        self.pool = pathos.pools._ProcessPool(self.n_cpus, initializer=_resident_init, initargs=(self.model,))
+    def map(self, f, args):
+        return self.pool.map(f, args, chunksize=1)
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+        self.pool = None
+        self.model = None
+
+_resident_model = None # The copy of the model in each process of a _ResidentPool
+def _resident_init(model):
+    global _resident_model
+    _resident_model = model
+
+def _resident_solve(args):
+    """Solve the model in a process of a _ResidentPool.
+
+    `args` is a tuple of the parameter values, the list of conditions
+    to solve, the method (as in solve_all_conditions), and whether
+    paranoid verification is enabled.  Returns a list of the arrays
+    describing each Solution.
+    """
+    params, conds, method, paranoid_enabled = args
+    paranoid_settings.set(enabled=paranoid_enabled)
+    _resident_model.set_model_parameters(params)
+    if method is None:
+        sols = _resident_model.solve_batch(conds)
     else:
-        _parallel_pool = None
+        meth = _get_solver(_resident_model, method)
+        sols = {frozenset(c.items()) : meth(conditions=c) for c in conds}
+    return [(s.choice_upper, s.choice_lower, s.undec) for s in (sols[frozenset(c.items())] for c in conds)]
 
 @accepts(Model, Model, tol=Number)
 @requires("m1.get_model_type() == m2.get_model_type()")
@@ -142,6 +229,14 @@ def fit_model(sample,
     special cases, changing the method is unlikely to give faster or
     more reliable estimation.
 
+    "lbfgs" is the L-BFGS-B method, a local search which uses the
+    gradient of the loss function.  For the likelihood and BIC loss
+    functions, the gradient is computed by get_model_loss_gradient(),
+    which solves the model with the implicit method and costs about as
+    much as one more solve, so `method` is ignored.  Otherwise, the
+    gradient is estimated numerically, which requires a solve for each
+    parameter.  Like "simplex", it needs a good starting position.
+
     `fitparams` is a dictionary of kwargs to be passed directly to the
     minimization routine for fine-grained low-level control over the
     optimization.  Normally this should not be needed.  
@@ -188,7 +283,7 @@ def fit_model(sample,
 
 
 def fit_adjust_model(sample, model, fitparams=None, fitting_method="differential_evolution",
-                     lossfunction=LossLikelihood, verify=False, method=None, verbose=True):
+                     lossfunction=LossLikelihood, verify=False, method=None, verbose=True, refine=False):
     """Modify parameters of a model which has already been fit.
     
     The data `sample` should be a Sample object of the reaction times
@@ -216,6 +311,14 @@ def fit_adjust_model(sample, model, fitparams=None, fitting_method="differential
     special cases, changing the method is unlikely to give faster or
     more reliable estimation.
 
+    "lbfgs" is the L-BFGS-B method, a local search which uses the
+    gradient of the loss function.  For the likelihood and BIC loss
+    functions, the gradient is computed by get_model_loss_gradient(),
+    which solves the model with the implicit method and costs about as
+    much as one more solve, so `method` is ignored.  Otherwise, the
+    gradient is estimated numerically, which requires a solve for each
+    parameter.  Like "simplex", it needs a good starting position.
+
     `fitparams` is a dictionary of kwargs to be passed directly to the
     minimization routine for fine-grained low-level control over the
     optimization.  Normally this should not be needed.  
@@ -232,11 +335,21 @@ def fit_adjust_model(sample, model, fitparams=None, fitting_method="differential
     does not re-enable it.
 
     `method` gives the method used to solve the model, and can be
-    "analytical", "numerical", "cn", "implicit", or "explicit".
+    "analytical", "numerical", "cn", "implicit", "explicit",
+    "spectral", "adaptive", "trbdf2", "graded", "lookup", or
+    "surrogate".
 
     `verbose` enables out-of-boundaries warnings and prints the model
     information at each evaluation of the fitness function.
 
+    If `refine` is True, the fit is then refined using the exact solver
+    (method=None), by a local search (the "simplex" fitting method)
+    starting from the fitted parameters.  This is useful when `method`
+    is an approximation, such as "surrogate" or "lookup": the
+    approximation finds the region of the best fit quickly, and the
+    exact solver only needs a few evaluations to finish the fit.  The
+    FitResult then describes the refined fit.
+
     Returns the same model object that was passed to it as an
     argument.  However, the parameters will be modified.  The model is
     modified in place, so a reference is returned to it for
@@ -329,10 +442,17 @@ def fit_adjust_model(sample, model, fitparams=None, fitting_method="differential
     lf = lossfunction(sample, required_conditions=required_conditions,
                       T_dur=m.T_dur, dt=m.dt, method=method,
                       nparams=len(params), samplesize=len(sample))
+    # Optimizers often evaluate the same parameters more than once,
+    # e.g. when polishing or after clipping to the bounds, so remember
+    # the loss for each (clipped) set of parameters.  Count the number
+    # of evaluations and how many of these were repeated.
+    evaluated = {}
+    counts = {"evaluations": 0, "duplicate_evaluations": 0}
     # A function for the solver to minimize.  Since the model is in
     # this scope, we can make use of it by using, for example, the
     # model `m` defined previously.
-    def _fit_model(xs):
+    def _set_parameters(xs):
+        clipped = []
         for x,p,s in zip(xs, params, setters):
             # Sometimes the numpy optimizers will ignore bounds up to
             # floating point errors, i.e. if your upper bound is 1,
@@ -347,10 +467,41 @@ def fit_adjust_model(sample, model, fitparams=None, fitting_method="differential
                     _logger.warning("Optimizer went out of bounds.  Setting %f to %f" % (x, p.minval))
                 x = p.minval
             s(m, x)
+            clipped.append(float(x))
+        return tuple(clipped)
+    def _fit_model(xs):
+        counts["evaluations"] += 1
+        key = _set_parameters(xs)
+        if key in evaluated:
+            counts["duplicate_evaluations"] += 1
+            return evaluated[key]
         lossf = lf.loss(m)
+        if len(evaluated) >= 100000:
+            evaluated.clear()
+        evaluated[key] = lossf
         if verbose:
             _logger.info(repr(m) + " loss="+ str(lossf))
         return lossf
+    # The same, but also returning the gradient, for the "lbfgs"
+    # fitting method.
+    def _fit_model_gradient(xs):
+        counts["evaluations"] += 1
+        key = _set_parameters(xs)
+        if key in evaluated:
+            counts["duplicate_evaluations"] += 1
+            return evaluated[key]
+        lossf, gradient = _loss_gradient(m, lf)
+        # L-BFGS-B cannot recover from an infinite loss, e.g. from a
+        # non-decision time longer than the shortest RT, so use the
+        # robust likelihood instead, which is finite but large.
+        if not np.isfinite(lossf):
+            lossf, gradient = _loss_gradient(m, lf, robustness=LossRobustLikelihood._robustness_param)
+        if len(evaluated) >= 100000:
+            evaluated.clear()
+        evaluated[key] = (lossf, gradient)
+        if verbose:
+            _logger.info(repr(m) + " loss="+ str(lossf))
+        return lossf, gradient
     # Cast to a dictionary if necessary
     if fitparams is None:
         fitparams = {}
@@ -368,6 +519,16 @@ def fit_adjust_model(sample, model, fitparams=None, fitting_method="differential
         x_fit = differential_evolution(_fit_model, constraints, **fitparams)
     elif fitting_method == "hillclimb":
         x_fit = evolution_strategy(_fit_model, x_0, **fitparams)
+    elif fitting_method == "lbfgs":
+        # Import here to avoid recursion
+        from .adjoint import _loss_gradient, _unsupported
+        reason = _unsupported(m, lf)
+        if reason is None:
+            x_fit = minimize(_fit_model_gradient, x_0, jac=True, method="L-BFGS-B", bounds=constraints, **fitparams)
+            method = "implicit"
+        else:
+            _logger.warning(reason + ", so the gradient will be estimated numerically")
+            x_fit = minimize(_fit_model, x_0, method="L-BFGS-B", bounds=constraints, **fitparams)
     elif callable(fitting_method):
         x_fit = fitting_method(_fit_model, x_0=x_0, constraints=constraints)
     else:
@@ -375,7 +536,8 @@ def fit_adjust_model(sample, model, fitparams=None, fitting_method="differential
     res = FitResult(method=(method if method is not None else "auto"),
                     fitting_method=fitting_method, loss=lf.name, value=x_fit.fun,
                     nparams=len(params), samplesize=len(sample),
-                    mess=(x_fit.message if "message" in x_fit.__dict__ else ""))
+                    mess=(x_fit.message if "message" in x_fit.__dict__ else ""),
+                    **counts)
     m.fitresult = res
     _logger.info("Params " + str(x_fit.x) + " gave " + str(x_fit.fun))
     for x,s in zip(x_fit.x, setters):
@@ -383,6 +545,9 @@ def fit_adjust_model(sample, model, fitparams=None, fitting_method="differential
     if not verify:
         paranoid_settings.set(enabled=paranoid_state)
         param.renorm_warnings = renorm_warnings_state
+    if refine:
+        fit_adjust_model(sample, m, fitting_method="simplex", lossfunction=lossfunction,
+                         verify=verify, method=None, verbose=verbose)
     return m
 
 def evolution_strategy(fitness, x_0, mu=1, lmbda=3, copyparents=True, mutate_var=.002, mutate_prob=.5, evals=100, seed=None):
@@ -461,9 +626,41 @@ def evolution_strategy(fitness, x_0, mu=1, lmbda=3, copyparents=True, mutate_var
                 P.append((new, fit))
     return OptimizeResult(x=np.asarray(best[0]), success=True, fun=best[1], nit=it)
 
-#@accepts(Model, Sample, Conditions, Unchecked, Set(["analytical", "numerical", "cn", "implicit", "explicit"]))
+def _get_solver(model, method):
+    """The method of `model` which solves it using the solver `method`.
+
+    `method` is a string as described in solve_all_conditions.
+    """
+    if method is None:
+        return model.solve
+    elif method == "analytical":
+        return model.solve_analytical
+    elif method == "numerical":
+        return model.solve_numerical
+    elif method == "cn":
+        return model.solve_numerical_cn
+    elif method == "implicit":
+        return model.solve_numerical_implicit
+    elif method == "explicit":
+        return model.solve_numerical_explicit
+    elif method == "spectral":
+        return model.solve_numerical_spectral
+    elif method == "adaptive":
+        return model.solve_numerical_adaptive
+    elif method == "trbdf2":
+        return model.solve_numerical_trbdf2
+    elif method == "graded":
+        return model.solve_numerical_graded
+    elif method == "lookup":
+        return model.solve_lookup
+    elif method == "surrogate":
+        return model.solve_surrogate
+    else:
+        raise ValueError("Invalid method "+method)
+
+#@accepts(Model, Sample, Conditions, Unchecked, Set(["analytical", "numerical", "cn", "implicit", "explicit", "spectral", "adaptive", "trbdf2", "graded", "lookup", "surrogate"]))
 #@returns(Unchecked)
-def solve_all_conditions(model, sample=None, condition_combinations=None, method=None):
+def solve_all_conditions(model, sample=None, condition_combinations=None, method=None, horizons=None):
     """Solve the model for all relevant conditions.
 
     This takes the following parameters (note that there are two legal
@@ -479,7 +676,17 @@ def solve_all_conditions(model, sample=None, condition_combinations=None, method
       outputs). Conditions must be the same as the required conditions in
       `model`. Conditions may equivalently be specified via `sample`.
     - `method` - A string describing the solver method.  Can be
-      "analytical", "numerical", "cn", "implicit", or "explicit".
+      "analytical", "numerical", "cn", "implicit", "explicit",
+      "spectral", "adaptive", "trbdf2", "graded", "lookup", or
+      "surrogate".
+    - `horizons` - Optionally, a dictionary indexed by a frozenset of
+      condition names and values (like the return value), giving the
+      latest response time which is needed for these conditions.  The
+      model is then only solved until shortly after this time, and the
+      pdfs are zero afterwards, with the remaining probability
+      undecided.  This is only done for overlays which support it (see
+      Overlay.min_delay).  Conditions which are not in `horizons` are
+      solved until T_dur.
 
     For each combination of relevant condition-values, this will solve the
     model for that "condition combination." It returns a dictionary indexed
@@ -490,7 +697,8 @@ def solve_all_conditions(model, sample=None, condition_combinations=None, method
          frozenset({('reward', 1)}): <Solution object>}
 
     This function will automatically parallelize if set_N_cpus() has
-    been called.
+    been called, and will use previously computed Solutions if
+    set_solution_cache() or set_solution_store() has been called.
     """
     if sample is not None and condition_combinations is None:
         conds = sample.condition_combinations(required_conditions=model.required_conditions)
@@ -502,26 +710,172 @@ def solve_all_conditions(model, sample=None, condition_combinations=None, method
     else:
         raise ValueError("Cannot specify both `sample` and `condition_combinations` for solve_all_conditions().")
 
-    if method is None:
-        meth = model.solve
-    elif method == "analytical":
-        meth = model.solve_analytical
-    elif method == "numerical":
-        meth = model.solve_numerical
-    elif method == "cn":
-        meth = model.solve_numerical_cn
-    elif method == "implicit":
-        meth = model.solve_numerical_implicit
-    elif method == "explicit":
-        meth = model.solve_numerical_explicit
-    else:
-        raise ValueError("Invalid method "+method)
+    # Surrogate Solutions are fast, include the overlay, and depend on
+    # the surrogate as well as the model, so they are not cached.
+    if method == "surrogate":
+        return {frozenset(c.items()) : model.solve_surrogate(conditions=c) for c in conds}
+    if horizons is not None:
+        return _solve_truncated_conditions(model, conds, method, horizons)
+    solution_cache = get_solution_cache()
+    if solution_cache is None:
+        return _solve_stored_conditions(model, conds, method)
+    # Only solve the conditions which are not in the cache
+    keys = {frozenset(c.items()) : solution_cache.key(model, c, method) for c in conds}
+    sols = {}
+    for c in conds:
+        sol = solution_cache.get(keys[frozenset(c.items())])
+        if sol is not None:
+            sols[frozenset(c.items())] = sol
+    missing = [c for c in conds if frozenset(c.items()) not in sols]
+    if len(missing) > 0:
+        for k,sol in _solve_stored_conditions(model, missing, method).items():
+            solution_cache.put(keys[k], sol)
+            sols[k] = sol
+    return sols
+
+def _solve_truncated_conditions(model, conds, method, horizons):
+    """Solve `model` for each of the conditions in the list `conds`,
+    only until the times in `horizons` (see solve_all_conditions).
+
+    The model is solved with a shorter T_dur, and the pdfs are then
+    extended with zeros.  To reduce the number of different T_dur values
+    (which cannot be solved together by solve_batch), the horizons are
+    rounded up to a multiple of a tenth of T_dur.
+    """
+    # Subclasses which override the solver may use the full T_dur.
+    solver = _get_solver(model, method)
+    if solver.__func__ is not getattr(Model, solver.__name__, None):
+        return solve_all_conditions(model, condition_combinations=conds, method=method)
+    n_steps = len(model.t_domain()) - 1
+    groups = {} # Number of timesteps -> list of conditions
+    for c in conds:
+        steps = _horizon_steps(model, c, horizons.get(frozenset(c.items())))
+        groups.setdefault(steps, []).append(c)
+    sols = {}
+    for steps,group in groups.items():
+        truncated = copy.copy(model)
+        truncated.T_dur = steps*model.dt
+        # Memoized values are keyed by T_dur, so they can be shared.
+        truncated._memo = model.__dict__.setdefault("_memo", {})
+        # Increasing bounds would give a different x domain
+        if steps == n_steps or any(len(truncated.x_domain(c)) != len(model.x_domain(c)) for c in group):
+            sols.update(solve_all_conditions(model, condition_combinations=group, method=method))
+            continue
+        for k,sol in solve_all_conditions(truncated, condition_combinations=group, method=method).items():
+            padding = n_steps - steps
+            sols[k] = Solution(np.pad(sol.choice_upper, (0, padding), "constant"), np.pad(sol.choice_lower, (0, padding), "constant"),
+                               model, conditions=sol.conditions, pdf_undec=sol.undec)
+    return sols
+
+def _horizon_steps(model, conditions, horizon):
+    """The number of timesteps for which `model` must be solved under
+    `conditions` to find the pdfs up to time `horizon`.
+
+    This is rounded up to a multiple of a tenth of the number of
+    timesteps in T_dur, and is never more than that number.  If
+    `horizon` is None or the overlay does not define min_delay, all of
+    the timesteps are needed.  Subclasses which redefine "apply" but
+    inherit min_delay may no longer only delay responses, so they also
+    need all of the timesteps.
+    """
+    n_steps = len(model.t_domain()) - 1
+    overlay = model.get_dependence("overlay")
+    if horizon is None or not _defined_together(overlay, "min_delay", "apply"):
+        return n_steps
+    delay = overlay.min_delay(conditions)
+    if delay is None:
+        return n_steps
+    step = max(1, n_steps//10)
+    # One extra timestep for overlays which round the delay
+    needed = int(np.ceil((horizon - min(delay, 0))/model.dt)) + 1
+    return min(n_steps, int(np.ceil(needed/step))*step)
+
+def _solve_stored_conditions(model, conds, method):
+    """Solve `model` for each of the conditions in the list `conds`,
+    loading Solutions from the SolutionStore if possible."""
+    store = get_solution_store()
+    if store is None:
+        return _solve_conditions(model, conds, method)
+    keys = {frozenset(c.items()) : store.key(model, c, method) for c in conds}
+    sols = {}
+    for c in conds:
+        sol = store.load(keys[frozenset(c.items())], model, c)
+        if sol is not None:
+            sols[frozenset(c.items())] = sol
+    missing = [c for c in conds if frozenset(c.items()) not in sols]
+    if len(missing) > 0:
+        for k,sol in _solve_conditions(model, missing, method).items():
+            store.save(keys[k], sol)
+            sols[k] = sol
+    return sols
+
+def _solve_conditions(model, conds, method):
+    """Solve `model` for each of the conditions in the list `conds`.
+
+    This is solve_all_conditions(), without checking the cache.  The
+    model is solved without its overlay once for each combination of the
+    conditions required by the drift, noise, bound, and initial
+    condition, and the overlay is then applied for each combination in
+    `conds`.  If only the overlay's parameters have changed since these
+    conditions were last solved, the Solutions before the overlay are
+    reused.
+    """
+    # Subclasses which override solve() may not apply the overlay last.
+    if isinstance(model.get_dependence("overlay"), OverlayNone) or \
+       (method is None and type(model).solve is not Model.solve):
+        return _run_solver(model, conds, method)
+    raw_model = model._without_overlay()
+    core = lambda c : frozenset((k,v) for k,v in c.items() if k in raw_model.required_conditions)
+    core_conds = [dict(cc) for cc in dict.fromkeys(core(c) for c in conds)]
+    cache = get_pre_overlay_cache()
+    sols = {}
+    if cache is not None:
+        keys = {frozenset(c.items()) : cache.key(raw_model, c, method) for c in core_conds}
+        for c in core_conds:
+            sol = cache.get(keys[frozenset(c.items())])
+            if sol is not None:
+                sols[frozenset(c.items())] = sol
+    missing = [c for c in core_conds if frozenset(c.items()) not in sols]
+    if len(missing) > 0:
+        for k,sol in _run_solver(raw_model, missing, method).items():
+            if cache is not None:
+                cache.put(keys[k], sol)
+            sols[k] = sol
+    return {frozenset(c.items()) : model._apply_overlay(sols[core(c)], c) for c in conds}
+
+def _run_solver(model, conds, method):
+    """Solve `model` for each of the conditions in the list `conds`,
+    in parallel if set_N_cpus() has been called."""
+    meth = _get_solver(model, method)
 
     cache = {}
-    if _parallel_pool is None: # No parallelization
+    if _parallel_pool is None and method is None: # No parallelization, solve all conditions at once
+        return model.solve_batch(conds)
+    elif _parallel_pool is None: # No parallelization
         for c in conds:
             cache[frozenset(c.items())] = meth(conditions=c)
         return cache
+    elif _parallel_pool.backend == "resident": # Parallelize across processes which already have the model
+        _parallel_pool.load(model)
+        params = [float(p) for p in model.get_model_parameters()]
+        chunks = [ch for ch in (conds[i::_parallel_pool.n_cpus] for i in range(0, _parallel_pool.n_cpus)) if len(ch) > 0]
+        for chunk,res in zip(chunks, _parallel_pool.map(_resident_solve, [(params, ch, method, paranoid_settings.get('enabled')) for ch in chunks])):
+            for c,(choice_upper, choice_lower, undec) in zip(chunk, res):
+                cache[frozenset(c.items())] = Solution(choice_upper, choice_lower, model, conditions=c, pdf_undec=undec)
+        return cache
+    elif _parallel_pool.backend == "thread": # Parallelize across threads
+        # Threads share the model, so nothing needs to be copied.  Split
+        # the conditions evenly across threads, and solve each thread's
+        # share at once where possible.
+        if method is None:
+            chunks = [conds[i::_parallel_pool.n_cpus] for i in range(0, _parallel_pool.n_cpus)]
+            for sols in _parallel_pool.map(model.solve_batch, [ch for ch in chunks if len(ch) > 0]):
+                cache.update(sols)
+            return cache
+        sols = _parallel_pool.map(meth, conds, chunksize=1)
+        for c,s in zip(conds, sols):
+            cache[frozenset(c.items())] = s
+        return cache
     else: # Parallelize across pool
         if paranoid_settings.get('enabled') is False:
             # The *2 makes sure that this runs on all subprocesses,
@@ -534,7 +888,7 @@ def solve_all_conditions(model, sample=None, condition_combinations=None, method
 
 
 # TODO explicitly test this in unit tests
-@accepts(Model, Maybe(Sample), Maybe(Conditions), Maybe(Set(["analytical", "numerical", "cn", "implicit", "explicit"])))
+@accepts(Model, Maybe(Sample), Maybe(Conditions), Maybe(Set(["analytical", "numerical", "cn", "implicit", "explicit", "spectral", "adaptive", "trbdf2", "graded", "lookup", "surrogate"])))
 # @returns(Solution) # This doesn't actually return a solution, only a solution-like object
 @requires('sample is not None --> all((c in sample.condition_names() for c in model.required_conditions))')
 @requires('conditions is not None and sample is not None --> all((c in sample.condition_names() for c in conditions))')
@@ -566,8 +920,11 @@ def solve_partial_conditions(model, sample=None, conditions=None, method=None):
 
     Optionally, `method` describes the solver to use.  It can be
     "analytical", "numerical", "cn" (Crank-Nicolson), "implicit"
-    (backward Euler), "explicit" (forward Euler), or None
-    (auto-detect method).
+    (backward Euler), "explicit" (forward Euler), "spectral", "adaptive"
+    (backward Euler with adaptive timesteps), "trbdf2" (TR-BDF2),
+    "graded" (backward Euler on a non-uniform grid), "lookup"
+    (interpolate from a LookupTable), "surrogate" (interpolate from a
+    Surrogate), or None (auto-detect method).
 
     This function will automatically parallelize if set_N_cpus() has
     been called.
@@ -731,6 +1088,9 @@ def display_model(model, print_output=True):
         OUT += "    Solver: %s\n" % ("forward Euler" if model.fitresult.method == "explicit" \
                                      else "backward Euler" if model.fitresult.method == "implicit" \
                                      else "Crank-Nicoloson" if model.fitresult.method == "cn" \
+                                     else "TR-BDF2" if model.fitresult.method == "trbdf2" \
+                                     else "backward Euler (graded grid)" if model.fitresult.method == "graded" \
+                                     else "lookup table" if model.fitresult.method == "lookup" \
                                      else model.fitresult.method)
         OUT += "    Other properties:\n"
         for p,v in model.fitresult.properties.items():
@@ -0,0 +1,141 @@
+# Copyright 2018 Max Shinn <maxwell.shinn@yale.edu>
+#           2018 Norman Lam <norman.lam@yale.edu>
+#
+# This file is part of PyDDM, and is available under the MIT license.
+# Please see LICENSE.txt in the root directory for more information.
+
+__all__ = ["LookupTable", "set_lookup_table", "get_lookup_table"]
+
+import os
+import numpy as np
+
+from paranoid.types import Number, Positive, Range, Natural1, String, NDArray, Unchecked
+from paranoid.decorators import accepts, returns, requires
+
+from .analytic import analytic_ddm
+
+class LookupTable:
+    """Precomputed response time distributions of the standard DDM.
+
+    The DDM with constant drift rate v, noise s, and bounds at -B and
+    B, starting at a proportion w of the distance from the lower to the
+    upper bound, is equivalent to a DDM with bounds at 0 and 1, noise 1,
+    and drift rate 2*B*v/s^2, with time rescaled by s^2/(4*B^2).  So,
+    the response time distributions of all such models can be found from
+    a table over only two parameters: the rescaled drift rate and the
+    starting point w.  A LookupTable stores the density of crossing the
+    upper bound over a grid of these two parameters and of (the square
+    root of) rescaled time.  By symmetry, the density of crossing the
+    lower bound is the density of crossing the upper bound with the
+    opposite drift rate and starting point 1-w.
+
+    The table is saved in the directory `path`, and is memory-mapped
+    when it is loaded, so it can be shared by many processes without
+    being read into memory by each of them.  Create a new table with
+    LookupTable.build(), and load an existing one with
+    LookupTable(path).  To solve models using the table, pass it to
+    set_lookup_table() and use the "lookup" method, e.g. in
+    fit_adjust_model() or in the loss function.
+
+    Response time distributions from the table are interpolated
+    linearly, so they are only approximately equal to those from
+    Model.solve_analytical().  A finer grid is more accurate, but uses
+    more memory and takes longer to build.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.table = np.load(os.path.join(path, "table.npy"), mmap_mode="r")
+        with np.load(os.path.join(path, "grid.npz")) as grid:
+            self.drifts = grid["drifts"]
+            self.shifts = grid["shifts"]
+            self.sqrt_times = grid["sqrt_times"]
+        assert self.table.shape == (len(self.drifts), len(self.shifts), len(self.sqrt_times)), "Invalid lookup table"
+    def __repr__(self):
+        return "LookupTable(%s) with drift in [%g, %g], starting point in [%g, %g], and time in [0, %g]" % \
+            (repr(self.path), self.drifts[0], self.drifts[-1], self.shifts[0], self.shifts[-1], self.sqrt_times[-1]**2)
+    @classmethod
+    @accepts(Unchecked, String, max_drift=Positive, n_drift=Natural1, min_shift=Range(0, .5),
+             n_shift=Natural1, max_time=Positive, n_time=Natural1)
+    @requires("n_drift >= 2 and n_shift >= 2 and n_time >= 2")
+    def build(cls, path, max_drift=20, n_drift=201, min_shift=.01, n_shift=99, max_time=20, n_time=400):
+        """Compute a new table and save it in the directory `path`.
+
+        The table spans rescaled drift rates (2*B*v/s^2, see
+        LookupTable) from -`max_drift` to `max_drift` in `n_drift` steps,
+        starting points from `min_shift` to 1-`min_shift` in `n_shift`
+        steps, and rescaled times (t*s^2/(4*B^2)) from 0 to `max_time` in
+        `n_time` steps evenly spaced in the square root of time, which
+        gives more steps near zero, where the distribution changes
+        fastest.  The table is stored in single precision.  With the
+        defaults, it is about 30 MB.
+
+        Returns the new LookupTable.
+        """
+        drifts = np.linspace(-max_drift, max_drift, n_drift)
+        shifts = np.linspace(min_shift, 1-min_shift, n_shift)
+        sqrt_times = np.linspace(0, np.sqrt(max_time), n_time)
+        os.makedirs(path, exist_ok=True)
+        table = np.lib.format.open_memmap(os.path.join(path, "table.npy"), mode="w+", dtype=np.float32,
+                                          shape=(n_drift, n_shift, n_time))
+        for i,drift in enumerate(drifts):
+            for j,shift in enumerate(shifts):
+                # The C solver requires evenly spaced times
+                upper,_ = analytic_ddm(drift, 1, .5, sqrt_times**2, shift=shift, force_python=True)
+                upper[0] = 0
+                table[i,j,:] = upper
+        table.flush()
+        del table
+        np.savez(os.path.join(path, "grid.npz"), drifts=drifts, shifts=shifts, sqrt_times=sqrt_times)
+        return cls(path)
+    def _interpolate(self, drift, shift, sqrt_times):
+        """The density of crossing the upper bound at rescaled times sqrt_times**2."""
+        if not (self.drifts[0] <= drift <= self.drifts[-1]):
+            raise ValueError("Rescaled drift rate %g is outside of the lookup table's range [%g, %g]" % (drift, self.drifts[0], self.drifts[-1]))
+        if not (self.shifts[0] <= shift <= self.shifts[-1]):
+            raise ValueError("Starting point %g is outside of the lookup table's range [%g, %g]" % (shift, self.shifts[0], self.shifts[-1]))
+        i = min(np.searchsorted(self.drifts, drift, side="right")-1, len(self.drifts)-2)
+        j = min(np.searchsorted(self.shifts, shift, side="right")-1, len(self.shifts)-2)
+        wi = (drift - self.drifts[i])/(self.drifts[i+1] - self.drifts[i])
+        wj = (shift - self.shifts[j])/(self.shifts[j+1] - self.shifts[j])
+        # Interpolate between the four surrounding rows of the table, and
+        # then in time.
+        corners = self.table[i:i+2,j:j+2,:]
+        row = (1-wi)*(1-wj)*corners[0,0] + wi*(1-wj)*corners[1,0] + (1-wi)*wj*corners[0,1] + wi*wj*corners[1,1]
+        return np.interp(sqrt_times, self.sqrt_times, row, right=0)
+    @accepts(Unchecked, Number, Positive, Positive, Range(0, 1), NDArray(d=1, t=Number))
+    @returns(NDArray(d=2, t=Number))
+    def pdfs(self, drift, noise, bound, shift, t):
+        """The response time densities of the DDM at times `t`.
+
+        The DDM has constant drift rate `drift`, noise `noise`, bounds at
+        -`bound` and `bound`, and starts at a proportion `shift` of the
+        distance between the lower and upper bounds (e.g. 0.5 is the
+        center).  Returns a 2xN ndarray, where N is the length of `t`,
+        of the densities of crossing the upper and lower bounds.
+        """
+        scale = noise**2/(4*bound**2)
+        rescaled_drift = 2*bound*drift/noise**2
+        sqrt_times = np.sqrt(t*scale)
+        return np.asarray([self._interpolate(rescaled_drift, shift, sqrt_times),
+                           self._interpolate(-rescaled_drift, 1-shift, sqrt_times)])*scale
+
+_lookup_table = None # Note: do not change this directly.  Call set_lookup_table() instead.
+
+def set_lookup_table(table):
+    """Use `table` for the "lookup" solver method.
+
+    `table` is either a LookupTable or the path of a directory where
+    one was saved with LookupTable.build().  Pass None to remove the
+    table.  When solving in parallel with the "process" or "resident"
+    backends, call this before set_N_cpus() so that the worker processes
+    also use the table.
+    """
+    global _lookup_table
+    if table is None or isinstance(table, LookupTable):
+        _lookup_table = table
+    else:
+        _lookup_table = LookupTable(table)
+
+def get_lookup_table():
+    """Return the LookupTable used by the "lookup" solver method, or None if there is none."""
+    return _lookup_table
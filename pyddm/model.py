@@ -5,9 +5,11 @@
 # Please see LICENSE.txt in the root directory for more information.
 
 import logging
+import copy
 import numpy as np
 from scipy import sparse
 import scipy.sparse.linalg
+import scipy.linalg
 from .tridiag import TriDiagMatrix
 
 from . import parameters as param
@@ -16,12 +18,14 @@ from .models.drift import DriftConstant, Drift
 from .models.noise import NoiseConstant, Noise
 from .models.ic import ICPointSourceCenter, ICPoint, InitialCondition
 from .models.bound import BoundConstant, BoundCollapsingLinear, Bound
-from .models.overlay import OverlayNone, Overlay
+from .models.overlay import OverlayNone, Overlay, _defined_together
 from .models.paranoid_types import Conditions
 from .sample import Sample
 from .solution import Solution
 from .fitresult import FitResult, FitResultEmpty
 from .logger import logger as _logger
+from .lookup import get_lookup_table
+from .cache import get_solution_cache, get_pre_overlay_cache, get_solution_store, _dependence_key, _param_key
 
 from paranoid.types import Numeric, Number, Self, List, Generic, Positive, Positive0, String, Boolean, Natural1, Natural0, Dict, Set, Integer, NDArray, Maybe, Nothing
 from paranoid.decorators import accepts, returns, requires, ensures, paranoidclass, paranoidconfig
@@ -154,6 +158,9 @@ class Model(object):
             _logger.warning("dt is large.  Estimated pdfs may be imprecise.  Decrease dt to 0.01 or less.")
         self.T_dur = T_dur
         self.fitresult = FitResultEmpty() if fitresult is None else fitresult # If the model was fit, store the status here
+    def __getstate__(self):
+        # Don't copy or pickle the memoized grids (see _memoize)
+        return {k:v for k,v in self.__dict__.items() if k != "_memo"}
     def __eq__(self, other):
         for i in range(0, len(self.dependencies)):
             if self.dependencies[i] != other.dependencies[i]:
@@ -330,20 +337,62 @@ class Model(object):
         """Return a dictionary which fully specifies the class of the five key model components."""
         tt = lambda x : (x.depname, type(x))
         return dict(map(tt, self.dependencies))
+    def _memoize(self, key, f):
+        """Return f(), or the value it returned previously for `key`.
+
+        This is used for the grids and initial conditions, which are
+        needed many times each time the model is solved.  `key` must
+        include everything the value depends on, i.e. the dx, dt, T_dur,
+        and the parameters and conditions of the relevant model
+        components, so changing any of these computes a new value.  The
+        returned arrays are read-only, since they are shared.
+        """
+        memo = self.__dict__.setdefault("_memo", {})
+        val = memo.get(key)
+        if val is not None:
+            return val
+        val = np.asarray(f())
+        val.flags.writeable = False
+        # Other threads may be using the dictionary (e.g. with the
+        # "thread" backend of set_N_cpus()), so start a new one instead
+        # of clearing it.
+        if len(memo) > 1000:
+            memo = self._memo = {}
+        memo[key] = val
+        return val
+    def _memo_key(self, name, conditions, *dependencies):
+        """The key for _memoize() of `name`, which depends on `dependencies` under `conditions`."""
+        required = set(c for d in dependencies for c in d.required_conditions)
+        return (name, self.dx, self.dt, self.T_dur,
+                tuple(_dependence_key(d) for d in dependencies),
+                tuple(sorted(((c, _param_key(v)) for c,v in conditions.items() if c in required), key=lambda cv : cv[0])))
     @accepts(Self, Conditions, Maybe(Positive0))
     def x_domain(self, conditions, t=None):
         """A list which spans from the lower boundary to the upper boundary by increments of dx."""
-        # Find the maximum size of the bound across the t-domain in
-        # case we have increasing bounds
-        if t is None:
-            B = max([self.get_dependence("bound").get_bound(t=t, conditions=conditions) for t in self.t_domain()])
-        else:
-            B = self.get_dependence("bound").get_bound(t=t, conditions=conditions)
-        B = np.ceil(B/self.dx)*self.dx # Align the bound to dx borders
-        return np.arange(-B, B+0.1*self.dx, self.dx) # +.1*dx is to ensure that the largest number in the array is B
+        return self._x_domain(conditions, t=t).copy()
+    def _x_domain(self, conditions, t=None):
+        """As x_domain(), but a shared, read-only array which is only computed once."""
+        bound = self.get_dependence("bound")
+        def compute():
+            # Find the maximum size of the bound across the t-domain in
+            # case we have increasing bounds
+            if t is None:
+                B = max([bound.get_bound(t=tt, conditions=conditions) for tt in self._t_domain()])
+            else:
+                B = bound.get_bound(t=t, conditions=conditions)
+            B = np.ceil(B/self.dx)*self.dx # Align the bound to dx borders
+            return np.arange(-B, B+0.1*self.dx, self.dx) # +.1*dx is to ensure that the largest number in the array is B
+        # The bound at time t is only the same for different t if the
+        # bound does not depend on time.
+        tkey = None if t is None or not bound._uses_t() else float(t)
+        return self._memoize(self._memo_key(("x_domain", tkey), conditions, bound), compute)
     def t_domain(self):
         """A list of all of the timepoints over which the joint PDF will be defined (increments of dt from 0 to T_dur)."""
-        return np.arange(0., self.T_dur+0.1*self.dt, self.dt)
+        return self._t_domain().copy()
+    def _t_domain(self):
+        """As t_domain(), but a shared, read-only array which is only computed once."""
+        return self._memoize(("t_domain", self.dt, self.T_dur),
+                             lambda : np.arange(0., self.T_dur+0.1*self.dt, self.dt))
     def flux(self, x, t, conditions):
         """The flux across the boundary at position `x` at time `t`."""
         drift_flux = self.get_dependence('drift').get_flux(x, t, dx=self.dx, dt=self.dt, conditions=conditions)
@@ -355,12 +404,47 @@ class Model(object):
         Returns a length N ndarray (where N is the size of x_domain())
         which should sum to 1.
         """
-        return self.get_dependence('IC').get_IC(self.x_domain(conditions=conditions), dx=self.dx, conditions=conditions)
+        return self._IC_array(conditions).copy()
+    def _IC_array(self, conditions):
+        """As IC(), but a shared, read-only array which is only computed once."""
+        ic = self.get_dependence('IC')
+        return self._memoize(self._memo_key("IC", conditions, self.get_dependence("bound"), ic),
+                             lambda : ic.get_IC(self._x_domain(conditions=conditions), dx=self.dx, conditions=conditions))
+    @accepts(Self, Conditions, Natural1)
+    @returns(NDArray(d=1, t=Natural0))
+    @ensures("return[0] == 0 and return[-1] == len(self._x_domain(conditions)) - 1")
+    @ensures("np.all(np.diff(return) >= 1) and np.all(np.diff(return) <= coarsening)")
+    def x_domain_graded(self, conditions, coarsening=8):
+        """Indices of x_domain() which form a non-uniform grid.
+
+        The grid has a spacing of dx near the bounds and wherever the
+        initial condition changes abruptly (e.g. at a point source),
+        where the distribution changes quickly.  Elsewhere, the spacing
+        gradually increases, up to `coarsening` times dx.
+        """
+        pdf_init = self._IC_array(conditions=conditions)
+        n = len(pdf_init)
+        # Grid points which must be kept at full resolution
+        jumps = np.where(np.abs(np.diff(pdf_init)) > .1*np.max(pdf_init))[0]
+        anchors = np.unique(np.concatenate([[0, n-1], jumps, jumps+1]))
+        # The spacing grows by a quarter of the distance from the
+        # nearest anchor.  Since this also counts anchors ahead, the
+        # spacing shrinks again when approaching the next anchor.
+        pos = np.arange(n)
+        nearest = np.searchsorted(anchors, pos)
+        dist = np.minimum(np.abs(pos - anchors[np.maximum(nearest-1, 0)]),
+                          np.abs(anchors[np.minimum(nearest, len(anchors)-1)] - pos))
+        spacing = np.clip((1 + .25*dist).astype(int), 1, coarsening)
+        indices = [0]
+        for anchor in anchors[1:]:
+            while indices[-1] < anchor:
+                indices.append(min(indices[-1] + spacing[indices[-1]], anchor))
+        return np.asarray(indices)
 
     @accepts(Self, conditions=Conditions, cutoff=Boolean, seed=Natural0, rk4=Boolean)
     @returns(NDArray(t=Number, d=1))
-    @ensures('0 < len(return) <= len(self.t_domain())')
-    @ensures('not cutoff --> len(return) == len(self.t_domain())')
+    @ensures('0 < len(return) <= len(self._t_domain())')
+    @ensures('not cutoff --> len(return) == len(self._t_domain())')
     def simulate_trial(self, conditions={}, cutoff=True, rk4=True, seed=0):
         """Simulate the decision variable for one trial.
 
@@ -387,12 +471,12 @@ class Model(object):
         self.check_conditions_satisfied(conditions)
         
         h = self.dt
-        T = self.t_domain()
+        T = self._t_domain()
 
         # Choose a starting position from the IC
         rng = np.random.RandomState(seed)
-        ic = self.IC(conditions=conditions)
-        x0 = rng.choice(self.x_domain(conditions=conditions), p=ic)
+        ic = self._IC_array(conditions=conditions)
+        x0 = rng.choice(self._x_domain(conditions=conditions), p=ic)
         pos = [x0]
 
         # Convenience functions
@@ -438,9 +522,18 @@ class Model(object):
         """Simulate individual trials to obtain a distribution.
 
         Given conditions `conditions` and the number `size` of trials
-        to simulate, this will run the function "simulate_trial"
-        `size` times, and use the result to find a histogram analogous
-        to solve.  Returns a Sample object.
+        to simulate, this will simulate all of the trials at once using
+        the same method as "simulate_trial", and use the result to find a
+        histogram analogous to solve.  Returns a Sample object.
+
+        Trials are simulated together, so the drift and noise are each
+        computed once per timestep (or four times with `rk4`) for an
+        ndarray of positions.  Trials which cross the bound are removed
+        from the simulation.  The overlay is applied with
+        Overlay.apply_crossings.  If the overlay does not define this,
+        or it is inherited by an overlay which redefines
+        Overlay.apply_trajectory, each trial is simulated individually
+        with Overlay.apply_trajectory instead, which is much slower.
 
         Note that in practice you should never need to use this
         function.  This function uses an outdated method to simulate
@@ -453,11 +546,74 @@ class Model(object):
 
         """
         _logger.warning("To generate a sample from a model, please use Solution.resample().  The only practical purpose of the simulated_solution function is debugging the simulate_trial function for custom Overlays.")
+        self.check_conditions_satisfied(conditions)
+        if not _defined_together(self.get_dependence("overlay"), "apply_crossings", "apply_trajectory"):
+            return self._simulated_solution_by_trial(conditions=conditions, size=size, rk4=rk4, seed=seed)
+        h = self.dt
+        T = self._t_domain()
+        rng = np.random.RandomState(seed)
+        _driftdep = self.get_dependence("drift")
+        _noisedep = self.get_dependence("noise")
+        fm = lambda x,t : _driftdep.get_drift(t=t, x=x, conditions=conditions)
+        fs = lambda x,t : _noisedep.get_noise(t=t, x=x, conditions=conditions)
+        # Positions of the trials which have not yet crossed the bound
+        pos = rng.choice(self._x_domain(conditions=conditions), size=size, p=self._IC_array(conditions=conditions))
+        active = np.arange(size)
+        # Timestep at which each trial crossed, and the bound it crossed
+        # (1 for upper, -1 for lower, and 0 for undecided)
+        steps = np.full(size, len(T)-1)
+        choices = np.zeros(size, dtype=int)
+        for i in range(1, len(T)):
+            if len(active) == 0:
+                break
+            # Same as simulate_trial, but for many trials at once
+            dw = np.sqrt(h)*rng.randn(len(pos))
+            drift1 = fm(t=T[i-1], x=pos)
+            s1 = fs(t=T[i-1], x=pos)
+            if rk4: # Use Runge-Kutta order 4
+                drift2 = fm(t=(T[i-1]+h/2), x=(pos + drift1*h/2 + s1*dw/2))
+                s2 = fs(t=(T[i-1]+h/2), x=(pos + drift1*h/2 + s1*dw/2))
+                drift3 = fm(t=(T[i-1]+h/2), x=(pos + drift2*h/2 + s2*dw/2))
+                s3 = fs(t=(T[i-1]+h/2), x=(pos + drift2*h/2 + s2*dw/2))
+                drift4 = fm(t=(T[i-1]+h), x=(pos + drift3*h + s3*dw))
+                s4 = fs(t=(T[i-1]+h), x=(pos + drift3*h + s3*dw))
+                pos = pos + h*(drift1 + 2*drift2 + 2*drift3 + drift4)/6 + dw*(s1 + 2*s2 + 2*s3 + s4)/6
+            else: # Use Euler's method
+                pos = pos + h*drift1 + dw*s1
+            B = self.get_dependence("bound").get_bound(t=T[i], conditions=conditions)
+            crossed_upper = pos > B
+            crossed_lower = pos < -B
+            crossed = crossed_upper | crossed_lower
+            steps[active[crossed]] = i
+            choices[active[crossed_upper]] = 1
+            choices[active[crossed_lower]] = -1
+            pos = pos[~crossed]
+            active = active[~crossed]
+        try:
+            steps, choices = self.get_dependence("overlay").apply_crossings(steps=steps, choices=choices, model=self, conditions=conditions, rng=rng)
+        except NotImplementedError:
+            return self._simulated_solution_by_trial(conditions=conditions, size=size, rk4=rk4, seed=seed)
+        # Correct for the fact that the particle could have crossed at
+        # any point between T_finish-dt and T_finish.
+        dt_correction = self.dt/2
+        choice_upper_times = T[steps[choices == 1]] - dt_correction
+        choice_lower_times = T[steps[choices == -1]] - dt_correction
+        undec_count = int(np.sum(choices == 0))
+        aa = lambda x : np.asarray(x)
+        conds = {k:(aa(len(choice_upper_times)*[v]), aa(len(choice_lower_times)*[v]), aa(undec_count*[v])) for k,v in conditions.items() if k and v}
+        return Sample(choice_upper_times, choice_lower_times, undec_count, **conds)
+
+    def _simulated_solution_by_trial(self, conditions, size, rk4, seed):
+        """Like simulated_solution, but calling "simulate_trial" for each trial.
+
+        This supports overlays which define Overlay.apply_trajectory but
+        not Overlay.apply_crossings.
+        """
         choice_upper_times = []
         choice_lower_times = []
         undec_count = 0
 
-        T = self.t_domain()
+        T = self._t_domain()
 
         for s in range(0, size):
             if s % 200 == 0:
@@ -507,7 +663,7 @@ class Model(object):
     def can_solve_explicit(self, conditions={}):
         """Check explicit method stability criterion"""
         self.check_conditions_satisfied(conditions)
-        noise_max = max((self._noisedep.get_noise(x=0, t=t, dx=self.dx, dt=self.dt, conditions=conditions) for t in self.t_domain()))
+        noise_max = max((self._noisedep.get_noise(x=0, t=t, dx=self.dx, dt=self.dt, conditions=conditions) for t in self._t_domain()))
         return noise_max**2 * self.dt/(self.dx**2) < 1
 
     @accepts(Self, conditions=Conditions)
@@ -524,28 +680,116 @@ class Model(object):
         if self.get_dependence("bound")._uses_t():
             return False
         return True
+
+    @accepts(Self, conditions=Conditions)
+    @returns(Boolean)
+    def can_solve_spectral(self, conditions={}):
+        """Check whether this model is compatible with the spectral solver.
+
+        Models are compatible if the drift, noise, and bounds do not
+        depend on time."""
+        return not (self.get_dependence("drift")._uses_t() or
+                    self.get_dependence("noise")._uses_t() or
+                    self.get_dependence("bound")._uses_t())
     
     @accepts(Self, conditions=Conditions, return_evolution=Boolean, force_python=Boolean)
     @returns(Solution)
     def solve(self, conditions={}, return_evolution=False, force_python=False):
         """Solve the model using an analytic solution if possible, and a numeric solution if not.
 
-        First, it tries to use Crank-Nicolson as the solver, and then backward
-        Euler.  See documentation of Model.solve_numerical() for more information.
+        If an analytic solution is not available, it uses Crank-Nicolson for
+        models with bounds which do not change over time, and backward Euler
+        otherwise.  Both use the compiled C solvers when available.  See
+        documentation of Model.solve_numerical() for more information.
 
         The return_evolution argument should be set to True if you need to use
         the Solution.get_evolution() function from the returned Solution.
 
         Return a Solution object describing the joint PDF distribution of reaction times.
 
+        If set_solution_cache() has been called, this returns the previous
+        Solution if the model has already been solved with the same
+        parameters and conditions.  Likewise, if set_solution_store() has
+        been called, this loads the Solution from disk if it was saved
+        there previously.  If set_pre_overlay_cache() has been called and
+        only the parameters of the overlay have changed since the model
+        was last solved, only the overlay is recomputed.
         """
+        self.check_conditions_satisfied(conditions)
+        if return_evolution is True:
+            return self._solve(conditions=conditions, return_evolution=return_evolution, force_python=force_python)
+        method = "python" if force_python else None
+        cache = get_solution_cache()
+        if cache is None:
+            return self._solve_from_store(conditions=conditions, force_python=force_python)
+        key = cache.key(self, conditions, method=method)
+        sol = cache.get(key)
+        if sol is None:
+            sol = self._solve_from_store(conditions=conditions, force_python=force_python)
+            cache.put(key, sol)
+        return sol
+
+    def _solve_from_store(self, conditions={}, force_python=False):
+        """Load the Solution from the SolutionStore if possible, or else solve the model and save it."""
+        store = get_solution_store()
+        if store is None:
+            return self._solve_reusing_overlay(conditions=conditions, force_python=force_python)
+        key = store.key(self, conditions, method=("python" if force_python else None))
+        sol = store.load(key, self, conditions)
+        if sol is None:
+            sol = self._solve_reusing_overlay(conditions=conditions, force_python=force_python)
+            store.save(key, sol)
+        return sol
+
+    def _solve_reusing_overlay(self, conditions={}, force_python=False):
+        """Solve the model, reusing the Solution before the overlay if possible."""
+        cache = get_pre_overlay_cache()
+        if cache is None or isinstance(self.get_dependence("overlay"), OverlayNone):
+            return self._solve(conditions=conditions, force_python=force_python)
+        m = self._without_overlay()
+        core_conditions = {k:v for k,v in conditions.items() if k in m.required_conditions}
+        key = cache.key(m, core_conditions, method=("python" if force_python else None))
+        sol = cache.get(key)
+        if sol is None:
+            sol = m._solve(conditions=core_conditions, force_python=force_python)
+            cache.put(key, sol)
+        return self._apply_overlay(sol, conditions)
+
+    def _without_overlay(self):
+        """A copy of the model which shares all components except the overlay.
+
+        The copy only requires the conditions used by the drift, noise,
+        bound, and initial condition.
+        """
+        m = copy.copy(self)
+        # The overlay is not part of any memoized value's key, so the
+        # grids and initial conditions can be shared.
+        m._memo = self.__dict__.setdefault("_memo", {})
+        m._overlay = OverlayNone()
+        m.dependencies = [m._driftdep, m._noisedep, m._bounddep, m._IC, m._overlay]
+        m.required_conditions = list(set([x for l in m.dependencies for x in l.required_conditions]))
+        return m
+
+    def _apply_overlay(self, solution, conditions):
+        """Apply the overlay to `solution`, a Solution of _without_overlay().
+
+        `conditions` must include the conditions required by the overlay.
+        Since `solution` may be cached, the new Solution gets copies of
+        its pdfs, so neither the overlay nor the caller can modify it.
+        """
+        undec = solution.undec.copy() if solution.undec is not None else None
+        sol = Solution(solution.choice_upper.copy(), solution.choice_lower.copy(), self,
+                       conditions=conditions, pdf_undec=undec)
+        return self.get_dependence("overlay").apply(sol)
+
+    def _solve(self, conditions={}, return_evolution=False, force_python=False):
+        """Solve the model, as in Model.solve(), but without checking the cache."""
         # TODO solves this using the dis module as described in the
         # comment for can_solve_cn
-        self.check_conditions_satisfied(conditions)
         if self.has_analytical_solution() and return_evolution is False:
             return self.solve_analytical(conditions=conditions)
-        elif isinstance(self.get_dependence("bound"), BoundConstant) and return_evolution is False and (force_python or not HAS_CSOLVE):
-            return self.solve_numerical_cn(conditions=conditions)
+        elif self.can_solve_cn(conditions=conditions) and return_evolution is False:
+            return self.solve_numerical_cn(conditions=conditions, force_python=force_python)
         else:
             return self.solve_numerical_implicit(conditions=conditions, return_evolution=return_evolution, force_python=force_python)
 
@@ -569,7 +813,7 @@ class Model(object):
         
         #calculate shift in initial conditions if present
         if isinstance(self.get_dependence('IC'),ICPoint):
-            ic = self.IC(conditions=conditions)
+            ic = self._IC_array(conditions=conditions)
             assert np.count_nonzero(ic)==1, "Cannot solve analytically for models with non-point initial conditions"
             shift = np.flatnonzero(ic) / (len(ic) - 1) #rescale to proprotion of total bound height
         else:
@@ -580,13 +824,13 @@ class Model(object):
             anal_pdf_choice_upper, anal_pdf_choice_lower = analytic_ddm(self.get_dependence("drift").get_drift(t=0, x=0, conditions=conditions),
                                                        self.get_dependence("noise").get_noise(t=0, x=0, conditions=conditions),
                                                        self.get_dependence("bound").get_bound(t=0, x=0, conditions=conditions),
-                                                       self.t_domain(), shift, -self.get_dependence("bound").t,
+                                                       self._t_domain(), shift, -self.get_dependence("bound").t,
                                                        force_python=force_python) # TODO why must this be negative? -MS
         else: # Constant bound DDM
             anal_pdf_choice_upper, anal_pdf_choice_lower = analytic_ddm(self.get_dependence("drift").get_drift(t=0, x=0, conditions=conditions),
                                                         self.get_dependence("noise").get_noise(t=0, x=0, conditions=conditions),
                                                        self.get_dependence("bound").get_bound(t=0, x=0, conditions=conditions), 
-                                                       self.t_domain(), shift,
+                                                       self._t_domain(), shift,
                                                        force_python=force_python)
 
         ## Remove some abnormalities such as NaN due to trivial reasons.
@@ -611,6 +855,59 @@ class Model(object):
         sol = Solution(anal_pdf_choice_upper, anal_pdf_choice_lower, self, conditions=conditions)
         return self.get_dependence('overlay').apply(sol)
     
+    @accepts(Self, conditions=Conditions)
+    @returns(Solution)
+    def solve_lookup(self, conditions={}):
+        """Solve the model by interpolating from a precomputed table.
+
+        This works for models with an analytic solution (see
+        solve_analytical()) which have constant bounds.  Instead of
+        evaluating the analytic solution, the response time distribution
+        is interpolated from the LookupTable set by set_lookup_table(),
+        which is much faster.  The result is approximately equal to
+        that of solve_analytical(), depending on the resolution of the
+        table.  See LookupTable for more information.
+        """
+        table = get_lookup_table()
+        if table is None:
+            raise ValueError("No lookup table, please call set_lookup_table() first")
+        assert self.has_analytical_solution() and not self.get_dependence("bound")._uses_t(), \
+            "Lookup tables only work for models with an analytic solution and constant bounds"
+        self.check_conditions_satisfied(conditions)
+        if isinstance(self.get_dependence('IC'), ICPoint):
+            ic = self._IC_array(conditions=conditions)
+            assert np.count_nonzero(ic)==1, "Cannot solve with a lookup table for models with non-point initial conditions"
+            shift = np.flatnonzero(ic)[0] / (len(ic) - 1) # Proportion of total bound height
+        else:
+            shift = .5
+        pdf_choice_upper, pdf_choice_lower = table.pdfs(self.get_dependence("drift").get_drift(t=0, x=0, conditions=conditions),
+                                                        self.get_dependence("noise").get_noise(t=0, x=0, conditions=conditions),
+                                                        self.get_dependence("bound").get_bound(t=0, x=0, conditions=conditions),
+                                                        shift, self._t_domain())*self.dt
+        # Fix numerical errors
+        pdfsum = np.sum(pdf_choice_upper) + np.sum(pdf_choice_lower)
+        if pdfsum > 1:
+            pdf_choice_upper /= pdfsum
+            pdf_choice_lower /= pdfsum
+        return self.get_dependence('overlay').apply(Solution(pdf_choice_upper, pdf_choice_lower, self, conditions=conditions))
+
+    def solve_surrogate(self, conditions={}):
+        """Solve the model approximately using a surrogate.
+
+        Instead of solving the model, the response time distribution is
+        interpolated from solutions of the model at other parameter
+        values, using the Surrogate set by set_surrogate().  This works
+        for any model, but only approximately, and only for the
+        conditions used to build the surrogate.  See Surrogate for more
+        information.
+        """
+        from .surrogate import get_surrogate # Importing here avoids a recursion issue
+        surrogate = get_surrogate()
+        if surrogate is None:
+            raise ValueError("No surrogate, please call set_surrogate() first")
+        self.check_conditions_satisfied(conditions)
+        return surrogate.solve(self, conditions)
+
     def solve_numerical_c(self, conditions={}):
         """Solve the DDM model using the implicit method with C extensions.
 
@@ -621,7 +918,70 @@ class Model(object):
         This does not current work with non-Gaussian diffusion matrices (a
         currently undocumented feature).
         """
-
+        drift, drifttype, noise, noisetype, bound, boundtype, ic = self._c_solver_arrays(conditions)
+        res = csolve.implicit_time(drift, drifttype, noise, noisetype, bound, boundtype, ic, self.T_dur, self.dt, self.dx, len(self._t_domain()))
+        return self._c_solver_solution(conditions, res[0], res[1], res[2])
+
+    @accepts(Self, List(Conditions))
+    @returns(Dict(k=Generic(frozenset), v=Solution))
+    def solve_batch(self, conditions_list):
+        """Solve the model for many condition combinations at once.
+
+        `conditions_list` is a list of dicts, each specifying one
+        combination of conditions (the same format as
+        Sample.condition_combinations() outputs).  This returns a dictionary
+        indexed by a frozenset of the condition names and values, with the
+        Solution object as the value, in the same format as
+        solve_all_conditions().
+
+        The Solutions are identical to those from Model.solve().  When
+        Model.solve() would use one of the C solvers (Crank-Nicolson or
+        implicit), all conditions are passed to the C extension in a single
+        call, which avoids most of the per-condition overhead.  Otherwise,
+        this is equivalent to calling Model.solve() for each condition.
+        """
+        for conditions in conditions_list:
+            self.check_conditions_satisfied(conditions)
+        # Subclasses which override solve() must still have their own solver
+        # used, so only batch when the default solve() would use the C solver.
+        if type(self).solve is not Model.solve:
+            return {frozenset(c.items()) : self.solve(conditions=c) for c in conditions_list}
+        if not HAS_CSOLVE or self.has_analytical_solution() or len(conditions_list) == 0:
+            return {frozenset(c.items()) : self._solve(conditions=c) for c in conditions_list}
+        use_cn = self.can_solve_cn()
+        batch_solver = csolve.cn_time_batch if use_cn else csolve.implicit_time_batch
+        args = self._c_solver_batch_arrays(conditions_list)
+        res = batch_solver(*args, self.T_dur, self.dt, self.dx, len(self._t_domain()))
+        ic_offsets = args[10]
+        # The Crank-Nicolson solver does not estimate the undecided
+        # probability (see solve_numerical_cn)
+        undec = lambda i : None if use_cn else res[2][ic_offsets[i]:ic_offsets[i+1]]
+        return {frozenset(c.items()) : self._c_solver_solution(c, res[0][i], res[1][i], undec(i))
+                for i,c in enumerate(conditions_list)}
+
+    def _c_solver_batch_arrays(self, conditions_list):
+        """The arguments describing the model which are passed to the batch C solvers.
+
+        Like _c_solver_arrays(), but for each condition in
+        `conditions_list`.  The arrays for each condition are stacked into
+        a single array, followed by an array of the index where each one
+        starts.  The types are the same for all conditions.
+        """
+        arrays = [self._c_solver_arrays(c) for c in conditions_list]
+        offsets = lambda i : np.cumsum([0]+[len(a[i]) for a in arrays])
+        stack = lambda i : np.concatenate([a[i] for a in arrays])
+        return (stack(0), offsets(0), arrays[0][1],
+                stack(2), offsets(2), arrays[0][3],
+                stack(4), offsets(4), arrays[0][5],
+                stack(6), offsets(6))
+
+    def _c_solver_arrays(self, conditions):
+        """The arguments describing the model which are passed to the C solver.
+
+        Returns a tuple of the drift, drift type, noise, noise type, bound,
+        bound type, and initial condition.  See csolve.c for a description
+        of the types.
+        """
         get_drift = self.get_dependence("drift").get_drift
         drift_uses_t = self.get_dependence("drift")._uses_t()
         drift_uses_x = self.get_dependence("drift")._uses_x()
@@ -630,10 +990,10 @@ class Model(object):
             drift = np.asarray([get_drift(conditions=conditions, x=0, t=0)])
         elif drift_uses_t and not drift_uses_x:
             drifttype = 1
-            drift = np.asarray([get_drift(t=t, conditions=conditions, x=0) for t in self.t_domain()])
+            drift = np.asarray([get_drift(t=t, conditions=conditions, x=0) for t in self._t_domain()])
         elif not drift_uses_t and drift_uses_x:
             drifttype = 2
-            drift = np.asarray(get_drift(x=self.x_domain(conditions=conditions), t=0, conditions=conditions))
+            drift = np.asarray(get_drift(x=self._x_domain(conditions=conditions), t=0, conditions=conditions))
         elif drift_uses_t and drift_uses_x:
             drifttype = 3
             # TODO: Right now this calculates and passes the maximum x domain,
@@ -645,9 +1005,9 @@ class Model(object):
             # rectangular matrix, since they will never be read within the C
             # code.  maxt is a workaround so we don't have to find the maximum
             # in the t domain on each iteration.
-            maxt = self.t_domain()[np.argmax([self.get_dependence("bound").get_bound(t=t, conditions=conditions) for t in self.t_domain()])]
-            xdomain = self.x_domain(t=maxt, conditions=conditions)
-            drift = np.concatenate([get_drift(t=t, x=xdomain, conditions=conditions) for t in self.t_domain()])
+            maxt = self._t_domain()[np.argmax([self.get_dependence("bound").get_bound(t=t, conditions=conditions) for t in self._t_domain()])]
+            xdomain = self._x_domain(t=maxt, conditions=conditions)
+            drift = np.concatenate([get_drift(t=t, x=xdomain, conditions=conditions) for t in self._t_domain()])
         get_noise = self.get_dependence("noise").get_noise
         noise_uses_t = self.get_dependence("noise")._uses_t()
         noise_uses_x = self.get_dependence("noise")._uses_x()
@@ -656,47 +1016,74 @@ class Model(object):
             noise = np.asarray([get_noise(conditions=conditions, x=0, t=0)])
         elif noise_uses_t and not noise_uses_x:
             noisetype = 1
-            noise = np.asarray([get_noise(t=t, conditions=conditions, x=0) for t in self.t_domain()])
+            noise = np.asarray([get_noise(t=t, conditions=conditions, x=0) for t in self._t_domain()])
         elif not noise_uses_t and noise_uses_x:
             noisetype = 2
-            noise = np.asarray(get_noise(x=self.x_domain(conditions=conditions), conditions=conditions, t=0))
+            noise = np.asarray(get_noise(x=self._x_domain(conditions=conditions), conditions=conditions, t=0))
         elif noise_uses_t and noise_uses_x:
             noisetype = 3
             # See comment in drifttype = 3
-            maxt = self.t_domain()[np.argmax([self.get_dependence("bound").get_bound(t=t, conditions=conditions) for t in self.t_domain()])]
-            xdomain = self.x_domain(t=maxt, conditions=conditions)
-            noise = np.concatenate([get_noise(t=t, x=xdomain, conditions=conditions) for t in self.t_domain()])
+            maxt = self._t_domain()[np.argmax([self.get_dependence("bound").get_bound(t=t, conditions=conditions) for t in self._t_domain()])]
+            xdomain = self._x_domain(t=maxt, conditions=conditions)
+            noise = np.concatenate([get_noise(t=t, x=xdomain, conditions=conditions) for t in self._t_domain()])
         bound_uses_t = self.get_dependence("bound")._uses_t()
         if not bound_uses_t:
             boundtype = 0
             bound = np.asarray([self.get_dependence("Bound").get_bound(conditions=conditions, t=0)])
         elif bound_uses_t:
             boundtype = 1
-            bound = np.asarray([self.get_dependence("Bound").get_bound(t=t, conditions=conditions) for t in self.t_domain()])
-        res = csolve.implicit_time(drift, drifttype, noise, noisetype, bound, boundtype, self.get_dependence("IC").get_IC(self.x_domain(conditions=conditions), self.dx, conditions=conditions), self.T_dur, self.dt, self.dx, len(self.t_domain()))
+            bounddep = self.get_dependence("Bound")
+            bound = self._memoize(self._memo_key("bound", conditions, bounddep),
+                                  lambda : [bounddep.get_bound(t=t, conditions=conditions) for t in self._t_domain()])
+        ic = self.get_dependence("IC").get_IC(self._x_domain(conditions=conditions), self.dx, conditions=conditions)
+        return (drift, drifttype, noise, noisetype, bound, boundtype, ic)
+
+    def _c_solver_solution(self, conditions, pdf_choice_upper, pdf_choice_lower, pdf_undec):
+        """Construct a Solution from the output of the C solver."""
         # TODO: Handle the pdf going below zero, returning pdfcurr, and fix numerical errors
-        choice_upper = (res[0]*self.dt)
+        choice_upper = (pdf_choice_upper*self.dt)
         choice_upper[choice_upper<0] = 0
-        choice_lower = (res[1]*self.dt)
+        choice_lower = (pdf_choice_lower*self.dt)
         choice_lower[choice_lower<0] = 0
-        undec = res[2]
-        undec[undec<0] = 0
+        if pdf_undec is not None:
+            undec = np.array(pdf_undec)
+            undec[undec<0] = 0
+        else:
+            undec = None
         return self.get_dependence('overlay').apply(Solution(choice_upper, choice_lower, self, conditions=conditions, pdf_undec=undec))
 
-    @accepts(Self, method=Set(["explicit", "implicit", "cn"]), conditions=Conditions, return_evolution=Boolean, force_python=Boolean)
+    @accepts(Self, method=Set(["explicit", "implicit", "cn", "spectral", "adaptive", "trbdf2", "graded"]), conditions=Conditions, return_evolution=Boolean, force_python=Boolean)
     @returns(Solution)
     @requires("method == 'explicit' --> self.can_solve_explicit(conditions=conditions)")
     @requires("method == 'cn' --> self.can_solve_cn()")
+    @requires("method == 'graded' --> self.can_solve_cn()")
+    @requires("method == 'spectral' --> self.can_solve_spectral()")
     def solve_numerical(self, method="cn", conditions={}, return_evolution=False, force_python=False):
         """Solve the DDM model numerically.
 
         Use `method` to solve the DDM.  `method` can either be
-        "explicit", "implicit", or "cn" (for Crank-Nicolson).  This is
-        the core DDM solver of this library.
+        "explicit", "implicit", "cn" (for Crank-Nicolson), "spectral",
+        "adaptive" (for backward Euler with adaptive timesteps),
+        "trbdf2" (for TR-BDF2), or "graded" (for backward Euler on a
+        non-uniform grid).  This is the core DDM solver of this library.
 
         Crank-Nicolson is the default and works for any model with
         constant bounds.
 
+        Spectral works for models where nothing depends on time.  See
+        solve_numerical_spectral() for more information.
+
+        Adaptive works for any model, and is fastest for long
+        simulations.  See solve_numerical_adaptive() for more
+        information.
+
+        TR-BDF2 works for any model.  It is second order in time like
+        Crank-Nicolson, but does not oscillate.
+
+        Graded works for any model with constant bounds, and uses fewer
+        grid points than the other methods.  See solve_numerical_graded()
+        for more information.
+
         Implicit is the fallback method.  It should work well in most
         cases and is generally stable.
 
@@ -719,32 +1106,59 @@ class Model(object):
         self.check_conditions_satisfied(conditions)
         if method == "cn":
             if return_evolution == False:
-                return self.solve_numerical_cn(conditions=conditions)
+                return self.solve_numerical_cn(conditions=conditions, force_python=force_python)
             else:
                 _logger.warning("return_evolution is not supported with the Crank-Nicolson solver, using implicit (backward Euler) instead.")
                 method = "implicit"
+        if method == "spectral":
+            if return_evolution == False:
+                return self.solve_numerical_spectral(conditions=conditions)
+            else:
+                _logger.warning("return_evolution is not supported with the spectral solver, using implicit (backward Euler) instead.")
+                method = "implicit"
+        if method == "trbdf2":
+            return self.solve_numerical_trbdf2(conditions=conditions, return_evolution=return_evolution, force_python=force_python)
+        if method == "graded":
+            if return_evolution == False:
+                return self.solve_numerical_graded(conditions=conditions, force_python=force_python)
+            else:
+                _logger.warning("return_evolution is not supported with the graded solver, using implicit (backward Euler) instead.")
+                method = "implicit"
+        if method == "adaptive":
+            if return_evolution == False:
+                return self.solve_numerical_adaptive(conditions=conditions, force_python=force_python)
+            else:
+                _logger.warning("return_evolution is not supported with the adaptive solver, using implicit (backward Euler) instead.")
+                method = "implicit"
         if method == "implicit" and HAS_CSOLVE and not force_python and not return_evolution:
             return self.solve_numerical_c(conditions=conditions)
 
         # Initial condition of decision variable
-        pdf_curr = self.IC(conditions=conditions)
+        pdf_curr = self._IC_array(conditions=conditions).copy()
         # Output correct and error pdfs.  If pdf_corr + pdf_err +
         # undecided probability are summed, they equal 1.  So these
         # are componets of the joint pdf.
-        pdf_choice_upper = np.zeros(len(self.t_domain())) # Not a proper pdf on its own (doesn't sum to 1)
-        pdf_choice_lower = np.zeros(len(self.t_domain())) # Not a proper pdf on its own (doesn't sum to 1)
-        x_list = self.x_domain(conditions=conditions)
+        pdf_choice_upper = np.zeros(len(self._t_domain())) # Not a proper pdf on its own (doesn't sum to 1)
+        pdf_choice_lower = np.zeros(len(self._t_domain())) # Not a proper pdf on its own (doesn't sum to 1)
+        x_list = self._x_domain(conditions=conditions)
 
         # If evolution of pdf should be returned, preallocate np.array pdf_evolution for performance reasons
         if return_evolution:
-            pdf_evolution = np.zeros((len(x_list), len(self.t_domain())))
+            pdf_evolution = np.zeros((len(x_list), len(self._t_domain())))
             pdf_evolution[:,0] = pdf_curr
 
         # Find maximum bound for increasing bounds
         _bound_func = self.get_dependence("bound").get_bound
-        bmax = max([_bound_func(t=t, conditions=conditions) for t in self.t_domain()])
+        bmax = max([_bound_func(t=t, conditions=conditions) for t in self._t_domain()])
+        # If nothing depends on time, the diffusion matrix is the same at
+        # each timestep, so only construct (and factorize) it once.
+        time_invariant = not (self.get_dependence("drift")._uses_t() or
+                              self.get_dependence("noise")._uses_t() or
+                              self.get_dependence("bound")._uses_t())
+        propagate = None
+        operators = _OperatorCache(self, conditions, implicit=(method!="explicit"))
         # Looping through time and updating the pdf.
-        for i_t, t in enumerate(self.t_domain()[:-1]): # -1 because nothing will happen at t=0 so each step computes the value for the next timepoint
+        for i_t, t in enumerate(self._t_domain()[:-1]): # -1 because nothing will happen at t=0 so each step computes the value for the next timepoint
             # Alias pdf_prev to pdf_curr for clarity
             pdf_prev = pdf_curr
 
@@ -775,25 +1189,18 @@ class Model(object):
             # Diffusion Matrix for Implicit Method. Here defined as
             # Outer Matrix, and inder matrix is either trivial or an
             # extracted submatrix.
-            drift_matrix = self.get_dependence('drift').get_matrix(x=x_list_inbounds, t=t,
-                                                                   dt=self.dt, dx=self.dx,
-                                                                   conditions=conditions,
-                                                                   implicit=(method!="explicit"))
-            noise_matrix = self.get_dependence('noise').get_matrix(x=x_list_inbounds, t=t,
-                                                                   dt=self.dt, dx=self.dx, conditions=conditions,
-                                                                   implicit=(method!="explicit"))
-            if method == "implicit":
-                diffusion_matrix = TriDiagMatrix.eye(len(x_list_inbounds)) + drift_matrix + noise_matrix
-            elif method == "explicit":
-                # Explicit method flips sign except for the identity matrix
-                diffusion_matrix_explicit = TriDiagMatrix.eye(len(x_list_inbounds)) - drift_matrix - noise_matrix
+            if propagate is None or not time_invariant:
+                if method == "implicit":
+                    diffusion_matrix = operators.matrix(x_list_inbounds, t, self.dt)
+                    propagate = diffusion_matrix.factorize() if time_invariant else diffusion_matrix.spsolve
+                elif method == "explicit":
+                    # Explicit method flips sign except for the identity matrix
+                    diffusion_matrix_explicit = operators.matrix(x_list_inbounds, t, self.dt, scale=-1)
+                    propagate = diffusion_matrix_explicit.dot
 
             ### Compute Probability density functions (pdf)
             # PDF for outer matrix
-            if method == "implicit":
-                pdf_outer = diffusion_matrix.spsolve(pdf_prev[x_index_outer:len(x_list)-x_index_outer])
-            elif method == "explicit":
-                pdf_outer = diffusion_matrix_explicit.dot(pdf_prev[x_index_outer:len(x_list)-x_index_outer]).squeeze()
+            pdf_outer = propagate(pdf_prev[x_index_outer:len(x_list)-x_index_outer])
             # If the bounds are the same the bound perfectly
             # aligns with the grid), we don't need so solve the
             # diffusion matrix again since we don't need a linear
@@ -802,21 +1209,12 @@ class Model(object):
                 pdf_inner = pdf_outer
             else:
                 # Need a separate matrix here to get the proper corrections
-                drift_matrix = self.get_dependence('drift').get_matrix(x=x_list_inbounds[1:-1], t=t,
-                                                                    dt=self.dt, dx=self.dx,
-                                                                    conditions=conditions,
-                                                                    implicit=(method!="explicit"))
-                noise_matrix = self.get_dependence('noise').get_matrix(x=x_list_inbounds[1:-1], t=t,
-                                                                    dt=self.dt, dx=self.dx, conditions=conditions,
-                                                                    implicit=(method!="explicit"))
-                if method == "implicit":
-                    diffusion_matrix = TriDiagMatrix.eye(len(x_list_inbounds)-2) + drift_matrix + noise_matrix
-                elif method == "explicit":
-                    # Explicit method flips sign except for the identity matrix
-                    diffusion_matrix_explicit = TriDiagMatrix.eye(len(x_list_inbounds)) - drift_matrix - noise_matrix
                 if method == "implicit":
+                    diffusion_matrix = operators.matrix(x_list_inbounds[1:-1], t, self.dt)
                     pdf_inner = diffusion_matrix.spsolve(pdf_prev[x_index_inner:len(x_list)-x_index_inner])
                 elif method == "explicit":
+                    # Explicit method flips sign except for the identity matrix
+                    diffusion_matrix_explicit = operators.matrix(x_list_inbounds[1:-1], t, self.dt, scale=-1)
                     pdf_inner = diffusion_matrix_explicit.dot(pdf_prev[x_index_inner:len(x_list)-x_index_inner])
 
             # Pdfs out of bound is considered decisions made.
@@ -913,28 +1311,535 @@ class Model(object):
         return self.solve_numerical(method="implicit", conditions=conditions, **kwargs)
 
     @accepts(Self, conditions=Conditions)
+    @requires("self.can_solve_spectral(conditions=conditions)")
+    @returns(Solution)
+    def solve_numerical_spectral(self, conditions={}):
+        """Solve the DDM model numerically using an eigendecomposition.
+
+        When the drift, noise, and bounds do not depend on time, the
+        diffusion matrix used by the implicit method is the same at every
+        timepoint.  Instead of stepping through time, this diagonalizes
+        the matrix once and computes the probability of crossing each
+        bound within each timestep in closed form.  Since there is no
+        error from the time discretization, the result is what the
+        implicit and Crank-Nicolson methods approach as dt decreases.  The
+        run time does not depend on dt, which makes it especially
+        efficient for models with long durations or small dt.
+
+        It returns a Solution object describing the joint PDF.
+        """
+        self.check_conditions_satisfied(conditions)
+        x_list = self._x_domain(conditions=conditions)
+        pdf_init = self._IC_array(conditions=conditions)
+        n_t = len(self._t_domain())
+        # The diffusion matrix for one timestep of the implicit method,
+        # i.e. the generator of the Fokker-Planck equation multiplied by dt.
+        diffusion_matrix = self.get_dependence('drift').get_matrix(x=x_list, t=0, dt=self.dt, dx=self.dx,
+                                                                   conditions=conditions, implicit=True) \
+                         + self.get_dependence('noise').get_matrix(x=x_list, t=0, dt=self.dt, dx=self.dx,
+                                                                   conditions=conditions, implicit=True)
+        # The density at the lower and upper boundary points are each
+        # sums of exponentials, amp*exp(-rate*i) at timestep i.
+        rates_lower, amps_lower, rates_upper, amps_upper, undec_modes = _spectral_decomposition(diffusion_matrix, pdf_init)
+        flux_lower = self.flux(x_list[0], 0, conditions=conditions)
+        flux_upper = self.flux(x_list[-1], 0, conditions=conditions)
+        def integrate(rates, amps):
+            # Integrate the exponentials over each timestep, dividing by
+            # the rate (or using the limit 1 if the rate is 0).
+            with np.errstate(divide="ignore", invalid="ignore"):
+                integral = np.where(np.abs(rates) > 1e-12, -np.expm1(-rates)/rates, 1)
+            order = np.argsort(np.real(rates))
+            rates = rates[order]
+            weights = (amps*integral)[order]
+            # Fast modes decay within a few timesteps, so only evaluate
+            # each mode until it has decayed by a factor of exp(-50).
+            # Work in blocks of timesteps of exponentially increasing size.
+            res = np.zeros(n_t)
+            start = 0
+            while start < n_t-1:
+                end = min(max(2*start, 1), n_t-1)
+                n_modes = np.searchsorted(np.real(rates), 50/start, side="right") if start > 0 else len(rates)
+                exps = np.exp(-np.outer(np.arange(start, end), rates[0:n_modes]))
+                res[start+1:end+1] = np.real(exps.dot(weights[0:n_modes]))
+                start = end
+            return res
+        pdf_choice_upper = flux_upper * integrate(rates_upper, amps_upper)
+        pdf_choice_lower = flux_lower * integrate(rates_lower, amps_lower)
+        pdf_undec = undec_modes(n_t-1)
+
+        # Detect and fix below zero errors
+        minval = np.min((np.min(pdf_choice_upper), np.min(pdf_choice_lower)))
+        if minval < 0:
+            sum_negative_strength = np.sum(pdf_choice_upper[pdf_choice_upper<0]) + np.sum(pdf_choice_lower[pdf_choice_lower<0])
+            if sum_negative_strength < -.01 and param.renorm_warnings:
+                _logger.warning(("Probability density included values less than zero (minimum=%f, "
+                    + "total=%f).  Please decrease dx and/or avoid extreme parameter values.")
+                    % (minval, sum_negative_strength))
+                _logger.debug(self.parameters())
+            pdf_choice_upper[pdf_choice_upper < 0] = 0
+            pdf_choice_lower[pdf_choice_lower < 0] = 0
+        pdf_undec[pdf_undec < 0] = 0
+        # Fix numerical errors
+        pdfsum = np.sum(pdf_choice_upper) + np.sum(pdf_choice_lower) + np.sum(pdf_undec)
+        if pdfsum > 1:
+            if pdfsum > 1.01 and param.renorm_warnings:
+                _logger.warning(("Renormalizing probability density from " + str(pdfsum) + " to 1."
+                    + "  Try decreasing dx.  If that doesn't eliminate this warning, it may be due"
+                    + " to extreme parameter values and/or bugs in your model spefication."))
+                _logger.debug(self.parameters())
+            pdf_choice_upper /= pdfsum
+            pdf_choice_lower /= pdfsum
+            pdf_undec /= pdfsum
+        return self.get_dependence('overlay').apply(Solution(pdf_choice_upper, pdf_choice_lower, self, conditions=conditions, pdf_undec=pdf_undec))
+
+    def _step_propagator(self, x, t, dt, conditions, scheme="euler", factorize=False, dx=None):
+        """A function which advances the distribution over `x` by one step.
+
+        The step has size `dt` and starts at time `t`.  `x` must contain
+        only the positions within the bounds.  `scheme` may be "euler"
+        for backward Euler or "trbdf2" for TR-BDF2.  If `factorize` is
+        True, the matrices are factorized up front, which is faster if
+        the returned function will be called many times.  `dx` defaults
+        to the model's dx, but may be an array of the spacing between
+        adjacent positions in `x` for a non-uniform grid.
+
+        The returned function takes the distribution at time `t` and
+        returns a tuple of the distribution at time `t+dt` and the
+        probability mass which crossed the lower and upper bounds during
+        the step.
+        """
+        drift = self.get_dependence('drift')
+        noise = self.get_dependence('noise')
+        if dx is None:
+            dx = self.dx
+        dx_lower = dx if np.isscalar(dx) else dx[0]
+        dx_upper = dx if np.isscalar(dx) else dx[-1]
+        def operator(t):
+            # The diffusion matrix (without the identity) and the flux
+            # across each bound.  The column sums of the matrix are the
+            # fluxes, so probability is conserved.
+            matrix = drift.get_matrix(x=x, t=t, dt=dt, dx=dx, conditions=conditions, implicit=True) \
+                   + noise.get_matrix(x=x, t=t, dt=dt, dx=dx, conditions=conditions, implicit=True)
+            flux_lower = drift.get_flux(x[0], t, dx=dx_lower, dt=dt, conditions=conditions) \
+                       + noise.get_flux(x[0], t, dx=dx_lower, dt=dt, conditions=conditions)
+            flux_upper = drift.get_flux(x[-1], t, dx=dx_upper, dt=dt, conditions=conditions) \
+                       + noise.get_flux(x[-1], t, dx=dx_upper, dt=dt, conditions=conditions)
+            return matrix, flux_lower, flux_upper
+        solver = (lambda m : m.factorize()) if factorize else (lambda m : m.spsolve)
+        eye = TriDiagMatrix.eye(len(x))
+        if scheme == "euler":
+            matrix, flux_lower, flux_upper = operator(t)
+            solve = solver(eye + matrix)
+            def advance(pdf):
+                pdf_next = solve(pdf)
+                return pdf_next, pdf_next[0]*flux_lower, pdf_next[-1]*flux_upper
+        elif scheme == "trbdf2":
+            # TR-BDF2 first takes a trapezoid (Crank-Nicolson) step to
+            # t+g*dt and then a BDF2 step from t, t+g*dt to t+dt.  The
+            # constants are from Bank et al. (1985), and are chosen such
+            # that the two stages have the same matrix structure and the
+            # method is L-stable.
+            g = 2 - np.sqrt(2)
+            w = (1-g)/(2-g)
+            a = 1/(g*(2-g))
+            b = (1-g)**2/(g*(2-g))
+            matrix0, flux_lower0, flux_upper0 = operator(t)
+            if drift._uses_t() or noise._uses_t():
+                matrix1, flux_lower1, flux_upper1 = operator(t+dt)
+            else:
+                matrix1, flux_lower1, flux_upper1 = matrix0, flux_lower0, flux_upper0
+            # Linearly interpolate the operator for the intermediate stage
+            matrix_g = matrix0*(1-g) + matrix1*g
+            flux_lower_g = flux_lower0*(1-g) + flux_lower1*g
+            flux_upper_g = flux_upper0*(1-g) + flux_upper1*g
+            explicit_stage1 = eye - matrix0*(g/2)
+            solve_stage1 = solver(eye + matrix_g*(g/2))
+            solve_stage2 = solver(eye + matrix1*w)
+            def advance(pdf):
+                pdf_mid = solve_stage1(explicit_stage1.dot(pdf))
+                pdf_next = solve_stage2(a*pdf_mid - b*pdf)
+                # Integrate the flux with the same quadrature as the
+                # scheme itself, so that probability is conserved.
+                mass_lower = a*g/2*(flux_lower0*pdf[0] + flux_lower_g*pdf_mid[0]) + w*flux_lower1*pdf_next[0]
+                mass_upper = a*g/2*(flux_upper0*pdf[-1] + flux_upper_g*pdf_mid[-1]) + w*flux_upper1*pdf_next[-1]
+                return pdf_next, mass_lower, mass_upper
+        else:
+            raise ValueError("Invalid scheme "+scheme)
+        return advance
+
+    def _implicit_step(self, pdf_prev, t, dt, x_list, bmax, conditions, factorizations=None, scheme="euler"):
+        """Take one implicit step of size `dt`, starting at time `t`.
+
+        `pdf_prev` is the distribution over `x_list` at time `t`, and
+        `bmax` is the largest bound over the simulation.  If
+        `factorizations` is a dict, factorized diffusion matrices are
+        stored in it and reused across calls.  This is only valid if the
+        drift and noise do not depend on time.  `scheme` is passed to
+        _step_propagator.
+
+        Returns a tuple of the distribution at time `t+dt` and the
+        probability mass which crossed the upper and lower bounds during
+        the step.  This follows the same scheme as solve_numerical, but
+        allows the size of the step to vary.
+        """
+        bound = self.get_dependence('bound').get_bound(t=t, conditions=conditions)
+        assert bmax >= bound, "Invalid change in bound" # Ensure the bound didn't expand
+        bound_shift = bmax - bound
+        # Linearly approximate the bound by the two surrounding grids
+        # sandwiching it, as in solve_numerical.
+        x_index_inner = int(np.ceil(bound_shift/self.dx))
+        x_index_outer = int(np.floor(bound_shift/self.dx))
+        weight_inner = (bound_shift - x_index_outer*self.dx)/self.dx
+        weight_outer = 1. - weight_inner
+        pdf_curr = np.zeros(len(x_list))
+        mass_upper = 0
+        mass_lower = 0
+        for x_index, weight in [(x_index_outer, weight_outer), (x_index_inner, weight_inner)]:
+            x_list_inbounds = x_list[x_index:len(x_list)-x_index]
+            if weight == 0 or len(x_list_inbounds) == 0:
+                continue
+            key = (dt, x_index, scheme)
+            if factorizations is not None and key in factorizations:
+                advance = factorizations[key]
+            else:
+                advance = self._step_propagator(x_list_inbounds, t, dt, conditions, scheme=scheme,
+                                                factorize=(factorizations is not None))
+                if factorizations is not None:
+                    factorizations[key] = advance
+            pdf, exit_lower, exit_upper = advance(pdf_prev[x_index:len(x_list)-x_index])
+            pdf_curr[x_index:len(x_list)-x_index] += weight*pdf
+            # Mass out of bounds is considered decisions made, as is the
+            # flux across the bounds.
+            mass_lower += weight * (np.sum(pdf_prev[:x_index]) + exit_lower)
+            mass_upper += weight * (np.sum(pdf_prev[len(x_list)-x_index:]) + exit_upper)
+        # Renormalize when the channel size has <1 grid
+        if bound < self.dx:
+            mass_upper *= (1+ (1-bound/self.dx))
+            mass_lower *= (1+ (1-bound/self.dx))
+        return pdf_curr, mass_upper, mass_lower
+
+    @accepts(Self, conditions=Conditions, return_evolution=Boolean, force_python=Boolean)
+    @returns(Solution)
+    def solve_numerical_trbdf2(self, conditions={}, return_evolution=False, force_python=False):
+        """Solve the DDM model using the TR-BDF2 method.
+
+        TR-BDF2 is second-order accurate in time, like Crank-Nicolson,
+        so it can use a larger dt than backward Euler for the same
+        accuracy.  Unlike Crank-Nicolson, it is L-stable, so it does not
+        oscillate, and it supports collapsing bounds.  Each timestep takes
+        about twice as long as a timestep of backward Euler.
+
+        This uses compiled C code if it is available, unless
+        `force_python` is True or `return_evolution` is True.  If
+        `return_evolution` is True, the Solution object includes the
+        distribution at each timepoint.
+        """
+        self.check_conditions_satisfied(conditions)
+        if HAS_CSOLVE and not force_python and not return_evolution:
+            drift, drifttype, noise, noisetype, bound, boundtype, ic = self._c_solver_arrays(conditions)
+            res = csolve.trbdf2_time(drift, drifttype, noise, noisetype, bound, boundtype, ic, self.T_dur, self.dt, self.dx, len(self._t_domain()))
+            return self._c_solver_solution(conditions, res[0], res[1], res[2])
+        x_list = self._x_domain(conditions=conditions)
+        pdf_curr = self._IC_array(conditions=conditions)
+        pdf_choice_upper = np.zeros(len(self._t_domain()))
+        pdf_choice_lower = np.zeros(len(self._t_domain()))
+        if return_evolution:
+            pdf_evolution = np.zeros((len(x_list), len(self._t_domain())))
+            pdf_evolution[:,0] = pdf_curr
+        _bound_func = self.get_dependence("bound").get_bound
+        bmax = max([_bound_func(t=t, conditions=conditions) for t in self._t_domain()])
+        if self.get_dependence("drift")._uses_t() or self.get_dependence("noise")._uses_t():
+            factorizations = None
+        else:
+            factorizations = {}
+        for i_t, t in enumerate(self._t_domain()[:-1]):
+            if np.sum(pdf_curr) < 0.0001:
+                break
+            pdf_curr, pdf_choice_upper[i_t+1], pdf_choice_lower[i_t+1] = \
+                self._implicit_step(pdf_curr, t, self.dt, x_list, bmax, conditions, factorizations, scheme="trbdf2")
+            if return_evolution:
+                pdf_evolution[:,i_t+1] = pdf_curr
+        pdf_undec = pdf_curr
+
+        # Detect and fix below zero errors
+        minval = np.min((np.min(pdf_choice_upper), np.min(pdf_choice_lower)))
+        if minval < 0:
+            sum_negative_strength = np.sum(pdf_choice_upper[pdf_choice_upper<0]) + np.sum(pdf_choice_lower[pdf_choice_lower<0])
+            if sum_negative_strength < -.01 and param.renorm_warnings:
+                _logger.warning(("Probability density included values less than zero (minimum=%f, "
+                    + "total=%f).  Please decrease dt and/or avoid extreme parameter values.")
+                    % (minval, sum_negative_strength))
+                _logger.debug(self.parameters())
+            pdf_choice_upper[pdf_choice_upper < 0] = 0
+            pdf_choice_lower[pdf_choice_lower < 0] = 0
+        pdf_undec[pdf_undec < 0] = 0
+        # Fix numerical errors
+        pdfsum = np.sum(pdf_choice_upper) + np.sum(pdf_choice_lower) + np.sum(pdf_undec)
+        if pdfsum > 1:
+            if pdfsum > 1.01 and param.renorm_warnings:
+                _logger.warning(("Renormalizing probability density from " + str(pdfsum) + " to 1."
+                    + "  Try decreasing dt.  If that doesn't eliminate this warning, it may be due"
+                    + " to extreme parameter values and/or bugs in your model spefication."))
+                _logger.debug(self.parameters())
+            pdf_choice_upper /= pdfsum
+            pdf_choice_lower /= pdfsum
+            pdf_undec /= pdfsum
+        if return_evolution:
+            # The first step after a point source initial condition may
+            # briefly dip below zero
+            pdf_evolution[pdf_evolution < 0] = 0
+            return self.get_dependence('overlay').apply(Solution(pdf_choice_upper, pdf_choice_lower, self, conditions=conditions, pdf_undec=pdf_undec, pdf_evolution=pdf_evolution))
+        return self.get_dependence('overlay').apply(Solution(pdf_choice_upper, pdf_choice_lower, self, conditions=conditions, pdf_undec=pdf_undec))
+
+    @accepts(Self, conditions=Conditions, tol=Positive, force_python=Boolean)
+    @returns(Solution)
+    def solve_numerical_adaptive(self, conditions={}, tol=1e-2, force_python=False):
+        """Solve the DDM model using backward Euler with adaptive timesteps.
+
+        Most of the probability mass usually crosses the bounds early in
+        the trial, after which the distribution changes slowly.  This
+        solver takes short timesteps when the distribution changes
+        quickly and long timesteps otherwise.  Timesteps are chosen by
+        step doubling: each step of size h is compared to two steps of
+        size h/2, and the step size is halved or doubled depending on the
+        difference between them.  Timesteps are always powers of two
+        multiples of the model's dt, so dt is the smallest timestep.
+
+        `tol` is the approximate error in the probability distribution
+        allowed over the duration of the simulation.  Smaller values take
+        smaller timesteps.  The default gives errors similar to those
+        from the fixed timestep dt.
+
+        The probability of crossing each bound is linearly interpolated
+        onto the timepoints given by t_domain(), so the resulting
+        Solution object is the same as for the other solvers.
+
+        This uses compiled C code if it is available, unless
+        `force_python` is True.
+        """
+        self.check_conditions_satisfied(conditions)
+        if HAS_CSOLVE and not force_python:
+            drift, drifttype, noise, noisetype, bound, boundtype, ic = self._c_solver_arrays(conditions)
+            res = csolve.adaptive_time(drift, drifttype, noise, noisetype, bound, boundtype, ic, self.T_dur, self.dt, self.dx, len(self._t_domain()), tol)
+            return self._c_solver_solution(conditions, res[0], res[1], res[2])
+        x_list = self._x_domain(conditions=conditions)
+        pdf_curr = self._IC_array(conditions=conditions)
+        n_steps = len(self._t_domain()) - 1
+        _bound_func = self.get_dependence("bound").get_bound
+        bmax = max([_bound_func(t=t, conditions=conditions) for t in self._t_domain()])
+        # The diffusion matrix only changes with the bound, so we can
+        # reuse factorized matrices if the drift and noise don't depend
+        # on time.
+        if self.get_dependence("drift")._uses_t() or self.get_dependence("noise")._uses_t():
+            factorizations = None
+        else:
+            factorizations = {}
+        # Times (in units of dt) at the end of each step, and the
+        # cumulative probability of crossing each bound at those times
+        step_ends = [0]
+        cum_upper = [0]
+        cum_lower = [0]
+        i_t = 0 # Current time, in units of dt
+        step = 1 # Current step size, in units of dt
+        while i_t < n_steps:
+            if np.sum(pdf_curr) < 0.0001:
+                break
+            # Steps must evenly divide the current time, so step sizes
+            # can only increase at aligned times.
+            while i_t % step != 0 or i_t + step > n_steps:
+                step //= 2
+            if step == 1:
+                pdf_curr, mass_upper, mass_lower = self._implicit_step(pdf_curr, i_t*self.dt, self.dt, x_list, bmax, conditions, factorizations)
+                steps = [(i_t+1, mass_upper, mass_lower)]
+                err = 0
+            else:
+                h = step*self.dt
+                pdf_full, mass_upper_full, mass_lower_full = self._implicit_step(pdf_curr, i_t*self.dt, h, x_list, bmax, conditions, factorizations)
+                pdf_half, mass_upper1, mass_lower1 = self._implicit_step(pdf_curr, i_t*self.dt, h/2, x_list, bmax, conditions, factorizations)
+                pdf_half, mass_upper2, mass_lower2 = self._implicit_step(pdf_half, i_t*self.dt+h/2, h/2, x_list, bmax, conditions, factorizations)
+                err = np.sum(np.abs(pdf_full - pdf_half)) \
+                      + np.abs(mass_upper_full - mass_upper1 - mass_upper2) \
+                      + np.abs(mass_lower_full - mass_lower1 - mass_lower2)
+                # Reject the step if it is larger than this step's share
+                # of the total tolerance.  The two half steps are already
+                # computed, so if they are the smallest possible step,
+                # use them.
+                if err > tol * step/n_steps and step > 2:
+                    step //= 2
+                    continue
+                pdf_curr = pdf_half
+                steps = [(i_t+step//2, mass_upper1, mass_lower1), (i_t+step, mass_upper2, mass_lower2)]
+            for end, mass_upper, mass_lower in steps:
+                step_ends.append(end)
+                cum_upper.append(cum_upper[-1] + mass_upper)
+                cum_lower.append(cum_lower[-1] + mass_lower)
+            i_t = step_ends[-1]
+            # Increase the step size if the error is well within
+            # tolerance.  The local error of backward Euler grows with the
+            # square of the step size, so each doubling of the step
+            # doubles the error relative to the step's tolerance.
+            # Grow by at most a factor of 8 per step.
+            for _ in range(3):
+                if err * 4 > tol * step/n_steps:
+                    break
+                step *= 2
+                err *= 2
+        # Interpolate the cumulative probability onto the time domain
+        # and convert it back to the probability within each timestep.
+        t_indices = np.arange(0, n_steps+1)
+        pdf_choice_upper = np.concatenate([[0], np.diff(np.interp(t_indices, step_ends, cum_upper))])
+        pdf_choice_lower = np.concatenate([[0], np.diff(np.interp(t_indices, step_ends, cum_lower))])
+        pdf_undec = pdf_curr
+
+        # Detect and fix below zero errors
+        minval = np.min((np.min(pdf_choice_upper), np.min(pdf_choice_lower)))
+        if minval < 0:
+            sum_negative_strength = np.sum(pdf_choice_upper[pdf_choice_upper<0]) + np.sum(pdf_choice_lower[pdf_choice_lower<0])
+            if sum_negative_strength < -.01 and param.renorm_warnings:
+                _logger.warning(("Probability density included values less than zero (minimum=%f, "
+                    + "total=%f).  Please decrease dt and/or avoid extreme parameter values.")
+                    % (minval, sum_negative_strength))
+                _logger.debug(self.parameters())
+            pdf_choice_upper[pdf_choice_upper < 0] = 0
+            pdf_choice_lower[pdf_choice_lower < 0] = 0
+        pdf_undec[pdf_undec < 0] = 0
+        # Fix numerical errors
+        pdfsum = np.sum(pdf_choice_upper) + np.sum(pdf_choice_lower) + np.sum(pdf_undec)
+        if pdfsum > 1:
+            if pdfsum > 1.01 and param.renorm_warnings:
+                _logger.warning(("Renormalizing probability density from " + str(pdfsum) + " to 1."
+                    + "  Try decreasing dt.  If that doesn't eliminate this warning, it may be due"
+                    + " to extreme parameter values and/or bugs in your model spefication."))
+                _logger.debug(self.parameters())
+            pdf_choice_upper /= pdfsum
+            pdf_choice_lower /= pdfsum
+            pdf_undec /= pdfsum
+        return self.get_dependence('overlay').apply(Solution(pdf_choice_upper, pdf_choice_lower, self, conditions=conditions, pdf_undec=pdf_undec))
+
+    @accepts(Self, conditions=Conditions, coarsening=Natural1, force_python=Boolean)
     @requires("self.can_solve_cn(conditions=conditions)")
     @returns(Solution)
-    def solve_numerical_cn(self, conditions={}):
+    def solve_numerical_graded(self, conditions={}, coarsening=8, force_python=False):
+        """Solve the DDM model with backward Euler on a non-uniform grid.
+
+        The distribution changes most quickly near the bounds and near
+        the starting point, so this uses a grid spacing of dx there, and a
+        coarser spacing (up to `coarsening` times dx) elsewhere.  See
+        x_domain_graded() for details.  This gives a similar accuracy to
+        the uniform grid with dx using several times fewer grid points.
+        Only bounds which do not depend on time are supported.
+
+        The initial condition is mapped onto the coarser grid by
+        splitting the probability of each point between the two
+        surrounding grid points, and the undecided probability is
+        interpolated back onto x_domain() at the end.
+
+        `force_python` makes PyDDM use the solver written in Python instead of
+        the optimized solver written in C.  The C solver is only used if
+        the drift and noise use the default get_matrix() and get_flux().
+
+        It returns a Solution object describing the joint PDF.
+        """
+        self.check_conditions_satisfied(conditions)
+        x_list = self._x_domain(conditions=conditions)
+        indices = self.x_domain_graded(conditions, coarsening)
+        x_graded = x_list[indices]
+        spacing = np.diff(x_graded)
+        width = np.concatenate([[spacing[0]], (spacing[1:]+spacing[:-1])/2, [spacing[-1]]])
+        # Split each point of the initial condition between the
+        # surrounding grid points, preserving the mean.
+        pos = np.arange(len(x_list))
+        segment = np.minimum(np.searchsorted(indices, pos, side="right")-1, len(indices)-2)
+        frac = (pos - indices[segment])/(indices[segment+1] - indices[segment])
+        pdf_init = self._IC_array(conditions=conditions)
+        pdf_curr = np.bincount(segment, (1-frac)*pdf_init, minlength=len(indices)) \
+                 + np.bincount(segment+1, frac*pdf_init, minlength=len(indices))
+        pdf_choice_upper = np.zeros(len(self._t_domain()))
+        pdf_choice_lower = np.zeros(len(self._t_domain()))
+        time_invariant = not (self.get_dependence("drift")._uses_t() or self.get_dependence("noise")._uses_t())
+        drift = self.get_dependence("drift")
+        noise = self.get_dependence("noise")
+        if HAS_CSOLVE and not force_python and \
+           type(drift).get_matrix is Drift.get_matrix and type(drift).get_flux is Drift.get_flux and \
+           type(noise).get_matrix is Noise.get_matrix and type(noise).get_flux is Noise.get_flux:
+            # Evaluate the drift and noise on the graded grid, in the
+            # format described in _c_solver_arrays.
+            def grid_values(dep, get):
+                ts = self._t_domain() if dep._uses_t() else [0]
+                n = len(x_graded) if dep._uses_x() else 1
+                values = np.concatenate([get(x=x_graded, t=t, dx=np.min(spacing), dt=self.dt, conditions=conditions) * np.ones(n) for t in ts])
+                return values, int(dep._uses_t()) + 2*int(dep._uses_x())
+            driftvals, drifttype = grid_values(drift, drift.get_drift)
+            noisevals, noisetype = grid_values(noise, noise.get_noise)
+            pdf_choice_upper, pdf_choice_lower, pdf_curr = csolve.graded_time(driftvals, drifttype, noisevals, noisetype, pdf_curr, spacing, self.dt, len(self._t_domain()))
+        else:
+            advance = None
+            for i_t, t in enumerate(self._t_domain()[:-1]):
+                if np.sum(pdf_curr) < 0.0001:
+                    break
+                if advance is None or not time_invariant:
+                    advance = self._step_propagator(x_graded, t, self.dt, conditions, factorize=time_invariant, dx=spacing)
+                pdf_curr, pdf_choice_lower[i_t+1], pdf_choice_upper[i_t+1] = advance(pdf_curr)
+        # Interpolate the density back onto the uniform grid
+        pdf_undec = np.interp(x_list, x_graded, pdf_curr/width) * self.dx
+        if np.sum(pdf_undec) > 0:
+            pdf_undec *= np.sum(pdf_curr)/np.sum(pdf_undec)
+
+        # Detect and fix below zero errors
+        minval = np.min((np.min(pdf_choice_upper), np.min(pdf_choice_lower)))
+        if minval < 0:
+            sum_negative_strength = np.sum(pdf_choice_upper[pdf_choice_upper<0]) + np.sum(pdf_choice_lower[pdf_choice_lower<0])
+            if sum_negative_strength < -.01 and param.renorm_warnings:
+                _logger.warning(("Probability density included values less than zero (minimum=%f, "
+                    + "total=%f).  Please decrease dx and/or avoid extreme parameter values.")
+                    % (minval, sum_negative_strength))
+                _logger.debug(self.parameters())
+            pdf_choice_upper[pdf_choice_upper < 0] = 0
+            pdf_choice_lower[pdf_choice_lower < 0] = 0
+        pdf_undec[pdf_undec < 0] = 0
+        # Fix numerical errors
+        pdfsum = np.sum(pdf_choice_upper) + np.sum(pdf_choice_lower) + np.sum(pdf_undec)
+        if pdfsum > 1:
+            if pdfsum > 1.01 and param.renorm_warnings:
+                _logger.warning(("Renormalizing probability density from " + str(pdfsum) + " to 1."
+                    + "  Try decreasing dx or coarsening.  If that doesn't eliminate this warning, it may be due"
+                    + " to extreme parameter values and/or bugs in your model spefication."))
+                _logger.debug(self.parameters())
+            pdf_choice_upper /= pdfsum
+            pdf_choice_lower /= pdfsum
+            pdf_undec /= pdfsum
+        return self.get_dependence('overlay').apply(Solution(pdf_choice_upper, pdf_choice_lower, self, conditions=conditions, pdf_undec=pdf_undec))
+
+    @accepts(Self, conditions=Conditions, force_python=Boolean)
+    @requires("self.can_solve_cn(conditions=conditions)")
+    @returns(Solution)
+    def solve_numerical_cn(self, conditions={}, force_python=False):
         """Solve the DDM model numerically using Crank-Nicolson.
 
         This uses the Crank Nicolson method to solve the DDM at each
         timepoint.  Results are then compiled together.  This is the
         core DDM solver of this library.
 
+        `force_python` makes PyDDM use the solver written in Python instead of
+        the optimized solver written in C.
+
         It returns a Solution object describing the joint PDF.
         """
         ### Initialization: Lists
         self.check_conditions_satisfied(conditions)
-        pdf_curr = self.IC(conditions=conditions) # Initial condition
-        pdf_outer = self.IC(conditions=conditions)
-        pdf_inner = self.IC(conditions=conditions)
+        if HAS_CSOLVE and not force_python:
+            drift, drifttype, noise, noisetype, bound, boundtype, ic = self._c_solver_arrays(conditions)
+            res = csolve.cn_time(drift, drifttype, noise, noisetype, bound, boundtype, ic, self.T_dur, self.dt, self.dx, len(self._t_domain()))
+            return self._c_solver_solution(conditions, res[0], res[1], None)
+        pdf_curr = self._IC_array(conditions=conditions).copy() # Initial condition
+        pdf_outer = self._IC_array(conditions=conditions)
+        pdf_inner = self._IC_array(conditions=conditions)
         # pdf_prev = np.zeros((len(pdf_curr)))
         # If pdf_corr + pdf_err + undecided probability are summed, they
         # equal 1.  So these are componets of the joint pdf.
-        pdf_choice_upper = np.zeros(len(self.t_domain())+1) # Not a proper pdf on its own (doesn't sum to 1)
-        pdf_choice_lower = np.zeros(len(self.t_domain())+1) # Not a proper pdf on its own (doesn't sum to 1)
-        x_list = self.x_domain(conditions=conditions)
+        pdf_choice_upper = np.zeros(len(self._t_domain())+1) # Not a proper pdf on its own (doesn't sum to 1)
+        pdf_choice_lower = np.zeros(len(self._t_domain())+1) # Not a proper pdf on its own (doesn't sum to 1)
+        x_list = self._x_domain(conditions=conditions)
 
         bound_shift = 0.
         # Note that we linearly approximate the bound by the two surrounding grids sandwiching it.
@@ -952,8 +1857,9 @@ class Model(object):
 
         prev_t = 0
         prev_i_t = 0
+        operators = _OperatorCache(self, conditions)
         # Looping through time and updating the pdf.
-        for i_t, t in enumerate(self.t_domain()):
+        for i_t, t in enumerate(self._t_domain()):
             # Update Previous state.
             pdf_outer_prev = pdf_outer.copy()
             pdf_inner_prev = pdf_inner.copy()
@@ -992,30 +1898,9 @@ class Model(object):
                 # Outer Matrix, and inner matrix is either trivial or an
                 # extracted submatrix.
                 # diffusion_matrix_prev = 2.* np.diag(np.ones(len(x_list_inbounds_prev))) - diffusion_matrix       #Diffusion Matrix for Implicit Method. Here defined as Outer Matrix, and inner matrix is either trivial or an extracted submatrix.
-                local_dt = t - prev_t if t!=0 else self.t_domain()[1]
-                drift_matrix = self.get_dependence('drift').get_matrix(x=x_list_inbounds, t=t,
-                                                                       dt=local_dt, dx=self.dx, conditions=conditions,
-                                                                       implicit=True)
-                drift_matrix *= .5
-                noise_matrix = self.get_dependence('noise').get_matrix(x=x_list_inbounds,
-                                                                       t=t, dt=local_dt, dx=self.dx, conditions=conditions,
-                                                                       implicit=True)
-                noise_matrix *= .5
-                diffusion_matrix = TriDiagMatrix.eye(len(x_list_inbounds))
-                diffusion_matrix += drift_matrix
-                diffusion_matrix += noise_matrix
-
-                drift_matrix_prev = self.get_dependence('drift').get_matrix(x=x_list_inbounds_prev, t=prev_t,
-                                                                            dt=local_dt, dx=self.dx, conditions=conditions,
-                                                                            implicit=True)
-                drift_matrix_prev *= .5
-                noise_matrix_prev = self.get_dependence('noise').get_matrix(x=x_list_inbounds_prev, t=prev_t,
-                                                                            dt=local_dt, dx=self.dx, conditions=conditions,
-                                                                            implicit=True)
-                noise_matrix_prev *= .5
-                diffusion_matrix_prev = TriDiagMatrix.eye(len(x_list_inbounds_prev))
-                diffusion_matrix_prev -= drift_matrix_prev
-                diffusion_matrix_prev -= noise_matrix_prev
+                local_dt = t - prev_t if t!=0 else self._t_domain()[1]
+                diffusion_matrix = operators.matrix(x_list_inbounds, t, local_dt, scale=.5)
+                diffusion_matrix_prev = operators.matrix(x_list_inbounds_prev, prev_t, local_dt, scale=-.5)
 
                 ### Compute Probability density functions (pdf)
                 # PDF for outer matrix
@@ -1045,29 +1930,8 @@ class Model(object):
                     pdf_inner = pdf_outer
                 else:
                     # Need a separate matrix here to get the proper corrections
-                    drift_matrix = self.get_dependence('drift').get_matrix(x=x_list_inbounds[si_from:si_to], t=t,
-                                                                           dt=local_dt, dx=self.dx, conditions=conditions,
-                                                                           implicit=True)
-                    drift_matrix *= .5
-                    noise_matrix = self.get_dependence('noise').get_matrix(x=x_list_inbounds[si_from:si_to],
-                                                                           t=t, dt=local_dt, dx=self.dx, conditions=conditions,
-                                                                           implicit=True)
-                    noise_matrix *= .5
-                    diffusion_matrix = TriDiagMatrix.eye(len(x_list_inbounds[si_from:si_to]))
-                    diffusion_matrix += drift_matrix
-                    diffusion_matrix += noise_matrix
-
-                    drift_matrix_prev = self.get_dependence('drift').get_matrix(x=x_list_inbounds_prev[si2_from:si2_to], t=prev_t,
-                                                                                dt=local_dt, dx=self.dx, conditions=conditions,
-                                                                                implicit=True)
-                    drift_matrix_prev *= .5
-                    noise_matrix_prev = self.get_dependence('noise').get_matrix(x=x_list_inbounds_prev[si2_from:si2_to], t=prev_t,
-                                                                                dt=local_dt, dx=self.dx, conditions=conditions,
-                                                                                implicit=True)
-                    noise_matrix_prev *= .5
-                    diffusion_matrix_prev = TriDiagMatrix.eye(len(x_list_inbounds_prev[si2_from:si2_to]))
-                    diffusion_matrix_prev -= drift_matrix_prev
-                    diffusion_matrix_prev -= noise_matrix_prev
+                    diffusion_matrix = operators.matrix(x_list_inbounds[si_from:si_to], t, local_dt, scale=.5)
+                    diffusion_matrix_prev = operators.matrix(x_list_inbounds_prev[si2_from:si2_to], prev_t, local_dt, scale=-.5)
                     pdf_inner = diffusion_matrix.spsolve(diffusion_matrix_prev.dot(pdf_inner_prev)[si3_from:si3_to])
 
 
@@ -1131,7 +1995,7 @@ class Model(object):
         pdf_undec = pdf_curr
         minval = np.min((np.min(pdf_choice_upper), np.min(pdf_choice_lower)))
         if minval < 0:
-            sum_negative_strength = np.sum(pdf_choice_upper[pdf_corr<0]) + np.sum(pdf_choice_lower[pdf_choice_lower<0])
+            sum_negative_strength = np.sum(pdf_choice_upper[pdf_choice_upper<0]) + np.sum(pdf_choice_lower[pdf_choice_lower<0])
             # For small errors, don't bother alerting the user
             if sum_negative_strength < -.01 and param.renorm_warnings:
                 _logger.warning(("Probability density included values less than zero (minimum=%f, "
@@ -1157,6 +2021,99 @@ class Model(object):
         return self.get_dependence('overlay').apply(Solution(pdf_choice_upper, pdf_choice_lower, self, conditions=conditions, pdf_undec=None))
 
 
+class _OperatorCache:
+    """The diffusion matrices used by one run of a solver.
+
+    `matrix` returns identity*I + scale*(D + N), where D and N are the
+    drift and noise matrices over positions `x`.  If neither the drift
+    nor the noise depends on time, these are the same at every timestep
+    for a given set of positions, so each one is assembled once and then
+    reused.  Otherwise, the drift and noise matrices are computed at
+    each timestep, but they are summed into preallocated workspace, one
+    for each size of matrix.  Either way, the returned matrix may be
+    overwritten by later calls, so it should not be modified or kept.
+    """
+    def __init__(self, model, conditions, implicit=True):
+        self.drift = model.get_dependence("drift")
+        self.noise = model.get_dependence("noise")
+        self.dx = model.dx
+        self.conditions = conditions
+        self.implicit = implicit
+        self.uses_t = self.drift._uses_t() or self.noise._uses_t()
+        self.matrices = {}
+    def matrix(self, x, t, dt, identity=1, scale=1):
+        # Slices of x within the bounds are identified by their first
+        # position and length.
+        key = (len(x), x[0], identity, scale) + ((t, dt) if self.uses_t else (dt,))
+        if key in self.matrices:
+            return self.matrices[key]
+        parts = [dep.get_matrix(x=x, t=t, dt=dt, dx=self.dx, conditions=self.conditions, implicit=self.implicit)
+                 for dep in [self.drift, self.noise]]
+        if self.uses_t:
+            workkey = (len(x), identity, scale)
+            if workkey not in self.matrices:
+                self.matrices[workkey] = TriDiagMatrix.zeros(len(x))
+            return self.matrices[workkey].set_sum(parts, identity=identity, scale=scale)
+        m = TriDiagMatrix.zeros(len(x)).set_sum(parts, identity=identity, scale=scale)
+        self.matrices[key] = m
+        return m
+
+def _spectral_decomposition(matrix, pdf_init):
+    """Eigendecomposition of the diffusion matrix for the spectral solver.
+
+    `matrix` is the TriDiagMatrix M for one timestep of the implicit method
+    (without the identity), and `pdf_init` is the initial condition.  The
+    density p evolves according to dp/di = -Mp, where i is the timestep.
+
+    Returns a tuple of five elements.  The first two are the rates and
+    amplitudes such that the density at the lower boundary point at
+    timestep i is sum(amps*exp(-rates*i)), and the second two are the same
+    for the upper boundary point.  The final element is a function which
+    takes i and returns the density over the full domain at timestep i.
+    Rates and amplitudes may be complex.
+    """
+    n = matrix.shape[0]
+    # Because of the absorbing boundary correction, the boundary points
+    # do not feed back into the interior.  So, if the interior can be
+    # symmetrized (i.e. all products of off-diagonals are positive), find
+    # the eigenvectors of the symmetric interior using a fast tridiagonal
+    # solver and then solve for the boundary points analytically.
+    # Otherwise, use a general dense eigendecomposition.
+    if n >= 3:
+        interior = matrix.splice(1, n-1)
+        up, down = interior.up, interior.down
+        if np.all(up*down > 0):
+            logw = np.concatenate([[0], np.cumsum(.5*np.log(down/up))])
+        # eigh_tridiagonal requires scipy 1.0 or later
+        if np.all(up*down > 0) and np.ptp(logw) < 30 and hasattr(scipy.linalg, "eigh_tridiagonal"):
+            w = np.exp(logw)
+            rates, evecs = scipy.linalg.eigh_tridiagonal(interior.diag, np.sign(up)*np.sqrt(up*down))
+            coefs = evecs.T.dot(pdf_init[1:-1]/w) # Project the initial condition onto the eigenvectors
+            vec_lower = matrix.up[0] * w[0] * evecs[0]
+            vec_upper = matrix.down[-1] * w[-1] * evecs[-1]
+            diff_lower = rates - matrix.diag[0]
+            diff_upper = rates - matrix.diag[-1]
+            # Avoid division by zero when an eigenvalue of the interior
+            # coincides with the diagonal at the boundary
+            if np.min(np.abs(diff_lower)) > 1e-10 and np.min(np.abs(diff_upper)) > 1e-10:
+                amps_lower = coefs * vec_lower/diff_lower
+                amps_upper = coefs * vec_upper/diff_upper
+                amp0_lower = pdf_init[0] - np.sum(amps_lower)
+                amp0_upper = pdf_init[-1] - np.sum(amps_upper)
+                def pdf_at(i):
+                    decay = np.exp(-rates*i)
+                    return np.concatenate([[np.sum(amps_lower*decay) + amp0_lower*np.exp(-matrix.diag[0]*i)],
+                                           w*evecs.dot(coefs*decay),
+                                           [np.sum(amps_upper*decay) + amp0_upper*np.exp(-matrix.diag[-1]*i)]])
+                return (np.concatenate([[matrix.diag[0]], rates]), np.concatenate([[amp0_lower], amps_lower]),
+                        np.concatenate([[matrix.diag[-1]], rates]), np.concatenate([[amp0_upper], amps_upper]),
+                        pdf_at)
+    dense = matrix.to_scipy_sparse().toarray()
+    rates, evecs = np.linalg.eig(dense)
+    coefs = np.linalg.solve(evecs, pdf_init.astype(complex))
+    pdf_at = lambda i : np.real(evecs.dot(coefs*np.exp(-rates*i)))
+    return (rates, evecs[0]*coefs, rates, evecs[-1]*coefs, pdf_at)
+
 @paranoidclass
 class Fittable(float):
     """For parameters that should be adjusted when fitting a model to data.
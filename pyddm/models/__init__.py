@@ -13,7 +13,8 @@ __all__ = ["Dependence",
                "OverlaySimplePause", "OverlayBlurredPause",
                "OverlayUniformMixture", "OverlayPoissonMixture", "OverlayExponentialMixture",
                "OverlayNonDecision", "OverlayNonDecisionUniform", "OverlayNonDecisionGamma",
-           "LossFunction", "LossSquaredError", "LossLikelihood", "LossBIC", "LossRobustLikelihood", "LossRobustBIC"]
+           "LossFunction", "LossSquaredError", "LossLikelihood", "LossBIC", "LossRobustLikelihood", "LossRobustBIC",
+           "LossQuantileChiSquare", "LossQuantileG2"]
 
 from .base import *
 from .drift import *
@@ -27,9 +27,10 @@ class Drift(Dependence):
         return self._uses(self.get_drift, "t")
     def _uses_x(self):
         return self._uses(self.get_drift, "x")
-    @accepts(Self, x=NDArray(d=1, t=Number), t=Positive0, dx=Positive, dt=Positive, conditions=Conditions, implicit=Boolean)
+    @accepts(Self, x=NDArray(d=1, t=Number), t=Positive0, dx=Or(Positive, NDArray(d=1, t=Positive)), dt=Positive, conditions=Conditions, implicit=Boolean)
     @returns(TriDiagMatrix)
     @ensures("return.shape == (len(x), len(x))")
+    @requires("np.isscalar(dx) or len(dx) == len(x) - 1")
     def get_matrix(self, x, t, dx, dt, conditions, implicit=False, **kwargs):
         """The drift component of the implicit method diffusion matrix across the domain `x` at time `t`.
 
@@ -38,11 +39,32 @@ class Drift(Dependence):
         `dt` and `dx` should be the simulations timestep and grid step
         `conditions` should be the conditions at which to calculate drift
 
+        For a non-uniform grid, `dx` may instead be a length N-1
+        ndarray of the spacing between adjacent positions in `x`.
+
         Returns a sparse NxN matrix as a PyDDM TriDiagMatrix object.
 
         There is generally no need to redefine this method in
         subclasses.
         """
+        if not np.isscalar(dx):
+            # Each grid point holds the probability within the cell
+            # extending halfway to its neighbors, so the probability
+            # density is the probability divided by the cell's width.
+            # This reduces to the uniform case below when dx is constant.
+            drift = self.get_drift(x=x, t=t, dx=np.min(dx), dt=dt, conditions=conditions, **kwargs) * np.ones(len(x))
+            width = np.concatenate([[dx[0]], (dx[1:]+dx[:-1])/2, [dx[-1]]])
+            D = np.zeros(len(x))
+            UP = 0.5*dt * drift[1:]/width[1:]
+            DOWN = -0.5*dt * drift[:-1]/width[:-1]
+            if implicit:
+                D[-1] = UP[-1]
+                UP[-1] = 0
+                D[0] = DOWN[0]
+                DOWN[0] = 0
+            return TriDiagMatrix(up=UP,
+                                 down=DOWN,
+                                 diag=D)
         drift = self.get_drift(x=x, t=t, dx=dx, dt=dt, conditions=conditions, **kwargs)
         D = np.zeros(len(x))
         if np.isscalar(drift):
@@ -4,7 +4,8 @@
 # This file is part of PyDDM, and is available under the MIT license.
 # Please see LICENSE.txt in the root directory for more information.
 
-__all__ = ['LossFunction', 'LossSquaredError', 'LossLikelihood', 'LossBIC', 'LossRobustLikelihood', 'LossRobustBIC']
+__all__ = ['LossFunction', 'LossSquaredError', 'LossLikelihood', 'LossBIC', 'LossRobustLikelihood', 'LossRobustBIC',
+           'LossQuantileChiSquare', 'LossQuantileG2']
 
 import logging
 import numpy as np
@@ -12,7 +13,9 @@ import numpy as np
 from paranoid.decorators import accepts, returns, requires, ensures, paranoidclass
 from paranoid.types import Self, Number, Positive0, Natural1
 from ..sample import Sample
-from ..model import Model
+from ..model import Model, HAS_CSOLVE
+from ..cache import get_solution_cache, get_solution_store
+from .overlay import OverlayNone, OverlayChain, OverlayNonDecision, OverlayUniformMixture
 from ..logger import logger as _logger
 
 class LossFunction(object):
@@ -34,11 +37,14 @@ class LossFunction(object):
     empty list.
 
     The optional `method` argument can be "analytical", "numerical",
-    "cn", "implicit", or "explicit".
+    "cn", "implicit", "explicit", "spectral", "adaptive", "trbdf2",
+    "graded", "lookup" (see LookupTable), or "surrogate" (see
+    Surrogate).
 
     This will automatically parallelize if set_N_cpus() has been
     called.
     """
+    horizons = None
     @classmethod
     def _generate(cls):
         # Return an instance of each subclass which doesn't have a
@@ -86,11 +92,14 @@ class LossFunction(object):
 
         This is a convenience function for defining new loss
         functions.  There is generally no need to redefine this
-        function in subclasses.
+        function in subclasses.  Loss functions which only need the
+        pdfs up to some time may set `horizons` in their setup function,
+        as described in solve_all_conditions, so that the model is not
+        solved for longer than necessary.
 
         """
         from ..functions import solve_all_conditions
-        return solve_all_conditions(model, sample=self.sample, method=self.method)
+        return solve_all_conditions(model, sample=self.sample, method=self.method, horizons=self.horizons)
 @paranoidclass
 class LossSquaredError(LossFunction):
     """Squared-error loss function"""
@@ -140,29 +149,32 @@ class LossLikelihood(LossFunction):
         self.T_dur = T_dur
         # Each element in the dict is indexed by the conditions of the
         # model (e.g. coherence, trial conditions) as a frozenset.
-        # Each contains a tuple of lists, which are to contain the
-        # position for each within a histogram.  For instance, if a
-        # reaction time corresponds to position i, then we can index a
-        # list representing a normalized histogram/"pdf" (given by dt
-        # and T_dur) for immediate access to the probability of
-        # obtaining that value.
-        self.hist_indexes = {}
+        # Each contains a tuple of histograms of the reaction times for
+        # each choice, as returned by _nonzero_counts, and the number
+        # of undecided trials.  The histogram bins are the timepoints
+        # in the pdfs (given by dt and T_dur), so the likelihood only
+        # needs the pdf once for each timepoint, no matter how many
+        # trials there are.
+        self.hist_counts = {}
+        # The likelihood only needs the pdfs up to the longest reaction
+        # time for each combination of conditions.
+        self.horizons = {}
         for comb in self.sample.condition_combinations(required_conditions=self.required_conditions):
             s = self.sample.subset(**comb)
             maxt = max(max(s.choice_upper) if s.choice_upper.size != 0 else -1, max(s.choice_lower) if s.choice_lower.size != 0 else -1)
             assert maxt <= self.T_dur, "Simulation time T_dur=%f not long enough for these data. (max sample RT=%f)" % (self.T_dur, maxt)
-            # Find the integers which correspond to the timepoints in
-            # the pdfs.  Also don't group them into the first bin
-            # because this creates bias.
-            choice_upper = [int(round(e/dt)) for e in s.choice_upper]
-            choice_lower = [int(round(e/dt)) for e in s.choice_lower]
             undec = self.sample.undecided
-            self.hist_indexes[frozenset(comb.items())] = (choice_upper, choice_lower, undec)
+            self.hist_counts[frozenset(comb.items())] = (_nonzero_counts(s.choice_upper, dt), _nonzero_counts(s.choice_lower, dt), undec)
+            self.horizons[frozenset(comb.items())] = max(maxt, 0)
     @accepts(Self, Model)
     @returns(Number)
     @requires("model.dt == self.dt and model.T_dur == self.T_dur")
     def loss(self, model):
         assert model.dt == self.dt and model.T_dur == self.T_dur
+        loglikelihood = self._loglikelihood_c(model)
+        # Infinite likelihoods are found again below to give a warning.
+        if loglikelihood is not None and np.isfinite(loglikelihood):
+            return -loglikelihood
         sols = self.cache_by_conditions(model)
         loglikelihood = 0
         for k in sols.keys():
@@ -176,8 +188,9 @@ class LossLikelihood(LossFunction):
             # make sure it doesn't go unnoticed.
             with np.errstate(all='raise', under='ignore'):
                 try:
-                    loglikelihood += np.sum(np.log(sols[k].pdf("_top")[self.hist_indexes[k][0]] + self._robustness_param))
-                    loglikelihood += np.sum(np.log(sols[k].pdf("_bottom")[self.hist_indexes[k][1]] + self._robustness_param))
+                    (inds_upper, counts_upper), (inds_lower, counts_lower), _ = self.hist_counts[k]
+                    loglikelihood += np.dot(counts_upper, np.log(sols[k].pdf("_top")[inds_upper] + self._robustness_param))
+                    loglikelihood += np.dot(counts_lower, np.log(sols[k].pdf("_bottom")[inds_lower] + self._robustness_param))
                 except FloatingPointError:
                     minlike = min(np.min(sols[k].pdf("_top")), np.min(sols[k].pdf("_bottom")))
                     if minlike == 0:
@@ -188,8 +201,108 @@ class LossLikelihood(LossFunction):
                     return np.inf
             # This is not a valid way to incorporate undecided trials into a likelihood
             #if sols[k].prob_undecided() > 0:
-            #    loglikelihood += np.log(sols[k].prob_undecided())*self.hist_indexes[k][2]
+            #    loglikelihood += np.log(sols[k].prob_undecided())*self.hist_counts[k][2]
         return -loglikelihood
+    def _loglikelihood_c(self, model):
+        """The log likelihood of `model`, computed entirely in C.
+
+        If `model` would be solved with the implicit or Crank-Nicolson
+        C solver, and its overlay only consists of OverlayNonDecision
+        and/or OverlayUniformMixture (in that order), the C extension
+        solves each condition with the same solver, applies the
+        overlay, and sums the log likelihood of the histograms in
+        hist_counts, without creating a Solution for each condition.
+        Otherwise, or if the Solutions should be cached
+        (set_solution_cache() or set_solution_store()) or found in
+        parallel (set_N_cpus()), this returns None.
+        """
+        from .. import functions # Importing here avoids a recursion issue
+        if not HAS_CSOLVE or functions._parallel_pool is not None or \
+           get_solution_cache() is not None or get_solution_store() is not None:
+            return None
+        # Subclasses may override the solvers
+        solvers = ["solve", "_solve", "solve_numerical", "solve_numerical_implicit", "solve_numerical_cn", "solve_numerical_c", "_c_solver_arrays"]
+        if any(getattr(type(model), s) is not getattr(Model, s) for s in solvers):
+            return None
+        # Use the same solver as Model.solve() or solve_all_conditions()
+        if self.method is None:
+            if model.has_analytical_solution():
+                return None
+            use_cn = model.can_solve_cn()
+        elif self.method == "implicit":
+            use_cn = False
+        elif self.method == "cn" and model.can_solve_cn():
+            use_cn = True
+        else:
+            return None
+        conds = [dict(k) for k in self.hist_counts.keys()]
+        if len(conds) == 0:
+            return None
+        overlays = [_c_overlay_parameters(model.get_dependence("overlay"), c, model.dt) for c in conds]
+        if None in overlays:
+            return None
+        args = model._c_solver_batch_arrays(conds)
+        n_t = len(model.t_domain())
+        lengths = []
+        for i,c in enumerate(conds):
+            horizon = self.horizons.get(frozenset(c.items())) if self.horizons is not None else None
+            length = functions._horizon_steps(model, c, horizon) + 1
+            # Increasing bounds would give a different grid when truncated
+            if args[8] == 1:
+                bound = args[6][args[7][i]:args[7][i+1]]
+                if np.max(bound[:length]) < np.max(bound):
+                    length = n_t
+            lengths.append(length)
+        offsets = lambda counts : np.cumsum([0]+[len(c) for c in counts])
+        inds_upper = [self.hist_counts[frozenset(c.items())][0][0] for c in conds]
+        counts_upper = [self.hist_counts[frozenset(c.items())][0][1] for c in conds]
+        inds_lower = [self.hist_counts[frozenset(c.items())][1][0] for c in conds]
+        counts_lower = [self.hist_counts[frozenset(c.items())][1][1] for c in conds]
+        from .. import csolve
+        loglikelihood_batch = csolve.cn_loglikelihood_batch if use_cn else csolve.implicit_loglikelihood_batch
+        return loglikelihood_batch(*args, model.T_dur, model.dt, model.dx, n_t,
+                                   np.asarray(lengths), np.asarray([o[0] for o in overlays]),
+                                   np.asarray([o[1] for o in overlays], dtype=float),
+                                   np.concatenate(inds_upper), np.concatenate(counts_upper).astype(float), offsets(inds_upper),
+                                   np.concatenate(inds_lower), np.concatenate(counts_lower).astype(float), offsets(inds_lower),
+                                   self._robustness_param)
+
+def _c_overlay_parameters(overlay, conditions, dt):
+    """The overlay as arguments to the C likelihood, e.g. csolve.implicit_loglikelihood_batch.
+
+    Returns the number of timesteps by which `overlay` shifts the pdfs
+    under `conditions` and the coefficient of its uniform mixture, or
+    None if the overlay does anything else.
+    """
+    overlays = overlay.overlays if type(overlay).apply is OverlayChain.apply else [overlay]
+    shift, mixture = 0, 0
+    # The C extension shifts the pdfs before applying the mixture
+    stage = 0
+    for o in overlays:
+        if type(o).apply is OverlayNone.apply:
+            continue
+        elif type(o).apply is OverlayNonDecision.apply and stage == 0:
+            shift = int(o.get_nondecision_time(conditions=conditions)/dt) # truncate
+            stage = 1
+        elif type(o).apply is OverlayUniformMixture.apply and stage < 2:
+            mixture = o.umixturecoef
+            stage = 2
+        else:
+            return None
+    return shift, mixture
+
+def _nonzero_counts(rts, dt):
+    """Histogram of the reaction times `rts` at the timepoints of the pdfs.
+
+    Returns the indices of the timepoints (spaced by `dt`) which are
+    the closest to at least one reaction time, and the number of
+    reaction times closest to each of these timepoints.  Reaction times
+    are rounded to the nearest timepoint, not down, because rounding
+    down creates bias.
+    """
+    counts = np.bincount(np.rint(np.asarray(rts)/dt).astype(int))
+    inds = np.flatnonzero(counts)
+    return inds, counts[inds]
 
 
 @paranoidclass
@@ -232,3 +345,120 @@ class LossRobustBIC(LossBIC):
     LossBIC.
     """
     _robustness_param = 1e-20
+
+@paranoidclass
+class LossQuantileChiSquare(LossFunction):
+    """Chi-squared loss function on response time quantiles.
+
+    For each combination of conditions and each choice, the response
+    times in the data are divided into bins at their quantiles (by
+    default the 0.1, 0.3, 0.5, 0.7, and 0.9 quantiles, giving six bins).
+    Undecided trials form one more bin.  The loss is the chi-squared
+    statistic comparing the number of trials in each bin to the number
+    predicted by the model, summed over all bins.  If there are fewer
+    than `min_trials` trials for a choice, its response times are not
+    divided, so only the number of trials is compared.
+
+    The quantiles are found once when the loss function is created, so
+    computing the loss does not slow down with the number of trials.
+    This is faster and more robust to outliers than the likelihood, but
+    uses less of the information in the data.  To use different
+    quantiles, create a subclass which redefines `quantiles`.
+    """
+    name = "Quantile chi-squared"
+    quantiles = (.1, .3, .5, .7, .9)
+    min_trials = 10
+    @staticmethod
+    def _test(v):
+        assert v.dt in Positive0()
+        assert v.T_dur in Positive0()
+    @staticmethod
+    def _generate():
+        yield LossQuantileChiSquare(sample=next(Sample._generate()), dt=.01, T_dur=3)
+    def setup(self, dt, T_dur, **kwargs):
+        self.dt = dt
+        self.T_dur = T_dur
+        # Each element in the dict is indexed by the conditions of the
+        # model as a frozenset.  Each contains the quantiles of the
+        # response times for each choice, and the number of trials in
+        # each bin: first the bins for the upper boundary, then for the
+        # lower boundary, and then the undecided trials.
+        self.bins = {}
+        for comb in self.sample.condition_combinations(required_conditions=self.required_conditions):
+            s = self.sample.subset(**comb)
+            maxt = max(max(s.choice_upper) if s.choice_upper.size != 0 else -1, max(s.choice_lower) if s.choice_lower.size != 0 else -1)
+            assert maxt <= self.T_dur, "Simulation time T_dur=%f not long enough for these data. (max sample RT=%f)" % (self.T_dur, maxt)
+            quantiles_upper = self._data_quantiles(s.choice_upper)
+            quantiles_lower = self._data_quantiles(s.choice_lower)
+            counts = np.concatenate([np.histogram(s.choice_upper, np.concatenate([[-np.inf], quantiles_upper, [np.inf]]))[0],
+                                     np.histogram(s.choice_lower, np.concatenate([[-np.inf], quantiles_lower, [np.inf]]))[0],
+                                     [s.undecided]])
+            self.bins[frozenset(comb.items())] = (quantiles_upper, quantiles_lower, counts)
+    def _data_quantiles(self, rts):
+        if len(rts) < self.min_trials:
+            return np.asarray([])
+        return np.percentile(rts, 100*np.asarray(self.quantiles)) # np.quantile needs numpy 1.15
+    def bin_probabilities(self, model):
+        """The probability of each bin under `model`, and the number of trials in each bin.
+
+        Returns a dictionary indexed by a frozenset of the conditions,
+        where each element is a tuple of the predicted probabilities and
+        the observed counts, in the order described in setup().
+        """
+        sols = self.cache_by_conditions(model)
+        probs = {}
+        for k,(quantiles_upper, quantiles_lower, counts) in self.bins.items():
+            sol = sols[k]
+            # The cdf at the end of each timestep, since each point of
+            # the pdf is the probability of responding between t and
+            # t+dt.  See Solution.quantile().
+            times = np.concatenate([[0], sol.t_domain + sol.dt])
+            bin_probs = []
+            for choice,quantiles in [("_top", quantiles_upper), ("_bottom", quantiles_lower)]:
+                cdf = np.concatenate([[0], sol._cdf(choice)])
+                bin_probs.append(np.diff(np.concatenate([[0], np.interp(quantiles, times, cdf), [cdf[-1]]])))
+            bin_probs.append([sol.prob_undecided()])
+            probs[k] = (np.maximum(np.concatenate(bin_probs), 0), counts)
+        return probs
+    @accepts(Self, Model)
+    @returns(Number)
+    @requires("model.dt == self.dt and model.T_dur == self.T_dur")
+    def loss(self, model):
+        assert model.dt == self.dt and model.T_dur == self.T_dur
+        chisq = 0
+        for probs,counts in self.bin_probabilities(model).values():
+            expected = probs*np.sum(counts)
+            if np.any((expected == 0) & (counts > 0)):
+                _logger.warning("Infinite loss encountered.  The model predicts no trials in a bin which contains data.  Try using a mixture model (via an Overlay).")
+                return np.inf
+            nonzero = expected > 0
+            chisq += np.sum((counts[nonzero] - expected[nonzero])**2/expected[nonzero])
+        return chisq
+
+@paranoidclass
+class LossQuantileG2(LossQuantileChiSquare):
+    """G-squared (likelihood ratio) loss function on response time quantiles.
+
+    This is the same as LossQuantileChiSquare, except that the G-squared
+    statistic is used to compare the number of trials in each bin to the
+    number predicted by the model.  It is equivalent to the likelihood of
+    the binned data, up to a constant.
+    """
+    name = "Quantile G-squared"
+    @staticmethod
+    def _generate():
+        yield LossQuantileG2(sample=next(Sample._generate()), dt=.01, T_dur=3)
+    @accepts(Self, Model)
+    @returns(Number)
+    @requires("model.dt == self.dt and model.T_dur == self.T_dur")
+    def loss(self, model):
+        assert model.dt == self.dt and model.T_dur == self.T_dur
+        g2 = 0
+        for probs,counts in self.bin_probabilities(model).values():
+            expected = probs*np.sum(counts)
+            nonzero = counts > 0
+            if np.any(expected[nonzero] == 0):
+                _logger.warning("Infinite loss encountered.  The model predicts no trials in a bin which contains data.  Try using a mixture model (via an Overlay).")
+                return np.inf
+            g2 += 2*np.sum(counts[nonzero]*np.log(counts[nonzero]/expected[nonzero]))
+        return g2
@@ -27,9 +27,10 @@ class Noise(Dependence):
         return self._uses(self.get_noise, "t")
     def _uses_x(self):
         return self._uses(self.get_noise, "x")
-    @accepts(Self, x=NDArray(d=1, t=Number), t=Positive0, dx=Positive, dt=Positive, conditions=Conditions, implicit=Boolean)
+    @accepts(Self, x=NDArray(d=1, t=Number), t=Positive0, dx=Or(Positive, NDArray(d=1, t=Positive)), dt=Positive, conditions=Conditions, implicit=Boolean)
     @returns(TriDiagMatrix)
     @ensures("return.shape == (len(x), len(x))")
+    @requires("np.isscalar(dx) or len(dx) == len(x) - 1")
     def get_matrix(self, x, t, dx, dt, conditions, implicit=False, **kwargs):
         """The diffusion component of the implicit method diffusion matrix across the domain `x` at time `t`.
 
@@ -38,20 +39,44 @@ class Noise(Dependence):
         `dt` and `dx` should be the simulations timestep and grid step
         `conditions` should be the conditions at which to calculate noise
 
+        For a non-uniform grid, `dx` may instead be a length N-1
+        ndarray of the spacing between adjacent positions in `x`.
+
         Returns a sparse NxN matrix as a PyDDM TriDiagMatrix object.
 
         There is generally no need to redefine this method in
         subclasses.
         """
-        noise = self.get_noise(x=x, t=t, dx=dx, dt=dt, conditions=conditions, **kwargs)
-        if np.isscalar(noise):
-            D = 1.0*noise**2 * dt/dx**2 * np.ones(len(x))
-            UP = -0.5*noise**2 * dt/dx**2 * np.ones(len(x)-1)
-            DOWN = -0.5*noise**2 * dt/dx**2 * np.ones(len(x)-1)
+        if not np.isscalar(dx):
+            # Each grid point holds the probability within the cell
+            # extending halfway to its neighbors.  The flux between
+            # adjacent cells is proportional to the difference in
+            # probability density, using the noise at the cell edge.
+            # This reduces to the uniform case below when dx and noise
+            # are constant.
+            noise = self.get_noise(x=x, t=t, dx=np.min(dx), dt=dt, conditions=conditions, **kwargs) * np.ones(len(x))
+            width = np.concatenate([[dx[0]], (dx[1:]+dx[:-1])/2, [dx[-1]]])
+            edge_noise2 = (0.5*(noise[1:]+noise[:-1]))**2
+            out_right = 0.5*dt * edge_noise2/(dx*width[:-1]) # Flux from each cell to the cell on its right
+            out_left = 0.5*dt * edge_noise2/(dx*width[1:]) # Flux from each cell to the cell on its left
+            D = np.zeros(len(x))
+            D[:-1] += out_right
+            D[1:] += out_left
+            # Flux out of the domain
+            D[0] += 0.5*dt * noise[0]**2/(dx[0]*width[0])
+            D[-1] += 0.5*dt * noise[-1]**2/(dx[-1]*width[-1])
+            UP = -out_left
+            DOWN = -out_right
         else:
-            D = 1.0*noise**2 * dt/dx**2
-            UP = -0.5*(0.5*(noise[1:]+noise[:-1]))**2 * dt/dx**2
-            DOWN = -0.5*(0.5*(noise[1:]+noise[:-1]))**2 * dt/dx**2
+            noise = self.get_noise(x=x, t=t, dx=dx, dt=dt, conditions=conditions, **kwargs)
+            if np.isscalar(noise):
+                D = 1.0*noise**2 * dt/dx**2 * np.ones(len(x))
+                UP = -0.5*noise**2 * dt/dx**2 * np.ones(len(x)-1)
+                DOWN = -0.5*noise**2 * dt/dx**2 * np.ones(len(x)-1)
+            else:
+                D = 1.0*noise**2 * dt/dx**2
+                UP = -0.5*(0.5*(noise[1:]+noise[:-1]))**2 * dt/dx**2
+                DOWN = -0.5*(0.5*(noise[1:]+noise[:-1]))**2 * dt/dx**2
         if implicit:
             D[0] += DOWN[0]
             D[-1] += UP[-1]
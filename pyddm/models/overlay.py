@@ -10,7 +10,7 @@ import numpy as np
 from scipy.special import gamma as sp_gamma
 import scipy.stats
 
-from paranoid import accepts, returns, requires, ensures, Self, paranoidclass, paranoidconfig, Range, Positive, Number, List, Positive0, NDArray, Unchecked
+from paranoid import accepts, returns, requires, ensures, Self, paranoidclass, paranoidconfig, Range, Positive, Number, List, Positive0, NDArray, Unchecked, Integer, Tuple
 from .paranoid_types import Conditions
 
 from .base import Dependence
@@ -67,6 +67,70 @@ class Overlay(Dependence):
         task conditions.  It returns the modified trajectory.
         """
         raise NotImplementedError("Overlay model %s not compatible with trajectory simulations" % self.__class__.__name__)
+    def apply_crossings(self, steps, choices, model, conditions, rng):
+        """Apply the overlay to many simulated trials at once.
+
+        This function is optional and may be redefined in subclasses.
+        It is expected to implement the same mechanism as
+        "apply_trajectory", but on the outcomes of many trials (i.e. from
+        Model.simulated_solution) instead of on a single trajectory.
+
+        `steps` is an ndarray of the index in the t domain at which each
+        trial crossed the bound, and `choices` is an ndarray which is 1
+        for trials which crossed the upper bound, -1 for the lower bound,
+        and 0 for undecided trials.  `rng` is a numpy RandomState which
+        should be used for any randomness.  It returns a tuple of the
+        modified `steps` and `choices`.
+
+        If this is not defined, or if a subclass redefines
+        "apply_trajectory" but not this function, Model.simulated_solution
+        simulates one trial at a time using "apply_trajectory" instead.
+        """
+        raise NotImplementedError("Overlay model %s not compatible with batch trajectory simulations" % self.__class__.__name__)
+    def min_delay(self, conditions):
+        """The shortest time by which the overlay delays responses.
+
+        This function is optional and may be redefined in subclasses.
+        Overlays which only delay responses, such as non-decision times,
+        may return the shortest delay under `conditions`, which is
+        negative if responses can be made earlier.  The response time
+        distribution up to any time t must then only depend on the
+        distribution before the overlay up to time t - min_delay.  This
+        allows the model to be solved only as long as necessary, e.g. in
+        LossLikelihood.  Other overlays, such as mixture models, return
+        None.  This is ignored for subclasses which redefine "apply" but
+        not this function.
+        """
+        return None
+
+def _defined_together(overlay, method, other):
+    """Whether the methods named `method` and `other` of `overlay` are
+    defined by the same class, for `overlay` and, if it is an
+    OverlayChain, each of its overlays.
+
+    Some methods implement the same mechanism as another, e.g.
+    apply_crossings and apply_trajectory, so they cannot be used by a
+    subclass which only redefines the other one.
+    """
+    owner = lambda name : next(c for c in type(overlay).__mro__ if name in c.__dict__)
+    if owner(method) is not owner(other):
+        return False
+    if isinstance(overlay, OverlayChain):
+        return all(_defined_together(o, method, other) for o in overlay.overlays)
+    return True
+
+def _shift_crossings(steps, choices, shift, n_t):
+    """Delay the crossing time of decided trials by `shift` timesteps.
+
+    `shift` is either an integer or an ndarray with one integer per
+    trial.  Trials delayed beyond the end of the simulation become
+    undecided, matching Overlay.apply_trajectory.
+    """
+    decided = choices != 0
+    steps = np.where(decided, np.maximum(steps + shift, 0), steps)
+    choices = np.where(steps > n_t - 1, 0, choices)
+    steps = np.minimum(steps, n_t - 1)
+    return steps, choices
 
 @paranoidclass
 class OverlayNone(Overlay):
@@ -92,6 +156,12 @@ class OverlayNone(Overlay):
     @returns(NDArray(d=1, t=Number))
     def apply_trajectory(self, trajectory, **kwargs):
         return trajectory
+    @accepts(Self, NDArray(d=1, t=Integer), NDArray(d=1, t=Integer))
+    @returns(Tuple(NDArray(d=1, t=Integer), NDArray(d=1, t=Integer)))
+    def apply_crossings(self, steps, choices, **kwargs):
+        return steps, choices
+    def min_delay(self, conditions):
+        return 0
 
 # NOTE: This class is likely to break if any changes are made to the
 # Dependence constructor.  In theory, no changes should be made to the
@@ -172,6 +242,16 @@ class OverlayChain(Overlay):
         for o in self.overlays:
             trajectory = o.apply_trajectory(trajectory=trajectory, **kwargs)
         return trajectory
+    @accepts(Self, NDArray(d=1, t=Integer), NDArray(d=1, t=Integer))
+    @returns(Tuple(NDArray(d=1, t=Integer), NDArray(d=1, t=Integer)))
+    @paranoidconfig(unit_test=False)
+    def apply_crossings(self, steps, choices, **kwargs):
+        for o in self.overlays:
+            steps, choices = o.apply_crossings(steps=steps, choices=choices, **kwargs)
+        return steps, choices
+    def min_delay(self, conditions):
+        delays = [o.min_delay(conditions) for o in self.overlays]
+        return None if None in delays else sum(delays)
 
 @paranoidclass
 class OverlayUniformMixture(Overlay):
@@ -215,7 +295,7 @@ class OverlayUniformMixture(Overlay):
         norm = np.sum(choice_upper)+np.sum(choice_lower)
         choice_upper = choice_upper*(1-self.umixturecoef) + .5*self.umixturecoef/len(m.t_domain())*norm
         choice_lower = choice_lower*(1-self.umixturecoef) + .5*self.umixturecoef/len(m.t_domain())*norm
-        return Solution(choice_upper, choice_lower, m, cond, undec, evolution)
+        return solution._derive(choice_upper, choice_lower, undec, evolution)
 
 @paranoidclass
 class OverlayExponentialMixture(Overlay):
@@ -271,7 +351,7 @@ class OverlayExponentialMixture(Overlay):
         choice_lower = choice_lower*(1-self.pmixturecoef) + .5*self.pmixturecoef*Y*norm
         #print(choice_upper)
         #print(choice_lower)
-        return Solution(choice_upper, choice_lower, m, cond, undec, evolution)
+        return solution._derive(choice_upper, choice_lower, undec, evolution)
 
 # Backward compatibility
 class OverlayPoissonMixture(OverlayExponentialMixture):
@@ -305,6 +385,8 @@ class OverlayNonDecision(Overlay):
         yield OverlayNonDecision(nondectime=-.5)
     def get_nondecision_time(self, conditions):
         return self.nondectime
+    def min_delay(self, conditions):
+        return self.get_nondecision_time(conditions)
     @accepts(Self, Solution)
     @returns(Solution)
     @ensures("set(return.choice_upper.tolist()) - set(solution.choice_upper.tolist()).union({0.0}) == set()")
@@ -329,7 +411,7 @@ class OverlayNonDecision(Overlay):
         else:
             newchoice_upper = choice_upper
             newchoice_lower = choice_lower
-        return Solution(newchoice_upper, newchoice_lower, m, cond, undec, evolution)
+        return solution._derive(newchoice_upper, newchoice_lower, undec, evolution)
     @accepts(Self, NDArray(d=1, t=Number), Conditions, Unchecked)
     @returns(NDArray(d=1, t=Number))
     def apply_trajectory(self, trajectory, model, conditions, **kwargs):
@@ -342,6 +424,11 @@ class OverlayNonDecision(Overlay):
             else:
                 trajectory = np.asarray([trajectory[-1]])
         return trajectory
+    @accepts(Self, NDArray(d=1, t=Integer), NDArray(d=1, t=Integer), Unchecked, Conditions)
+    @returns(Tuple(NDArray(d=1, t=Integer), NDArray(d=1, t=Integer)))
+    def apply_crossings(self, steps, choices, model, conditions, **kwargs):
+        shift = int(self.get_nondecision_time(conditions=conditions)/model.dt)
+        return _shift_crossings(steps, choices, shift, len(model.t_domain()))
 
 @paranoidclass
 class OverlayNonDecisionUniform(Overlay):
@@ -371,6 +458,8 @@ class OverlayNonDecisionUniform(Overlay):
         yield OverlayNonDecisionUniform(nondectime=0, halfwidth=.1)
     def get_nondecision_time(self, conditions):
         return self.nondectime
+    def min_delay(self, conditions):
+        return self.get_nondecision_time(conditions) - self.halfwidth
     @accepts(Self, Solution)
     @returns(Solution)
     @ensures("np.sum(return.choice_upper) <= np.sum(solution.choice_upper) + 1e-10")
@@ -406,14 +495,20 @@ class OverlayNonDecisionUniform(Overlay):
             else:
                 newchoice_upper += choice_upper/len(offsets)
                 newchoice_lower += choice_lower/len(offsets)
-        return Solution(newchoice_upper, newchoice_lower, m, cond, undec, evolution)
+        return solution._derive(newchoice_upper, newchoice_lower, undec, evolution)
+    @accepts(Self, NDArray(d=1, t=Integer), NDArray(d=1, t=Integer), Unchecked, Conditions, Unchecked)
+    @returns(Tuple(NDArray(d=1, t=Integer), NDArray(d=1, t=Integer)))
+    def apply_crossings(self, steps, choices, model, conditions, rng):
+        ndtime = rng.rand(len(steps))*2*self.halfwidth + (self.get_nondecision_time(conditions=conditions)-self.halfwidth)
+        shift = (ndtime/model.dt).astype(int)
+        return _shift_crossings(steps, choices, shift, len(model.t_domain()))
     @accepts(Self, NDArray(d=1, t=Number), Conditions, Unchecked)
     @returns(NDArray(d=1, t=Number))
     def apply_trajectory(self, trajectory, model, conditions, **kwargs):
         ndtime = np.random.rand()*2*self.halfwidth + (self.get_nondecision_time(conditions=conditions)-self.halfwidth)
         shift = int(ndtime/model.dt)
         if shift > 0:
-            np.append([trajectory[0]]*shift, trajectory)
+            trajectory = np.append([trajectory[0]]*shift, trajectory)
         elif shift < 0:
             if len(trajectory) > abs(shift):
                 trajectory = trajectory[abs(shift):]
@@ -476,15 +571,20 @@ class OverlayNonDecisionGamma(Overlay):
         # Divide by 1+1e-14 to avoid numerical errors after the convolution, which are on the order of 10^-16
         newchoice_upper = np.convolve(choice_upper, weights, mode="full")[len(choice_upper):(2*len(choice_upper))]/(1+1e-14)
         newchoice_lower = np.convolve(choice_lower, weights, mode="full")[len(choice_upper):(2*len(choice_upper))]/(1+1e-14)
-        return Solution(newchoice_upper, newchoice_lower, solution.model,
-                        solution.conditions, solution.undec, solution.evolution)
+        return solution._derive(newchoice_upper, newchoice_lower, solution.undec, solution.evolution)
+    @accepts(Self, NDArray(d=1, t=Integer), NDArray(d=1, t=Integer), Unchecked, Conditions, Unchecked)
+    @returns(Tuple(NDArray(d=1, t=Integer), NDArray(d=1, t=Integer)))
+    def apply_crossings(self, steps, choices, model, conditions, rng):
+        ndtime = scipy.stats.gamma(a=self.shape, scale=self.scale, loc=self.get_nondecision_time(conditions=conditions)).rvs(size=len(steps), random_state=rng)
+        shift = (ndtime/model.dt).astype(int)
+        return _shift_crossings(steps, choices, shift, len(model.t_domain()))
     @accepts(Self, NDArray(d=1, t=Number), Conditions, Unchecked)
     @returns(NDArray(d=1, t=Number))
     def apply_trajectory(self, trajectory, model, conditions, **kwargs):
         ndtime = scipy.stats.gamma(a=self.shape, scale=self.scale, loc=self.get_nondecision_time(conditions=conditions)).rvs()
         shift = int(ndtime/model.dt)
         if shift > 0:
-            np.append([trajectory[0]]*shift, trajectory)
+            trajectory = np.append([trajectory[0]]*shift, trajectory)
         elif shift < 0:
             if len(trajectory) > abs(shift):
                 trajectory = trajectory[abs(shift):]
@@ -528,7 +628,7 @@ class OverlaySimplePause(Overlay):
         newchoice_lower[0:start] = choice_lower[0:start]
         newchoice_upper[stop:] = choice_upper[start:-(stop-start)]
         newchoice_lower[stop:] = choice_lower[start:-(stop-start)]
-        return Solution(newchoice_upper, newchoice_lower, m, cond, undec, evolution)
+        return solution._derive(newchoice_upper, newchoice_lower, undec, evolution)
 
 @paranoidclass
 class OverlayBlurredPause(Overlay):
@@ -580,5 +680,5 @@ class OverlayBlurredPause(Overlay):
                 newchoice_lower[i:] += choice_lower[gamma_start:len(choice_upper)-(i-gamma_start)]*gamma_vals[int(i-gamma_start)]/sumgamma
             else:
                 raise ValueError("Invalid domain")
-        return Solution(newchoice_upper, newchoice_lower, m, cond, undec, evolution)
+        return solution._derive(newchoice_upper, newchoice_lower, undec, evolution)
 
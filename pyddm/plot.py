@@ -115,16 +115,17 @@ def plot_decision_variable_distribution(model, conditions={}, resolution=.1, fig
     distribution because the distribution of histogram values is
     highly skewed.
 
-    Finally, note that this routine always uses the implicit method
+    Finally, note that this routine always uses the TR-BDF2 method
     because it gives the most reliable histograms for the decision
-    variable.  (Crank-Nicoloson tends to oscillate.)
+    variable.  (Crank-Nicoloson tends to oscillate, and backward Euler
+    is less accurate.)
     """
 
 
     # Generate the distributions.  Note that this is extremely
     # inefficient (it is O(n) with resolution and should be O(1) with
     # resolution) so this should be improved someday...
-    s = model.solve_numerical_implicit(conditions=conditions, return_evolution=True)
+    s = model.solve_numerical_trbdf2(conditions=conditions, return_evolution=True)
     hists = s.pdf_evolution()
     top = s.pdf("_top")
     bot = s.pdf("_bottom")
@@ -169,7 +170,8 @@ def plot_fit_diagnostics(model=None, sample=None, fig=None, conditions=None, dat
       to 0.01.
     - `method` - Optionally the method to use to solve the model,
       either "analytical", "numerical" "cn", "implicit", "explicit",
-      or None (auto-select, the default).
+      "spectral", "adaptive", "trbdf2", "graded", "lookup",
+      "surrogate", or None (auto-select, the default).
     """
     # Avoid stupid warnings with mutable objects
     if conditions is None:
@@ -96,10 +96,48 @@ class Solution(object):
         from .models.overlay import OverlayNone
         self.is_overlay_none = isinstance(model.get_dependence("overlay"), OverlayNone)
         # Correct floating point errors to always get prob <= 1
+        # Not in place, since the pdfs may be shared with a cached Solution.
         if np.sum(self.choice_upper + self.choice_lower) > 1:
-            self.choice_upper /= 1.00000000001
-            self.choice_lower /= 1.00000000001
+            self.choice_upper = self.choice_upper/1.00000000001
+            self.choice_lower = self.choice_lower/1.00000000001
         self.conditions = conditions
+        self._stats = {}
+
+    def _derive(self, pdf_choice_upper, pdf_choice_lower, pdf_undec=None, pdf_evolution=None):
+        """A Solution of the same model and conditions with different pdfs.
+
+        This is a faster alternative to the constructor for overlays.
+        The new Solution shares the properties of the model, including
+        the snapshot of its parameters, with this one.
+        """
+        sol = copy.copy(self)
+        sol.choice_upper = pdf_choice_upper
+        sol.choice_lower = pdf_choice_lower
+        sol.undec = pdf_undec
+        sol.evolution = pdf_evolution
+        if np.sum(sol.choice_upper + sol.choice_lower) > 1:
+            sol.choice_upper = sol.choice_upper/1.00000000001
+            sol.choice_lower = sol.choice_lower/1.00000000001
+        sol._stats = {}
+        return sol
+
+    def _stat(self, key, f):
+        """The derived statistic `key`, computed by calling `f` the first time.
+
+        Statistics such as the cdf and the probability of each choice
+        are cached, since they are often needed many times, e.g. when
+        computing loss functions or plotting.  This assumes the pdfs are
+        not modified after the Solution is created.  Arrays are stored
+        read-only so that the cached values cannot be changed, and
+        public methods should return copies of them.
+        """
+        stats = self.__dict__.setdefault("_stats", {}) # Solutions saved by older versions have no cache
+        if key not in stats:
+            v = f()
+            if isinstance(v, np.ndarray):
+                v.flags.writeable = False
+            stats[key] = v
+        return stats[key]
 
     def __eq__(self, other):
         if not np.allclose(self.choice_upper, other.choice_upper) or \
@@ -282,8 +320,12 @@ class Solution(object):
         the undecided distribution will collectively converge to one.
 
         """
-        v = self.choice_upper if self._choice_name_to_id(choice) == 1 else self.choice_lower
-        return np.cumsum(v)
+        return self._cdf(choice).copy()
+
+    def _cdf(self, choice):
+        """The cached (read-only) cdf for `choice`, see Solution.cdf()."""
+        i = self._choice_name_to_id(choice)
+        return self._stat(("cdf", i), lambda : np.cumsum(self.choice_upper if i == 1 else self.choice_lower))
 
     @accepts(Self)
     @returns(NDArray(d=1, t=Positive0))
@@ -295,7 +337,7 @@ class Solution(object):
         if self.choice_names != ("correct", "error"):
             raise NotImplementedError("Choice names need to be set to \"correct\" and \"error\" to use this function.  Use \"cdf\" instead.")
         deprecation_warning(instead="Solution.cdf('correct')")
-        return np.cumsum(self.choice_upper)
+        return self.cdf("_top")
 
     @accepts(Self)
     @returns(NDArray(d=1, t=Positive0))
@@ -307,7 +349,7 @@ class Solution(object):
         if self.choice_names != ("correct", "error"):
             raise NotImplementedError("Choice names need to be set to \"correct\" and \"error\" to use this function.  Use \"cdf\" instead.")
         deprecation_warning(instead="Solution.cdf('error')")
-        return np.cumsum(self.choice_lower)
+        return self.cdf("_bottom")
 
     @accepts(Self, Choice)
     @returns(Range(0, 1))
@@ -318,8 +360,8 @@ class Solution(object):
         probability, corresponding to the upper or lower boundary crossings.
         E.g., "correct", "error", or the choice names specified in the model's
         """
-        v = self.choice_upper if self._choice_name_to_id(choice) == 1 else self.choice_lower
-        return np.sum(v)
+        i = self._choice_name_to_id(choice)
+        return self._stat(("prob", i), lambda : np.sum(self.choice_upper if i == 1 else self.choice_lower))
 
     @accepts(Self)
     @returns(Range(0, 1))
@@ -331,7 +373,7 @@ class Solution(object):
         if self.choice_names != ("correct", "error"):
             raise NotImplementedError("Choice names need to be set to \"correct\" and \"error\" to use this function.  Use \"prob\" instead.")
         deprecation_warning(instead="Solution.prob('correct')")
-        return np.sum(self.choice_upper)
+        return self.prob("_top")
 
     @accepts(Self)
     @returns(Range(0, 1))
@@ -343,13 +385,16 @@ class Solution(object):
         if self.choice_names != ("correct", "error"):
             raise NotImplementedError("Choice names need to be set to \"correct\" and \"error\" to use this function.  Use \"prob\" instead.")
         deprecation_warning(instead="Solution.prob('error')")
-        return np.sum(self.choice_lower)
+        return self.prob("_bottom")
 
     @accepts(Self)
     @returns(Range(0, 1))
     def prob_undecided(self):
         """The probability of not responding during the time limit."""
-        udprob = 1 - np.sum(self.choice_upper) - np.sum(self.choice_lower)
+        return self._stat("prob_undecided", self._prob_undecided)
+
+    def _prob_undecided(self):
+        udprob = 1 - self.prob("_top") - self.prob("_bottom")
         if udprob < 0:
             _logger.warning("Setting undecided probability from %f to 0" % udprob)
             _logger.debug(self.model_parameters)
@@ -465,7 +510,28 @@ class Solution(object):
         """The mean decision time in the correct trials (excluding undecided trials)."""
         if self.choice_names != ("correct", "error"):
             raise NotImplementedError("Choice names need to be set to \"correct\" and \"error\" to use this function.")
-        return np.sum(self.corr*self.t_domain) / self.prob_correct()
+        return self._stat("mean_decision_time", lambda : np.sum(self.choice_upper*self.t_domain) / self.prob("_top"))
+
+    @accepts(Self, Choice, Or(Range(0, 1), NDArray(d=1, t=Range(0, 1))))
+    @requires("self.prob(choice) > 0")
+    def quantile(self, choice, q):
+        """The response time below which a proportion `q` of responses for `choice` fall.
+
+        `choice` should be the name of the choice, e.g. "correct",
+        "error", or the choice names specified in the model's
+        choice_names parameter.  Only responses for this choice are
+        included, so, e.g., the 0.5 quantile is the median response time
+        of this choice.  `q` may be a number or an ndarray of numbers
+        between 0 and 1.  Each point of the pdf describes the
+        probability of responding between t and t+dt, and the quantiles
+        are linearly interpolated within this interval.
+        """
+        i = self._choice_name_to_id(choice)
+        def normalized_cdf():
+            cdf = self._cdf(choice)
+            return np.concatenate([[0], cdf/cdf[-1]])
+        cdf = self._stat(("normalized_cdf", i), normalized_cdf)
+        return np.interp(q, cdf, np.concatenate([[0], self.t_domain + self.dt]))
 
     @accepts(Self, Natural1, seed=Maybe(Natural0))
     @returns(Sample)
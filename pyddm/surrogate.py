@@ -0,0 +1,143 @@
+# Copyright 2018 Max Shinn <maxwell.shinn@yale.edu>
+#           2018 Norman Lam <norman.lam@yale.edu>
+#
+# This file is part of PyDDM, and is available under the MIT license.
+# Please see LICENSE.txt in the root directory for more information.
+
+__all__ = ["Surrogate", "set_surrogate", "get_surrogate"]
+
+import copy
+import numpy as np
+
+from paranoid.types import Natural0, Natural1, String, Maybe, Unchecked
+from paranoid.decorators import accepts
+from paranoid.settings import Settings as paranoid_settings
+
+from .model import Model
+from .sample import Sample
+from .solution import Solution
+from .functions import solve_all_conditions
+
+class Surrogate:
+    """A fast approximation of a model's response time distributions.
+
+    Models which must be solved numerically can be slow to fit, since
+    they are solved many times.  A Surrogate solves the model at
+    `n_samples` points spread evenly (by Latin hypercube sampling) over
+    the range of each of its Fittable parameters, which must have finite
+    `minval` and `maxval`.  It then interpolates between these points
+    with radial basis functions, so the response time distributions for
+    any other parameters can be found without solving the model.
+
+    The model is solved for each combination of conditions in `sample`,
+    or in `conditions` (a list of dicts, as in solve_all_conditions()).
+    `method` is the solver method used to build the surrogate, and
+    `kernel` is the radial basis function (see
+    scipy.interpolate.RBFInterpolator).  `seed` is the random seed for
+    choosing the points.  The solutions at each point are found with
+    solve_all_conditions(), so they are computed in parallel if
+    set_N_cpus() has been called.
+
+    To use the surrogate, pass it to set_surrogate() and use the
+    "surrogate" method, e.g. in fit_adjust_model() or in the loss
+    function.  The Solutions are only approximate, and become more
+    accurate with more points.  The fit can be finished with the exact
+    solver by passing `refine=True` to fit_adjust_model().  The
+    surrogate includes the model's overlay, so it is not applied again.
+    """
+    @accepts(Unchecked, Model, Maybe(Sample), Unchecked, Natural1, Maybe(String), String, Natural0)
+    def __init__(self, model, sample=None, conditions=None, n_samples=200, method=None,
+                 kernel="thin_plate_spline", seed=0):
+        try:
+            from scipy.interpolate import RBFInterpolator
+        except ImportError:
+            raise ImportError("Surrogates require scipy 1.7 or later.  Please upgrade scipy.")
+        params = model.get_model_parameters()
+        assert len(params) > 0, "Models must contain at least one Fittable parameter to build a surrogate"
+        self.minvals = np.asarray([p.minval for p in params], dtype=float)
+        self.maxvals = np.asarray([p.maxval for p in params], dtype=float)
+        assert np.all(np.isfinite(self.minvals)) and np.all(np.isfinite(self.maxvals)), \
+            "All Fittable parameters must have a finite minval and maxval to build a surrogate"
+        if sample is not None:
+            conditions = sample.condition_combinations(required_conditions=model.required_conditions)
+        elif conditions is None:
+            conditions = [{}]
+        self.required_conditions = list(model.required_conditions)
+        self.conditions = [frozenset(c.items()) for c in conditions]
+        self._index = {c : i for i,c in enumerate(self.conditions)}
+        self.dt = model.dt
+        self.T_dur = model.T_dur
+        self.choice_names = model.choice_names
+        self.n_t = len(model.t_domain())
+        # Latin hypercube sample of the unit cube: one point in each of
+        # n_samples equal slices of each dimension.
+        rng = np.random.RandomState(seed)
+        self.points = (np.argsort(rng.rand(n_samples, len(params)), axis=0) + rng.rand(n_samples, len(params)))/n_samples
+        m = copy.deepcopy(model)
+        paranoid_state = paranoid_settings.get('enabled')
+        paranoid_settings.set(enabled=False)
+        try:
+            values = []
+            for point in self.points:
+                m.set_model_parameters(list(self._unscale(point)))
+                sols = solve_all_conditions(m, condition_combinations=[dict(c) for c in self.conditions], method=method)
+                values.append(np.concatenate([np.concatenate([sols[c].choice_upper, sols[c].choice_lower]) for c in self.conditions]))
+        finally:
+            paranoid_settings.set(enabled=paranoid_state)
+        self.interpolant = RBFInterpolator(self.points, np.asarray(values), kernel=kernel)
+        self._last = (None, None)
+    def __repr__(self):
+        return "Surrogate with %i points, %i parameters, and %i condition combinations" % \
+            (len(self.points), len(self.minvals), len(self.conditions))
+    def _scale(self, params):
+        return (np.asarray(params, dtype=float) - self.minvals)/(self.maxvals - self.minvals)
+    def _unscale(self, point):
+        return self.minvals + point*(self.maxvals - self.minvals)
+    def _evaluate(self, params):
+        """The interpolated pdfs for all conditions at parameters `params`."""
+        point = self._scale(params)
+        # Models are solved for each condition in turn with the same
+        # parameters, so remember the last evaluation.
+        last_point,last_values = self._last
+        if last_point is not None and np.array_equal(point, last_point):
+            return last_values
+        values = self.interpolant(point[None,:])[0]
+        self._last = (point, values)
+        return values
+    def solve(self, model, conditions={}):
+        """Approximate the Solution of `model` under `conditions`.
+
+        `model` must have the same structure as the model used to build
+        the surrogate, but may have different parameter values.
+        """
+        assert model.dt == self.dt and model.T_dur == self.T_dur and model.choice_names == self.choice_names, \
+            "Model must have the same dt, T_dur, and choice names as the surrogate"
+        params = model.get_model_parameters()
+        assert len(params) == len(self.minvals), "Model must have the same parameters as the surrogate"
+        key = frozenset((k,v) for k,v in conditions.items() if k in self.required_conditions)
+        if key not in self._index:
+            raise ValueError("The surrogate was not built with conditions %s" % repr(dict(key)))
+        i = self._index[key]
+        values = self._evaluate([float(p) for p in params])[2*self.n_t*i:2*self.n_t*(i+1)]
+        # Interpolation may give slightly negative densities or a total
+        # probability over 1.
+        pdfs = np.maximum(values, 0)
+        pdfsum = np.sum(pdfs)
+        if pdfsum > 1:
+            pdfs /= pdfsum
+        return Solution(pdfs[:self.n_t], pdfs[self.n_t:], model, conditions=conditions)
+
+_surrogate = None # Note: do not change this directly.  Call set_surrogate() instead.
+
+def set_surrogate(surrogate):
+    """Use `surrogate` for the "surrogate" solver method.
+
+    `surrogate` is a Surrogate, or None to remove it.
+    """
+    global _surrogate
+    assert surrogate is None or isinstance(surrogate, Surrogate), "Invalid surrogate"
+    _surrogate = surrogate
+
+def get_surrogate():
+    """Return the Surrogate used by the "surrogate" solver method, or None if there is none."""
+    return _surrogate
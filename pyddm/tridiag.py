@@ -80,6 +80,32 @@ class TriDiagMatrix:
     def eye(cls, size):
         """Return an identity matrix of size `size`."""
         return cls(diag=np.ones(size), up=np.zeros(size-1), down=np.zeros(size-1))
+    @classmethod
+    def zeros(cls, size):
+        """Return a matrix of zeros of size `size`."""
+        return cls(diag=np.zeros(size), up=np.zeros(size-1), down=np.zeros(size-1))
+    def set_sum(self, matrices, identity=0, scale=1):
+        """Set the matrix to identity*I + scale*(sum of `matrices`), in place.
+
+        `matrices` is a list of TriDiagMatrix objects with the same
+        shape as this matrix.  This overwrites the existing values
+        instead of allocating new arrays, so it can be used to assemble
+        a matrix into the same workspace many times.  Returns the
+        matrix.
+        """
+        self.diag.fill(identity)
+        self.up.fill(0)
+        self.down.fill(0)
+        for m in matrices:
+            if scale == 1:
+                self.diag += m.diag
+                self.up += m.up
+                self.down += m.down
+            else:
+                self.diag += m.diag*scale
+                self.up += m.up*scale
+                self.down += m.down*scale
+        return self
     #@pns.accepts(pt.Self, pt.Integer, pt.Integer) TODO determine domain
     #@pns.returns(pt.Self)
     def splice(self, lower, upper):
@@ -141,6 +167,29 @@ class TriDiagMatrix:
             return vec/self.diag
         (_, _, _, x, _) = lapack.dgtsv(self.down, self.diag, self.up, vec)
         return x
+    @pns.accepts(pt.Self)
+    def factorize(self):
+        """Precompute the LU factorization of the matrix.
+
+        For a matrix A, returns a function which takes a vector `vec` and
+        solves the equation "Ax = vec" for x, like spsolve.  This is faster
+        than spsolve when solving many equations with the same matrix.
+        Changes to the matrix after calling this function do not affect
+        the returned function.
+        """
+        if self.shape[0] == 1:
+            diag = self.diag.copy()
+            return lambda vec : vec/diag
+        if self.shape[0] == 2:
+            # LAPACK's tridiagonal solver in scipy does not accept 2x2
+            # matrices.
+            inverse = np.linalg.inv(self.to_scipy_sparse().toarray())
+            return lambda vec : inverse.dot(vec)
+        (dl, d, du, du2, ipiv, _) = lapack.dgttrf(self.down, self.diag, self.up)
+        def solve(vec):
+            (x, _) = lapack.dgttrs(dl, d, du, du2, ipiv, vec)
+            return x
+        return solve
     @pns.accepts(pt.Self, pt.Or(pt.Number, pt.Self))
     @pns.requires("not np.isscalar(other) --> self.shape == other.shape")
     @pns.returns(pt.Self)
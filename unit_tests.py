@@ -681,6 +681,28 @@ class TestSolution(TestCase):
             assert s.evaluate(100, "_bottom") == 0
         self.quick_cn_b.evaluate(100, "a") == 0
         self.quick_cn_b.evaluate(100, "a") == 0
+    def test_quantile(self):
+        """Quantiles and cached statistics match the distribution"""
+        for s in self.all_sols:
+            for choice in ["_top", "_bottom"]:
+                median = s.quantile(choice, .5)
+                i = int(median/s.dt)
+                assert s.cdf(choice)[i-1] <= s.prob(choice)/2 <= s.cdf(choice)[i] + 1e-10
+                assert np.all(np.diff(s.quantile(choice, np.linspace(0, 1, 11))) >= 0)
+                assert s.quantile(choice, 1) <= s.T_dur + s.dt
+                # Statistics are only computed once, and cannot be changed
+                assert s._cdf(choice) is s._cdf(choice)
+                self.assertRaises(ValueError, lambda : s._cdf(choice).__setitem__(0, 1))
+                # The public cdf is a copy which may be modified
+                cdf = s.cdf(choice)
+                cdf[:] = 0
+                assert s.cdf(choice)[-1] == s._cdf(choice)[-1] > 0
+        # Solutions derived by overlays have their own statistics
+        s = self.params_ana
+        s2 = ddm.OverlayNonDecision(nondectime=.1).apply(s)
+        assert s2.model is s.model and s2.model_parameters is s.model_parameters
+        assert np.isclose(s2.quantile("_top", .5), s.quantile("_top", .5) + .1, atol=.01)
+        assert np.isclose(s2.prob("_top"), np.sum(s2.choice_upper))
 
 class TestTriDiagMatrix(TestCase):
     def setUp(self):
@@ -748,6 +770,29 @@ class TestTriDiagMatrix(TestCase):
             m -= 1.4
             m -= mo
             assert not m != (mo - 1.4) - mo
+    def test_factorize(self):
+        """Solving with a precomputed factorization is the same as spsolve"""
+        for m in self.matrices + [ddm.tridiag.TriDiagMatrix(diag=np.asarray([1.5, 2]), up=np.asarray([.3]), down=np.asarray([-1]))]:
+            solve = m.factorize()
+            for v in [np.ones(m.shape[0]), np.arange(m.shape[0])*1.3 - .2]:
+                assert np.all(np.isclose(solve(v), m.spsolve(v)))
+            # Changing the matrix later doesn't change the factorization
+            v = np.ones(m.shape[0])
+            x = m.spsolve(v)
+            m2 = copy.deepcopy(m)
+            solve = m2.factorize()
+            m2 *= 2
+            assert np.all(np.isclose(solve(v), x))
+    def test_set_sum(self):
+        """Assembling a matrix in place is the same as adding matrices"""
+        for m in self.matrices:
+            work = ddm.tridiag.TriDiagMatrix.zeros(m.shape[0])
+            for m2 in self.matrices:
+                if m.shape == m2.shape:
+                    diag = work.diag
+                    assert work.set_sum([m, m2]) == m + m2
+                    assert work.set_sum([m, m2], identity=1, scale=-.5) == ddm.tridiag.TriDiagMatrix.eye(m.shape[0]) - m*.5 - m2*.5
+                    assert work.diag is diag
 
 class TestMisc(TestCase):
     def test_analytic_lin_collapse(self):
@@ -799,6 +844,530 @@ class TestMisc(TestCase):
         with self.assertRaises(AssertionError):
             ddm.functions.solve_all_conditions(m, condition_combinations=cond_combs + [{"c1": 1, "c2": 1.0, "dummy": -1}])
 
+    def test_resident_backend(self):
+        """Processes which keep a copy of the model give the same results"""
+        m = ddm.Model(drift=ddm.DriftLinear(drift=ddm.Fittable(minval=0, maxval=2), x=-.5, t=0),
+                      noise=ddm.NoiseConstant(noise=ddm.Fittable(minval=.5, maxval=2)), T_dur=2)
+        m.set_model_parameters([1, 1])
+        samp = m.solve().resample(200)
+        conds = [{}]
+        try:
+            ddm.set_N_cpus(2, backend="resident")
+            resident = ddm.functions.solve_all_conditions(m, condition_combinations=conds)
+            pool = ddm.functions._parallel_pool.pool
+            # Changing parameters does not restart the pool
+            m.set_model_parameters([.5, 1.2])
+            resident2 = ddm.functions.solve_all_conditions(m, condition_combinations=conds, method="implicit")
+            loss = ddm.get_model_loss(model=m, sample=samp)
+            assert pool is ddm.functions._parallel_pool.pool
+            # Changing anything else does
+            m2 = ddm.Model(drift=ddm.DriftLinear(drift=ddm.Fittable(minval=0, maxval=2), x=-.5, t=0),
+                           noise=ddm.NoiseConstant(noise=.8), T_dur=2)
+            m2.set_model_parameters([.5])
+            resident3 = ddm.functions.solve_all_conditions(m2, condition_combinations=conds)
+            assert pool is not ddm.functions._parallel_pool.pool
+        finally:
+            ddm.set_N_cpus(1)
+        m.set_model_parameters([1, 1])
+        assert np.all(resident[frozenset()].choice_upper == m.solve().choice_upper)
+        m.set_model_parameters([.5, 1.2])
+        assert np.all(resident2[frozenset()].choice_upper == m.solve_numerical_implicit().choice_upper)
+        # Computed from Solutions in parallel, but entirely in C here
+        assert np.isclose(loss, ddm.get_model_loss(model=m, sample=samp))
+        assert np.all(resident3[frozenset()].choice_upper == m2.solve().choice_upper)
+    def test_solution_cache(self):
+        """Cached solutions are reused only for the same parameters and conditions"""
+        class DriftCond(ddm.Drift):
+            name = "Drift depends on condition"
+            required_conditions = ["coh"]
+            required_parameters = ["scale"]
+            def get_drift(self, conditions, **kwargs):
+                return self.scale * conditions["coh"]
+        m = ddm.Model(drift=DriftCond(scale=ddm.Fittable(minval=0, maxval=2)), noise=ddm.NoiseLinear(noise=1, x=0, t=.1), T_dur=1)
+        m.set_model_parameters([1])
+        conds = [{"coh": c} for c in [0, .5, 1]]
+        try:
+            ddm.set_solution_cache()
+            cache = ddm.get_solution_cache()
+            sols1 = ddm.functions.solve_all_conditions(m, condition_combinations=conds)
+            assert (cache.hits, cache.misses, len(cache)) == (0, 3, 3)
+            sols2 = ddm.functions.solve_all_conditions(m, condition_combinations=conds+[{"coh": 2}])
+            assert (cache.hits, cache.misses, len(cache)) == (3, 4, 4)
+            assert all(np.all(sols1[k].choice_upper == sols2[k].choice_upper) for k in sols1.keys())
+            assert np.all(m.solve(conditions={"coh": 2}).choice_lower == sols2[frozenset({("coh", 2)})].choice_lower)
+            assert cache.hits == 4
+            # Modifying a returned Solution does not modify the cache
+            prob = m.solve(conditions={"coh": 2}).prob("correct")
+            sols2[frozenset({("coh", 2)})].choice_upper[:] = 0
+            m.solve(conditions={"coh": 2}).choice_upper[:] = 0
+            assert m.solve(conditions={"coh": 2}).prob("correct") == prob
+            # Different parameters or solvers are solved again
+            m.set_model_parameters([1.5])
+            sols3 = ddm.functions.solve_all_conditions(m, condition_combinations=conds)
+            assert not np.allclose(sols3[frozenset({("coh", 1)})].choice_upper, sols1[frozenset({("coh", 1)})].choice_upper)
+            ddm.functions.solve_all_conditions(m, condition_combinations=conds, method="implicit")
+            assert cache.hits == 7 and len(cache) == 10
+            m.get_dependence("noise").t = .2
+            m.solve(conditions={"coh": 2})
+            assert cache.hits == 7
+            # The least recently used solutions are removed
+            ddm.set_solution_cache(max_bytes=int(2.5*ddm.cache._solution_nbytes(sols1[frozenset({("coh", 0)})])))
+            cache = ddm.get_solution_cache()
+            ddm.functions.solve_all_conditions(m, condition_combinations=conds)
+            assert len(cache) == 2 and cache.nbytes <= cache.max_bytes
+            m.solve(conditions={"coh": 1})
+            assert cache.hits == 1
+        finally:
+            ddm.set_solution_cache(None)
+        assert ddm.get_solution_cache() is None
+    def test_memoized_domains(self):
+        """Grids and initial conditions are recomputed when the model changes"""
+        class ICCond(ddm.InitialCondition):
+            name = "Starting point depends on condition"
+            required_conditions = ["side"]
+            required_parameters = ["x0"]
+            def get_IC(self, x, dx, conditions):
+                pdf = np.zeros(len(x))
+                pdf[int(np.round((len(x)-1)/2 + self.x0*conditions["side"]/dx))] = 1
+                return pdf
+        m = ddm.Model(IC=ICCond(x0=.2), bound=ddm.BoundCollapsingLinear(B=1, t=.5), dx=.01, dt=.01, T_dur=1)
+        assert m._t_domain() is m._t_domain()
+        assert not m._t_domain().flags.writeable
+        # The public methods return copies which may be modified
+        t = m.t_domain()
+        t *= 2
+        ic = m.IC({"side": 1})
+        ic[:] = 0
+        assert m.t_domain()[-1] == 1 and np.sum(m.IC({"side": 1})) == 1
+        assert np.all(m.t_domain() == np.arange(0, 1.001, .01))
+        assert len(m.x_domain({"side": 1})) == 201
+        assert len(m.x_domain({"side": 1}, t=.5)) == 151
+        assert np.argmax(m.IC({"side": 1})) == 120
+        assert np.argmax(m.IC({"side": -1})) == 80
+        m.get_dependence("IC").x0 = .1
+        assert np.argmax(m.IC({"side": 1})) == 110
+        m.get_dependence("bound").B = 2
+        assert len(m.x_domain({"side": 1})) == 401
+        assert np.argmax(m.IC({"side": 1})) == 210
+        m.dt = .02
+        m.T_dur = 2
+        assert np.all(m.t_domain() == np.arange(0, 2.001, .02))
+        m.dx = .02
+        assert len(m.x_domain({"side": 1})) == 201
+        # Copies do not include the memoized values
+        assert "_memo" not in copy.deepcopy(m).__dict__
+        # When there are too many values, they are moved to a new
+        # dictionary, so the old one can still be used by other threads
+        memo = m._memo
+        for T_dur in np.arange(1, 1100)*.01:
+            m.T_dur = T_dur
+            m.t_domain()
+        assert m._memo is not memo and len(m._memo) < 1000
+        assert len(memo) > 1000
+    def test_solution_store(self):
+        """Solutions saved to disk are loaded for the same parameters and conditions"""
+        import tempfile
+        m = ddm.Model(drift=ddm.DriftLinear(drift=ddm.Fittable(minval=0, maxval=2), x=0, t=.2),
+                      bound=ddm.BoundCollapsingLinear(B=1, t=.5),
+                      overlay=ddm.OverlayNonDecision(nondectime=.1), T_dur=1)
+        m.set_model_parameters([1])
+        conds = [{}]
+        with tempfile.TemporaryDirectory() as path:
+            try:
+                ddm.set_solution_store(path)
+                store = ddm.get_solution_store()
+                sol = ddm.functions.solve_all_conditions(m, condition_combinations=conds)[frozenset()]
+                assert (store.hits, store.misses, len(store)) == (0, 1, 1)
+                # A new store in the same directory, e.g. in a new session
+                ddm.set_solution_store(path)
+                store = ddm.get_solution_store()
+                sol2 = m.solve()
+                assert (store.hits, store.misses) == (1, 0)
+                assert sol2.model is m and sol2.conditions == {}
+                assert np.all(sol.pdf("correct") == sol2.pdf("correct"))
+                assert np.all(sol.pdf_undec() == sol2.pdf_undec())
+                m.set_model_parameters([1.5])
+                m.solve()
+                assert (store.hits, store.misses, len(store)) == (1, 1, 2)
+                # The least recently used solutions are removed
+                m.set_model_parameters([1])
+                m.solve()
+                ddm.set_solution_store(path, max_bytes=int(1.5*store.nbytes/2))
+                store = ddm.get_solution_store()
+                m.set_model_parameters([.5])
+                m.solve()
+                assert len(store) == 1 and store.nbytes <= store.max_bytes
+                # Parameters which are identified by their address in memory are not stored
+                class DriftFunction(ddm.Drift):
+                    name = "Drift given by a function"
+                    required_parameters = ["f"]
+                    def get_drift(self, t, **kwargs):
+                        return self.f(t)
+                m2 = ddm.Model(drift=DriftFunction(f=lambda t : 1+t), T_dur=1)
+                assert store.key(m2, {}) is None
+                m2.solve()
+                assert len(store) == 1 and (store.hits, store.misses) == (0, 1)
+                store.clear()
+                assert len(store) == 0
+            finally:
+                ddm.set_solution_store(None)
+        assert ddm.get_solution_store() is None
+    def test_pre_overlay_cache(self):
+        """Changing only the overlay reuses the Solution before the overlay"""
+        m = ddm.Model(drift=ddm.DriftLinear(drift=1, x=.5, t=0),
+                      overlay=ddm.OverlayChain(overlays=[ddm.OverlayNonDecision(nondectime=ddm.Fittable(minval=0, maxval=.5)),
+                                                         ddm.OverlayPoissonMixture(pmixturecoef=.05, rate=1)]),
+                      dx=.02, dt=.02, T_dur=1)
+        m.set_model_parameters([.1])
+        conds = [{}]
+        # Disabled by default, like the solution cache
+        assert ddm.get_pre_overlay_cache() is None
+        try:
+            ddm.set_pre_overlay_cache()
+            cache = ddm.get_pre_overlay_cache()
+            ddm.functions.solve_all_conditions(m, condition_combinations=conds)
+            m.set_model_parameters([.3])
+            sol = ddm.functions.solve_all_conditions(m, condition_combinations=conds)[frozenset()]
+            assert (cache.hits, cache.misses) == (1, 1)
+            sol2 = m.solve()
+            assert cache.hits == 2
+            assert sol.model is m and sol.model_parameters == m.parameters()
+            m.get_dependence("drift").drift = 1.5
+            m.solve()
+            assert (cache.hits, cache.misses) == (2, 2)
+            m.get_dependence("drift").drift = 1
+            ddm.set_pre_overlay_cache(None)
+            sol3 = m.solve()
+            assert np.allclose(sol.pdf("correct"), sol3.pdf("correct"))
+            assert np.allclose(sol2.pdf("error"), sol3.pdf("error"))
+        finally:
+            ddm.set_pre_overlay_cache(None)
+    def test_pre_overlay_cache_mutation(self):
+        """Modifying a returned Solution does not change the cached Solution before the overlay"""
+        class OverlayPassThrough(ddm.Overlay):
+            name = "Return the solution unchanged"
+            required_parameters = ["unused"]
+            def apply(self, solution):
+                return solution
+        m = ddm.Model(drift=ddm.DriftLinear(drift=1, x=.5, t=0), overlay=OverlayPassThrough(unused=ddm.Fittable(minval=0, maxval=1)),
+                      dx=.02, dt=.02, T_dur=1)
+        m.set_model_parameters([.1])
+        try:
+            ddm.set_pre_overlay_cache()
+            prob = m.solve().prob("correct")
+            s = m.solve()
+            s.choice_upper[:] = 0
+            m.set_model_parameters([.2])
+            assert np.isclose(m.solve().prob("correct"), prob)
+            assert ddm.get_pre_overlay_cache().hits >= 2
+        finally:
+            ddm.set_pre_overlay_cache(None)
+    def test_overlay_only_conditions(self):
+        """Conditions used only by the overlay do not cause extra solves"""
+        class DriftCond(ddm.Drift):
+            name = "Drift depends on condition"
+            required_conditions = ["coh"]
+            required_parameters = ["scale"]
+            def get_drift(self, conditions, **kwargs):
+                return self.scale * conditions["coh"]
+        class MixtureSide(ddm.Overlay):
+            name = "Rescale the response time distribution depending on side"
+            required_conditions = ["side"]
+            required_parameters = ["coef"]
+            def apply(self, solution):
+                w = 1 - self.coef*solution.conditions["side"]
+                return ddm.Solution(solution.choice_upper*w, solution.choice_lower*w, solution.model,
+                                    solution.conditions, pdf_undec=solution.undec)
+        m = ddm.Model(drift=DriftCond(scale=1), overlay=MixtureSide(coef=.2),
+                      noise=ddm.NoiseLinear(noise=1, x=0, t=.1), dx=.02, dt=.02, T_dur=1)
+        conds = [{"coh": c, "side": s} for c in [0, .5, 1] for s in [0, 1]]
+        try:
+            ddm.set_pre_overlay_cache()
+            cache = ddm.get_pre_overlay_cache()
+            sols = ddm.functions.solve_all_conditions(m, condition_combinations=conds)
+            assert (cache.hits, cache.misses, len(cache)) == (0, 3, 3)
+            assert len(sols) == 6
+            ddm.set_pre_overlay_cache(None)
+            for c in conds:
+                sol = sols[frozenset(c.items())]
+                assert sol.conditions == c
+                assert np.allclose(sol.pdf("correct"), m.solve(conditions=c).pdf("correct"))
+            # Same results without the cache
+            sols2 = ddm.functions.solve_all_conditions(m, condition_combinations=conds)
+            assert all(np.allclose(sols[k].pdf("error"), sols2[k].pdf("error")) for k in sols.keys())
+        finally:
+            ddm.set_pre_overlay_cache(None)
+    def test_spectral(self):
+        """Spectral solver agrees with the analytical and implicit solvers"""
+        m = ddm.Model(drift=ddm.DriftConstant(drift=1.5), T_dur=2)
+        s_spec = m.solve_numerical_spectral()
+        s_an = m.solve_analytical()
+        assert np.all(np.abs(s_spec.pdf("_top")[1:] - s_an.pdf("_top")[1:]) < .05)
+        assert np.abs(s_spec.prob("_bottom") - s_an.prob("_bottom")) < 1e-3
+        # Leaky integrator with an off-center IC, compared to a fine timestep
+        m = ddm.Model(drift=ddm.DriftLinear(drift=.5, x=-1, t=0), IC=ddm.ICPoint(x0=.2), dt=.01, T_dur=2)
+        m_fine = ddm.Model(drift=ddm.DriftLinear(drift=.5, x=-1, t=0), IC=ddm.ICPoint(x0=.2), dt=.0005, T_dur=2)
+        s_spec = m.solve_numerical(method="spectral")
+        s_fine = m_fine.solve_numerical_implicit()
+        fine_top = np.add.reduceat(s_fine.pdf("_top")[1:], np.arange(0, 4000, 20))/20
+        assert np.all(np.abs(s_spec.pdf("_top")[1:] - fine_top) < .01)
+        assert np.isclose(s_spec.prob_undecided(), s_fine.prob_undecided(), atol=1e-4)
+        # Older versions of scipy without eigh_tridiagonal use the dense eigendecomposition
+        import scipy.linalg
+        eigh_tridiagonal = scipy.linalg.eigh_tridiagonal
+        try:
+            del scipy.linalg.eigh_tridiagonal
+            s_dense = m.solve_numerical(method="spectral")
+        finally:
+            scipy.linalg.eigh_tridiagonal = eigh_tridiagonal
+        assert np.allclose(s_spec.pdf("_top"), s_dense.pdf("_top"))
+        assert np.isclose(s_spec.prob_undecided(), s_dense.prob_undecided())
+        # Spectral solver requires time-invariant models
+        fails(lambda : ddm.Model(bound=ddm.BoundCollapsingLinear(B=1, t=.5)).solve_numerical_spectral())
+    def test_graded(self):
+        """Non-uniform grid agrees with the uniform grid using fewer points"""
+        # With constant spacing, the non-uniform matrices match the uniform ones
+        m = ddm.Model(drift=ddm.DriftLinear(drift=.5, x=-1, t=0), noise=ddm.NoiseConstant(noise=.8))
+        x = m.x_domain({})
+        for dep in [m.get_dependence("drift"), m.get_dependence("noise")]:
+            uniform = dep.get_matrix(x=x, t=0, dx=m.dx, dt=m.dt, conditions={}, implicit=True).to_scipy_sparse().toarray()
+            graded = dep.get_matrix(x=x, t=0, dx=m.dx*np.ones(len(x)-1), dt=m.dt, conditions={}, implicit=True).to_scipy_sparse().toarray()
+            assert np.allclose(uniform, graded)
+        for ic in [ddm.ICPointSourceCenter(), ddm.ICPoint(x0=.3), ddm.ICRange(sz=.3)]:
+            m = ddm.Model(drift=ddm.DriftLinear(drift=1, x=.8, t=.3), IC=ic, dx=.005, dt=.005, T_dur=2)
+            assert len(m.x_domain_graded({})) < len(m.x_domain({}))/4
+            s_uniform = m.solve_numerical_implicit(force_python=True)
+            s_graded = m.solve_numerical(method="graded")
+            assert np.all(np.abs(s_graded.pdf("_top") - s_uniform.pdf("_top")) < .02)
+            assert np.all(np.abs(s_graded.pdf("_bottom") - s_uniform.pdf("_bottom")) < .02)
+            assert np.isclose(s_graded.prob("_top"), s_uniform.prob("_top"), atol=1e-3)
+            # The C solver matches the Python solver
+            s_python = m.solve_numerical_graded(force_python=True)
+            assert np.allclose(s_graded.pdf("_top"), s_python.pdf("_top"))
+            assert np.allclose(s_graded.pdf("_bottom"), s_python.pdf("_bottom"))
+            assert np.allclose(s_graded.undec, s_python.undec)
+        fails(lambda : ddm.Model(bound=ddm.BoundCollapsingLinear(B=1, t=.5)).solve_numerical_graded())
+
+    def test_lookup(self):
+        """Lookup tables give approximately the analytical solution"""
+        import tempfile
+        with tempfile.TemporaryDirectory() as path:
+            table = ddm.LookupTable.build(path, max_drift=10, n_drift=41, n_shift=21, n_time=200)
+            assert np.all(ddm.LookupTable(path).table == table.table)
+            m = ddm.Model(drift=ddm.DriftConstant(drift=1.2), noise=ddm.NoiseConstant(noise=.9),
+                          bound=ddm.BoundConstant(B=.8), IC=ddm.ICPoint(x0=.2),
+                          overlay=ddm.OverlayNonDecision(nondectime=.1), dt=.005, dx=.005, T_dur=2)
+            self.assertRaises(ValueError, m.solve_lookup)
+            try:
+                ddm.set_lookup_table(path)
+                sol = m.solve_lookup()
+                sol_anal = m.solve_analytical()
+                assert np.isclose(sol.prob("correct"), sol_anal.prob("correct"), atol=.005)
+                assert np.isclose(sol.mean_decision_time(), sol_anal.mean_decision_time(), atol=.01)
+                assert np.max(np.abs(sol.pdf("error") - sol_anal.pdf("error"))) < .05*np.max(sol_anal.pdf("error"))
+                samp = sol_anal.resample(1000, seed=0)
+                assert np.isclose(ddm.get_model_loss(m, samp, method="lookup"), ddm.get_model_loss(m, samp, method="analytical"), rtol=.01)
+                # Parameters outside of the table
+                m.get_dependence("drift").drift = 20
+                self.assertRaises(ValueError, m.solve_lookup)
+            finally:
+                ddm.set_lookup_table(None)
+    def test_surrogate(self):
+        """Surrogates approximate the model and can be refined with the exact solver"""
+        m = ddm.Model(drift=ddm.DriftConstant(drift=ddm.Fittable(minval=0, maxval=2)),
+                      bound=ddm.BoundCollapsingLinear(B=1, t=ddm.Fittable(minval=0, maxval=1)),
+                      overlay=ddm.OverlayNonDecision(nondectime=.1), dt=.01, dx=.01, T_dur=2)
+        self.assertRaises(ValueError, m.solve_surrogate)
+        surrogate = ddm.Surrogate(m, n_samples=40)
+        # Exact at the points used to build it
+        params = surrogate._unscale(surrogate.points[3])
+        m.set_model_parameters(list(params))
+        try:
+            ddm.set_surrogate(surrogate)
+            assert np.allclose(m.solve_surrogate().pdf("correct"), m.solve().pdf("correct"))
+            m.set_model_parameters([1.1, .45])
+            sol = m.solve_surrogate()
+            sol_exact = m.solve()
+            assert np.isclose(sol.prob("correct"), sol_exact.prob("correct"), atol=.01)
+            assert np.isclose(sol.mean_decision_time(), sol_exact.mean_decision_time(), atol=.02)
+            samp = sol_exact.resample(500, seed=0)
+            assert np.isclose(ddm.get_model_loss(m, samp, method="surrogate"), ddm.get_model_loss(m, samp), rtol=.01)
+            ddm.fit_adjust_model(samp, m, fitting_method="simplex", method="surrogate", refine=True, verbose=False)
+            assert m.fitresult.method == "auto"
+            assert np.isclose(m.fitresult.value(), ddm.get_model_loss(m, samp))
+        finally:
+            ddm.set_surrogate(None)
+    def test_likelihood_counts(self):
+        """The likelihood from histograms matches the likelihood of each trial"""
+        m = ddm.Model(drift=ddm.DriftConstant(drift=1), overlay=ddm.OverlayNonDecision(nondectime=.2), dx=.01, dt=.01, T_dur=2)
+        sol = m.solve()
+        samp = sol.resample(1000, seed=0)
+        loglikelihood = np.sum(np.log([sol.evaluate(rt, "_top") for rt in samp.choice_upper])) + \
+                        np.sum(np.log([sol.evaluate(rt, "_bottom") for rt in samp.choice_lower]))
+        assert np.isclose(ddm.LossLikelihood(samp, dt=m.dt, T_dur=m.T_dur).loss(m), -loglikelihood)
+    def test_likelihood_horizons(self):
+        """Solving only until the last response time does not change the likelihood"""
+        m = ddm.Model(drift=ddm.DriftConstant(drift=2), bound=ddm.BoundCollapsingLinear(B=1, t=.3),
+                      overlay=ddm.OverlayNonDecision(nondectime=.2), dx=.01, dt=.01, T_dur=5)
+        samp = m.solve().resample(200, seed=0)
+        lf = ddm.LossLikelihood(samp, dt=m.dt, T_dur=m.T_dur)
+        horizon = lf.horizons[frozenset()]
+        assert horizon == max(samp.choice_upper.max(), samp.choice_lower.max())
+        sol = ddm.functions.solve_all_conditions(m, samp, horizons=lf.horizons)[frozenset()]
+        assert len(sol.choice_upper) == len(m.t_domain())
+        assert np.all(sol.choice_upper[m.t_domain() > horizon + .6] == 0)
+        assert sol.prob_undecided() > m.solve().prob_undecided()
+        for method in [None, "implicit"]:
+            lf.method = method
+            loss = lf.loss(m)
+            lf.horizons = None
+            assert np.isclose(loss, lf.loss(m))
+            lf.setup(dt=m.dt, T_dur=m.T_dur)
+        # Subclasses which redefine apply may depend on the whole pdf
+        class OverlayNonDecisionLateMixture(ddm.OverlayNonDecision):
+            def apply(self, solution):
+                solution = ddm.OverlayNonDecision.apply(self, solution)
+                n = len(solution.choice_upper)
+                w = np.sum(solution.choice_upper[n//2:]) # Mixture coefficient is the probability of late responses
+                total = np.sum(solution.choice_upper) + np.sum(solution.choice_lower)
+                return solution._derive(solution.choice_upper*(1-w) + .5*w*total/n, solution.choice_lower*(1-w) + .5*w*total/n,
+                                        solution.undec, solution.evolution)
+        m = ddm.Model(drift=ddm.DriftConstant(drift=2), bound=ddm.BoundCollapsingLinear(B=1, t=.3),
+                      overlay=OverlayNonDecisionLateMixture(nondectime=.2), dx=.01, dt=.01, T_dur=5)
+        lf = ddm.LossLikelihood(samp, dt=m.dt, T_dur=m.T_dur)
+        assert ddm.functions._horizon_steps(m, {}, lf.horizons[frozenset()]) == len(m.t_domain()) - 1
+        loss = lf.loss(m)
+        lf.horizons = None
+        assert np.isclose(loss, lf.loss(m))
+    def test_likelihood_c(self):
+        """The likelihood computed entirely in C matches the likelihood from Solutions"""
+        # Both the implicit (collapsing bounds) and Crank-Nicolson (constant
+        # bounds) solvers, with a nondecision time which is not a multiple
+        # of dt.
+        overlay = ddm.OverlayChain(overlays=[ddm.OverlayNonDecision(nondectime=.234), ddm.OverlayUniformMixture(umixturecoef=.05)])
+        for bound in [ddm.BoundCollapsingExponential(B=1, tau=1), ddm.BoundConstant(B=1)]:
+            m = ddm.Model(drift=ddm.DriftLinear(drift=1, x=.5, t=0), bound=bound,
+                          overlay=overlay, dx=.01, dt=.01, T_dur=3)
+            samp = m.solve().resample(500, seed=0)
+            for lossfunction in [ddm.LossLikelihood, ddm.LossRobustLikelihood]:
+                lf = lossfunction(samp, dt=m.dt, T_dur=m.T_dur)
+                assert lf._loglikelihood_c(m) is not None
+                loss = lf.loss(m)
+                # Likelihood from the overlays applied to the Solution
+                sol = m.solve()
+                loglikelihood = 0
+                for choice,rts in [("_top", samp.choice_upper), ("_bottom", samp.choice_lower)]:
+                    inds = np.rint(rts/m.dt).astype(int)
+                    loglikelihood += np.sum(np.log(sol.pdf(choice)[inds] + lf._robustness_param))
+                assert np.isclose(loss, -loglikelihood)
+                # The Solutions are used if they are cached
+                try:
+                    ddm.set_solution_cache()
+                    assert lf._loglikelihood_c(m) is None
+                    assert np.isclose(loss, lf.loss(m))
+                finally:
+                    ddm.set_solution_cache(None)
+        # Models with analytical solutions are not solved numerically
+        m = ddm.Model(drift=ddm.DriftConstant(drift=1), overlay=overlay, dx=.01, dt=.01, T_dur=3)
+        assert ddm.LossLikelihood(samp, dt=m.dt, T_dur=m.T_dur)._loglikelihood_c(m) is None
+        assert ddm.LossLikelihood(samp, dt=m.dt, T_dur=m.T_dur, method="cn")._loglikelihood_c(m) is not None
+        # Other overlays, or overlays in a different order, use the Solutions
+        m = ddm.Model(drift=ddm.DriftConstant(drift=1), bound=ddm.BoundCollapsingExponential(B=1, tau=1),
+                      overlay=ddm.OverlayChain(overlays=overlay.overlays[::-1]), dx=.01, dt=.01, T_dur=3)
+        assert lf._loglikelihood_c(m) is None
+    def test_loss_gradient(self):
+        """The adjoint gradient of the loss matches finite differences, and can be used for fitting"""
+        m = ddm.Model(drift=ddm.DriftLinear(drift=ddm.Fittable(minval=0, maxval=3), x=ddm.Fittable(minval=-1, maxval=1), t=0),
+                      noise=ddm.NoiseConstant(noise=ddm.Fittable(minval=.5, maxval=2)),
+                      bound=ddm.BoundCollapsingExponential(B=1, tau=ddm.Fittable(minval=.5, maxval=3)),
+                      overlay=ddm.OverlayChain(overlays=[ddm.OverlayNonDecision(nondectime=.2),
+                                                         ddm.OverlayUniformMixture(umixturecoef=ddm.Fittable(minval=0, maxval=.1))]),
+                      dx=.01, dt=.01, T_dur=2)
+        m.set_model_parameters([1, .5, 1.2, 1.5, .05])
+        samp = m.solve().resample(500, seed=0)
+        loss, gradient = ddm.get_model_loss_gradient(m, samp)
+        assert np.isclose(loss, ddm.get_model_loss(m, samp, method="implicit"))
+        x = [float(p) for p in m.get_model_parameters()]
+        for i,h in [(0, 1e-5), (1, 1e-5), (2, 1e-5), (4, 1e-5)]:
+            m.set_model_parameters(x[:i] + [x[i]+h] + x[i+1:])
+            loss_high = ddm.get_model_loss_gradient(m, samp)[0]
+            m.set_model_parameters(x[:i] + [x[i]-h] + x[i+1:])
+            loss_low = ddm.get_model_loss_gradient(m, samp)[0]
+            assert np.isclose(gradient[i], (loss_high-loss_low)/(2*h), rtol=1e-4)
+        m.set_model_parameters(x)
+        # Unsupported loss functions
+        with self.assertRaises(NotImplementedError):
+            ddm.get_model_loss_gradient(m, samp, lossfunction=ddm.LossSquaredError)
+        # Fitting starting away from the best parameters
+        m_fit = ddm.Model(drift=ddm.DriftConstant(drift=ddm.Fittable(minval=0, maxval=3, default=.5)),
+                          overlay=ddm.OverlayNonDecision(nondectime=ddm.Fittable(minval=0, maxval=.5, default=.1)),
+                          dx=.01, dt=.01, T_dur=2)
+        samp = ddm.Model(drift=ddm.DriftConstant(drift=1.5), overlay=ddm.OverlayNonDecision(nondectime=.2),
+                         dx=.01, dt=.01, T_dur=2).solve().resample(2000, seed=0)
+        ddm.fit_adjust_model(samp, m_fit, fitting_method="lbfgs", verbose=False)
+        assert abs(m_fit.get_model_parameters()[0] - 1.5) < .15
+        assert abs(m_fit.get_model_parameters()[1] - .2) < .03
+    def test_quantile_losses(self):
+        """Quantile losses are smallest near the parameters which generated the data"""
+        m = ddm.Model(drift=ddm.DriftConstant(drift=1), overlay=ddm.OverlayNonDecision(nondectime=.2), dx=.01, dt=.01, T_dur=3)
+        samp = m.solve().resample(5000, seed=0)
+        m_other = ddm.Model(drift=ddm.DriftConstant(drift=1.5), overlay=ddm.OverlayNonDecision(nondectime=.2), dx=.01, dt=.01, T_dur=3)
+        losses = {}
+        for lossfunction in [ddm.LossQuantileChiSquare, ddm.LossQuantileG2]:
+            lf = lossfunction(samp, dt=m.dt, T_dur=m.T_dur)
+            quantiles_upper, quantiles_lower, counts = lf.bins[frozenset()]
+            assert len(quantiles_upper) == len(quantiles_lower) == 5
+            assert np.sum(counts) == len(samp)
+            probs,_ = lf.bin_probabilities(m)[frozenset()]
+            assert np.isclose(np.sum(probs), 1)
+            losses[lossfunction] = lf.loss(m)
+            assert 0 <= losses[lossfunction] < lf.loss(m_other)
+        # The statistics are approximately equal for good fits
+        assert np.isclose(losses[ddm.LossQuantileChiSquare], losses[ddm.LossQuantileG2], rtol=.2)
+        # Choices with few trials are not divided into bins
+        lf = ddm.LossQuantileChiSquare(samp, dt=m.dt, T_dur=m.T_dur)
+        lf.min_trials = 10000
+        lf.setup(dt=m.dt, T_dur=m.T_dur)
+        assert len(lf.bins[frozenset()][2]) == 3
+    def test_fit_evaluation_memo(self):
+        """Repeated and clipped parameters are only evaluated once when fitting"""
+        m = ddm.Model(drift=ddm.DriftConstant(drift=ddm.Fittable(minval=0, maxval=2)), dx=.01, dt=.01, T_dur=2)
+        samp = ddm.Model(drift=ddm.DriftConstant(drift=1), dx=.01, dt=.01, T_dur=2).solve().resample(200, seed=0)
+        def fitting_method(f, x_0, constraints):
+            losses = [f([1.]), f([1.]), f([2.]), f([2.0000001]), f([.5])]
+            assert losses[0] == losses[1] and losses[2] == losses[3]
+            return scipy.optimize.OptimizeResult(x=[1.], fun=losses[0])
+        ddm.fit_adjust_model(samp, m, fitting_method=fitting_method, verbose=False)
+        assert m.fitresult.properties["evaluations"] == 5
+        assert m.fitresult.properties["duplicate_evaluations"] == 2
+    def test_simulated_solution(self):
+        """Simulated trials match the solved distribution"""
+        m = ddm.Model(drift=ddm.DriftLinear(drift=1, x=.5, t=0), bound=ddm.BoundCollapsingLinear(B=1, t=.3),
+                      overlay=ddm.OverlayNonDecision(nondectime=.2), dt=.005, T_dur=2)
+        samp = m.simulated_solution(size=20000, seed=1)
+        sol = m.solve()
+        assert len(samp) == 20000
+        assert np.isclose(samp.prob("_top"), sol.prob("_top"), atol=.03)
+        assert np.isclose(np.mean(samp.choice_upper), np.sum(sol.pdf("_top")*m.t_domain())/np.sum(sol.pdf("_top")), atol=.05)
+        assert np.min(np.concatenate([samp.choice_upper, samp.choice_lower])) > .2
+        # Overlays which only support single trajectories are simulated one trial at a time
+        class OverlayTrajectoryOnly(ddm.Overlay):
+            name = "Trajectory-only overlay"
+            required_parameters = []
+            def apply(self, solution):
+                return solution
+            def apply_trajectory(self, trajectory, **kwargs):
+                return trajectory
+        assert len(ddm.Model(overlay=OverlayTrajectoryOnly(), T_dur=1).simulated_solution(size=20)) == 20
+        # Subclasses which redefine apply_trajectory use their own mechanism
+        class OverlayDoubleNonDecision(ddm.OverlayNonDecision):
+            def apply_trajectory(self, trajectory, model, **kwargs):
+                shift = int(2*self.nondectime/model.dt)
+                return np.append([trajectory[0]]*shift, trajectory)
+        m = ddm.Model(drift=ddm.DriftConstant(drift=1), overlay=OverlayDoubleNonDecision(nondectime=.2), dt=.005, T_dur=2)
+        samp = m.simulated_solution(size=200, seed=1)
+        assert np.min(np.concatenate([samp.choice_upper, samp.choice_lower])) > .4
+
 class TestCSolver(TestCase):
     def test_numerical(self):
         assert ddm.model.HAS_CSOLVE, "C extension build failed"
@@ -835,6 +1404,123 @@ class TestCSolver(TestCase):
             s2 = m.solve_analytical(force_python=False)
             assert np.all(np.isclose(s1.pdf("_top"), s2.pdf("_top"), atol=1e-3, rtol=1e-3)), "Testing model id " + str(i)
             assert np.all(np.isclose(s1.pdf("_bottom"), s2.pdf("_bottom"), atol=1e-3, rtol=1e-3)), "Testing model id " + str(i)
+    def test_cn(self):
+        """The C and Python Crank-Nicolson solvers give the same results"""
+        models = [
+            ddm.Model(),
+            ddm.Model(drift=ddm.DriftLinear(x=0, t=.5, drift=0)),
+            ddm.Model(drift=ddm.DriftLinear(x=.5, t=.5, drift=.2), IC=ddm.ICPoint(x0=.3)),
+            ddm.Model(noise=ddm.NoiseLinear(x=-.2, t=.2, noise=.6), IC=ddm.ICUniform()),
+            ddm.Model(IC=ddm.ICPointRatio(x0=.8), bound=ddm.BoundConstant(B=.3)),
+            ]
+        for i,m in enumerate(models):
+            s1 = m.solve_numerical_cn(force_python=True)
+            s2 = m.solve_numerical_cn()
+            assert np.all(np.isclose(s1.pdf("_top"), s2.pdf("_top"), atol=1e-8)), "Testing model id " + str(i)
+            assert np.all(np.isclose(s1.pdf("_bottom"), s2.pdf("_bottom"), atol=1e-8)), "Testing model id " + str(i)
+            if not m.has_analytical_solution():
+                s3 = m.solve()
+                assert np.all(s2.pdf("_top") == s3.pdf("_top"))
+        # Collapsing bounds are not supported
+        fails(lambda : ddm.csolve.cn_time(np.asarray([0.]), 0, np.asarray([1.]), 0, np.asarray([1., .9]), 1, ddm.Model().IC({}), 2., .005, .005, 401))
+    def test_trbdf2(self):
+        """The C and Python TR-BDF2 solvers agree, and converge faster than backward Euler"""
+        models = [
+            ddm.Model(),
+            ddm.Model(drift=ddm.DriftLinear(x=.5, t=.5, drift=.2), IC=ddm.ICPoint(x0=.3)),
+            ddm.Model(noise=ddm.NoiseLinear(x=0, t=.2, noise=.6), IC=ddm.ICUniform()),
+            ddm.Model(bound=ddm.BoundCollapsingExponential(B=1.5, tau=1), T_dur=3),
+            ddm.Model(drift=ddm.DriftLinear(x=.5, t=.5, drift=.2), bound=ddm.BoundCollapsingLinear(B=1, t=.4), T_dur=3),
+            ]
+        for i,m in enumerate(models):
+            s1 = m.solve_numerical_trbdf2(force_python=True)
+            s2 = m.solve_numerical_trbdf2()
+            assert np.all(np.isclose(s1.pdf("_top"), s2.pdf("_top"), atol=1e-8)), "Testing model id " + str(i)
+            assert np.all(np.isclose(s1.pdf("_bottom"), s2.pdf("_bottom"), atol=1e-8)), "Testing model id " + str(i)
+            assert np.all(np.isclose(s1.pdf_undec(), s2.pdf_undec(), atol=1e-8)), "Testing model id " + str(i)
+        # Compare to the spectral solver, which has no error from the timestep
+        mk = lambda dt : ddm.Model(drift=ddm.DriftConstant(drift=1), IC=ddm.ICPoint(x0=.3), dt=dt, T_dur=2)
+        exact = mk(.005).solve_numerical_spectral().cdf("_top")[::4]
+        err_trbdf2 = np.max(np.abs(mk(.02).solve_numerical(method="trbdf2").cdf("_top") - exact))
+        err_implicit = np.max(np.abs(mk(.02).solve_numerical_implicit().cdf("_top") - exact))
+        assert err_trbdf2 < 1e-3
+        assert err_trbdf2 < err_implicit/10
+        # The evolution is available
+        s = models[0].solve_numerical(method="trbdf2", return_evolution=True)
+        assert s.pdf_evolution().shape == (len(models[0].x_domain({})), len(models[0].t_domain()))
+        assert np.all(np.isclose(s.pdf_evolution()[:,-1], s.pdf_undec()))
+    def test_adaptive(self):
+        """The C and Python adaptive solvers agree, and approximate the implicit solver"""
+        models = [
+            ddm.Model(T_dur=5),
+            ddm.Model(drift=ddm.DriftLinear(x=-.5, t=.5, drift=.2), IC=ddm.ICPoint(x0=.3), T_dur=5),
+            ddm.Model(noise=ddm.NoiseLinear(x=0, t=.2, noise=.6), IC=ddm.ICUniform()),
+            ddm.Model(bound=ddm.BoundCollapsingExponential(B=1.5, tau=2), T_dur=5),
+            ]
+        for i,m in enumerate(models):
+            s1 = m.solve_numerical_adaptive(force_python=True)
+            s2 = m.solve_numerical_adaptive()
+            assert np.all(np.isclose(s1.pdf("_top"), s2.pdf("_top"), atol=1e-8)), "Testing model id " + str(i)
+            assert np.all(np.isclose(s1.pdf("_bottom"), s2.pdf("_bottom"), atol=1e-8)), "Testing model id " + str(i)
+            s3 = m.solve_numerical_implicit()
+            assert np.all(np.isclose(s2.cdf("_top"), s3.cdf("_top"), atol=1e-3)), "Testing model id " + str(i)
+            assert np.isclose(s2.prob_undecided(), s3.prob_undecided(), atol=1e-3), "Testing model id " + str(i)
+        # A very small tolerance only takes steps of size dt.  (It may
+        # take one extra step before stopping when the remaining
+        # probability is negligible.)
+        s4 = models[1].solve_numerical_adaptive(tol=1e-8)
+        assert np.all(np.isclose(s4.pdf("_top"), models[1].solve_numerical_implicit().pdf("_top"), atol=1e-3))
+        assert np.isclose(s4.prob("_top"), models[1].solve_numerical_implicit().prob("_top"), atol=1e-5)
+    def test_batch(self):
+        """Solving many conditions at once gives the same results as solving each one"""
+        class DriftCond(ddm.Drift):
+            name = "Drift depends on condition and time"
+            required_conditions = ["coh"]
+            required_parameters = []
+            def get_drift(self, t, conditions, **kwargs):
+                return conditions["coh"] * (1 + t)
+        class BoundCond(ddm.Bound):
+            name = "Bound depends on condition"
+            required_conditions = ["B"]
+            required_parameters = []
+            def get_bound(self, t, conditions, **kwargs):
+                return conditions["B"] * np.exp(-t)
+        m = ddm.Model(drift=DriftCond(), bound=BoundCond(), IC=ddm.ICPoint(x0=.1),
+                      overlay=ddm.OverlayNonDecision(nondectime=.1), T_dur=1)
+        conds = [{"coh": c, "B": B} for c in [0, .5, 1] for B in [.5, 1, 1.3]]
+        sols = m.solve_batch(conds)
+        assert len(sols) == len(conds)
+        for c in conds:
+            s1 = m.solve_numerical_c(conditions=c)
+            s2 = sols[frozenset(c.items())]
+            assert s2.conditions == c
+            assert np.all(s1.choice_upper == s2.choice_upper)
+            assert np.all(s1.choice_lower == s2.choice_lower)
+            assert np.all(s1.undec == s2.undec)
+        assert ddm.functions.solve_all_conditions(m, condition_combinations=conds).keys() == sols.keys()
+    def test_thread_backend(self):
+        """Solving conditions in parallel threads gives the same results"""
+        class DriftCond(ddm.Drift):
+            name = "Drift depends on condition"
+            required_conditions = ["coh"]
+            required_parameters = []
+            def get_drift(self, conditions, **kwargs):
+                return conditions["coh"]
+        m = ddm.Model(drift=DriftCond(), bound=ddm.BoundCollapsingExponential(B=1, tau=1), T_dur=2)
+        conds = [{"coh": c} for c in [0, .2, .4, .6, .8]]
+        serial = ddm.functions.solve_all_conditions(m, condition_combinations=conds)
+        serial_tr = ddm.functions.solve_all_conditions(m, condition_combinations=conds, method="trbdf2")
+        try:
+            ddm.set_N_cpus(2, backend="thread")
+            threaded = ddm.functions.solve_all_conditions(m, condition_combinations=conds)
+            threaded_tr = ddm.functions.solve_all_conditions(m, condition_combinations=conds, method="trbdf2")
+        finally:
+            ddm.set_N_cpus(1)
+        assert serial.keys() == threaded.keys() == threaded_tr.keys()
+        for k in serial.keys():
+            assert np.all(serial[k].choice_upper == threaded[k].choice_upper)
+            assert np.all(serial_tr[k].choice_upper == threaded_tr[k].choice_upper)
+        fails(lambda : ddm.set_N_cpus(2, backend="invalid"))
 
 
 